@@ -0,0 +1,626 @@
+# End-to-end latency benchmark for the Insight server.
+#
+# Starts the rover and SIYI stand-ins from sim.py in this process, launches
+# server.py against them (synthetic camera, mock servo), then drives it the
+# way browsers do: gamepad tabs emitting `control` and `joystick_command` at
+# 60 Hz over Socket.IO, and viewers pulling /video_feed. Each scenario reports
+# p50/p99 latency, throughput, drops and server CPU as JSON so runs can be
+# diffed between releases.
+#
+#   pip install "python-socketio[client]"
+#   python bench.py                              # all scenarios, JSON on stdout
+#   python bench.py -s control -s video --duration 20 -o results.json
+#   python bench.py --server ../old-checkout/server.py -o old.json
+#   python bench.py --fleet 4 --viewers 8         # fleet gateway over 4 sim rovers
+#
+# Latencies:
+#   control  socket.io emit -> JSON line read from the rover pty
+#   gimbal   socket.io emit -> 0x07 speed packet received by the SIYI emulator
+#   video    frame generated by the camera source -> parsed by the viewer
+# Setpoints are encoded in the values themselves, so each command that reaches
+# the hardware side can be matched to the emit it came from. Both control
+# paths are latest-wins at `control_rate_hz`/`gimbal_speed_rate_hz`, so most
+# 60 Hz setpoints are superseded by design; "coalesced" counts those, while
+# "stale" counts commands that could not be matched to any emit.
+#
+# --fleet N runs N such servers as rovers behind one more server.py in fleet
+# gateway mode, with --viewers browsers on its fleet_update stream. It reports
+# the updates and bytes each browser receives and the Socket.IO clients and
+# HTTP polls each rover serves, which should not grow with N or the browsers.
+
+import argparse
+import bisect
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import sim
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    # name: (gamepad tabs, viewers)
+    'idle': (0, 0),
+    'control': (1, 0),
+    'control-multi': (3, 0),
+    'video': (0, 4),
+    'mixed': (2, 4),
+}
+MAX_TABS = 9 # Tab ids are encoded in the setpoint values
+
+def percentile(values, q):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+def summarize(latencies):
+    """Latency list in seconds -> dict in milliseconds."""
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'count': len(latencies),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(max(latencies) if latencies else None),
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# --- Server process ---
+class ProcessSampler:
+    """CPU time and RSS of one process from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK')
+
+    def cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks # utime + stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_mb(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+
+class BenchServer:
+    """server.py wired to in-process emulators through a throwaway config."""
+
+    def __init__(self, server_script, imu_rate, fps, frame_bytes):
+        self.server_script = server_script
+        self.rover = sim.RoverEmulator(imu_rate).start()
+        self.gimbal = sim.SiyiEmulator().start()
+        self.workdir = tempfile.mkdtemp(prefix='insight-bench-')
+        self.port = free_port()
+        self.config = {
+            'camera_mode': 'siyi', # joystick_command only drives the gimbal in siyi mode
+            'serial_backend': 'hw', 'serial_port': self.rover.port,
+            'gimbal_backend': 'hw', 'gimbal_ip': self.gimbal.host, 'gimbal_port': self.gimbal.port,
+            'camera_backend': 'sim', 'sim_camera_fps': fps, 'sim_frame_bytes': frame_bytes,
+            'servo_backend': 'mock',
+            'recorder_dir': os.path.join(self.workdir, 'recordings'),
+            'http_port': self.port,
+        }
+        self.process = None
+        self.sampler = None
+
+    def start(self, timeout=60):
+        config_path = os.path.join(self.workdir, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump(self.config, f)
+        self.log = open(os.path.join(self.workdir, 'server.out'), 'wb')
+        env = dict(os.environ, INSIGHT_CONFIG=config_path, PYTHONUNBUFFERED='1')
+        self.process = subprocess.Popen([sys.executable, self.server_script], cwd=self.workdir,
+                                        env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.sampler = ProcessSampler(self.process.pid)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with {self.process.returncode}:\n{self.output_tail()}")
+            try:
+                self.get_json('/api/stream', timeout=1)
+                return self
+            except (OSError, http.client.HTTPException, ValueError):
+                time.sleep(0.5)
+        raise RuntimeError(f"server not ready after {timeout}s:\n{self.output_tail()}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try: self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def output_tail(self, lines=30):
+        self.log.flush()
+        with open(self.log.name, 'rb') as f:
+            return b'\n'.join(f.read().splitlines()[-lines:]).decode(errors='replace')
+
+    def get(self, path, timeout=5):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            if resp.status != 200: raise ValueError(f"{path}: HTTP {resp.status}")
+            return resp.read()
+        finally:
+            conn.close()
+
+    def get_json(self, path, timeout=5):
+        return json.loads(self.get(path, timeout))
+
+    def socket_clients(self):
+        """Connected Socket.IO clients, from /metrics."""
+        return self.get('/metrics').count(b'insight_socketio_queue_depth{')
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+class GatewayServer(BenchServer):
+    """server.py in fleet gateway mode in front of `rovers` (BenchServers)."""
+
+    def __init__(self, server_script, rovers):
+        self.server_script = server_script
+        self.rover = self.gimbal = None
+        self.workdir = tempfile.mkdtemp(prefix='insight-gateway-')
+        self.port = free_port()
+        self.config = {
+            'fleet_rovers': {f'rover{i}': rover.url for i, rover in enumerate(rovers)},
+            'servo_backend': 'mock',
+            'recorder_dir': os.path.join(self.workdir, 'recordings'),
+            'http_port': self.port,
+        }
+        self.process = None
+        self.sampler = None
+
+# --- Synthetic clients ---
+class EmitLog:
+    """Send times per encoded setpoint, shared by all tabs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.count = 0
+
+    def add(self, key, t):
+        with self.lock:
+            self.times.setdefault(key, []).append(t)
+            self.count += 1
+
+    def match(self, key, arrival):
+        """Latest emit of `key` at or before `arrival`, or None."""
+        times = self.times.get(key)
+        if not times: return None
+        i = bisect.bisect_right(times, arrival)
+        return times[i - 1] if i else None
+
+def control_setpoint(tab, seq):
+    """(L, R) unique per tab for 100k frames; both survive the server's 3-decimal rounding."""
+    return (tab * 100 + (seq // 1000) % 100 + 1) / 1000.0, (seq % 1000 + 1) / 1000.0
+
+def control_key(left, right):
+    return round(left * 1000), round(right * 1000)
+
+def joystick_setpoint(tab, seq):
+    """(yaw, pitch) that int(x * 100) on the server maps to unique 1..100 speeds."""
+    return (seq % 100 + 1.5) / 100.0, (tab * 10 + (seq // 100) % 10 + 1.5) / 100.0
+
+def joystick_key(yaw, pitch):
+    return int(yaw * 100), int(pitch * 100)
+
+class GamepadTab(threading.Thread):
+    """One dashboard tab: emits control and joystick_command every frame."""
+
+    def __init__(self, url, tab, rate_hz, stop_event, controls, joysticks):
+        super().__init__(daemon=True)
+        self.url, self.tab, self.rate_hz = url, tab, rate_hz
+        self.stop_event = stop_event
+        self.controls, self.joysticks = controls, joysticks
+        self.emit_errors = 0
+        self.late_frames = 0
+        self.client = socketio.Client(reconnection=False)
+
+    def connect(self):
+        self.client.connect(self.url, transports=['websocket'])
+
+    def run(self):
+        interval = 1.0 / self.rate_hz
+        next_time = time.monotonic()
+        seq = 0
+        try:
+            while not self.stop_event.is_set():
+                left, right = control_setpoint(self.tab, seq)
+                yaw, pitch = joystick_setpoint(self.tab, seq)
+                try:
+                    now = time.time()
+                    self.client.emit('control', {'L': left, 'R': right})
+                    self.controls.add(control_key(left, right), now)
+                    now = time.time()
+                    self.client.emit('joystick_command', {'yaw': yaw, 'pitch': pitch})
+                    self.joysticks.add(joystick_key(yaw, pitch), now)
+                except Exception:
+                    self.emit_errors += 1
+                seq += 1
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.late_frames += 1
+                    if delay < -1.0: next_time = time.monotonic()
+            # Release the sticks like a real tab would
+            self.client.emit('control', {'L': 0, 'R': 0})
+            self.client.emit('joystick_command', {'yaw': 0, 'pitch': 0})
+        except Exception:
+            self.emit_errors += 1
+        finally:
+            time.sleep(0.2)
+            self.client.disconnect()
+
+class Viewer(threading.Thread):
+    """An MJPEG client that parses every part and checks the frame tag."""
+
+    def __init__(self, server, stop_event):
+        super().__init__(daemon=True)
+        self.server = server
+        self.stop_event = stop_event
+        self.latencies = []
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0     # seq gaps: frames the server never sent us
+        self.repeated = 0    # same frame re-sent (idle keepalive)
+        self.untagged = 0
+        self.error = None
+        self.first_frame_s = None
+
+    def run(self):
+        started = time.monotonic()
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=10)
+        last_seq = None
+        try:
+            conn.request('GET', '/video_feed')
+            resp = conn.getresponse()
+            while not self.stop_event.is_set():
+                length = None
+                while True:
+                    line = resp.readline()
+                    if not line: raise EOFError("stream closed")
+                    line = line.strip()
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                    elif not line and length is not None:
+                        break
+                jpeg = resp.read(length)
+                arrival = time.time()
+                self.frames += 1
+                self.bytes += len(jpeg)
+                tag = sim.parse_frame_tag(jpeg)
+                if tag is None:
+                    self.untagged += 1
+                    continue
+                seq, sent = tag
+                if self.first_frame_s is None:
+                    # The first part is the cached latest frame, so it only
+                    # counts towards time-to-first-frame
+                    self.first_frame_s = time.monotonic() - started
+                    last_seq = seq
+                    continue
+                if last_seq is not None:
+                    if seq == last_seq:
+                        self.repeated += 1
+                        continue
+                    if seq > last_seq + 1: self.dropped += seq - last_seq - 1
+                last_seq = seq
+                self.latencies.append(arrival - sent)
+        except Exception as e:
+            if not self.stop_event.is_set(): self.error = repr(e)
+        finally:
+            conn.close()
+
+class FleetBrowser(threading.Thread):
+    """A /fleet page: counts the batched fleet_update messages it receives."""
+
+    def __init__(self, url, stop_event):
+        super().__init__(daemon=True)
+        self.url = url
+        self.stop_event = stop_event
+        self.updates = 0
+        self.rover_entries = 0
+        self.bytes = 0
+        self.rovers = set()
+        self.error = None
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('fleet_update', self.on_update)
+
+    def on_update(self, batch):
+        if batch.get('full'): return # The initial snapshot of the whole fleet
+        self.updates += 1
+        self.rover_entries += len(batch['rovers'])
+        self.rovers.update(batch['rovers'])
+        self.bytes += len(json.dumps(batch))
+
+    def run(self):
+        try:
+            self.client.connect(self.url, transports=['websocket'])
+            self.client.call('fleet_subscribe', {}, timeout=10)
+            self.stop_event.wait()
+        except Exception as e:
+            self.error = repr(e)
+        finally:
+            self.client.disconnect()
+
+# --- Scenarios ---
+def match_commands(commands, since, until, decode, emits):
+    """Matches hardware-side commands received in [since, until] to emits."""
+    latencies, stale, delivered = [], 0, set()
+    for arrival, *payload in list(commands):
+        if not since <= arrival <= until: continue
+        key = decode(*payload)
+        if key is None: continue
+        sent = emits.match(key, arrival)
+        if sent is None:
+            stale += 1
+            continue
+        latencies.append(arrival - sent)
+        delivered.add((key, sent))
+    return latencies, stale, len(delivered)
+
+def decode_rover(line):
+    try: cmd = json.loads(line)
+    except ValueError: return None
+    if not isinstance(cmd, dict) or cmd.get('T') != 1: return None
+    if cmd.get('L', 0) == 0 and cmd.get('R', 0) == 0: return None
+    return control_key(cmd['L'], cmd['R'])
+
+def decode_gimbal(cmd_id, payload):
+    if cmd_id != 0x07 or len(payload) < 2: return None
+    yaw, pitch = payload[0], payload[1]
+    if yaw == 0 and pitch == 0: return None
+    return yaw, pitch
+
+def command_report(emits, latencies, stale, delivered, duration):
+    report = summarize(latencies)
+    report.update({
+        'sent': emits.count,
+        'sent_per_s': round(emits.count / duration, 1),
+        'delivered': delivered,
+        'delivered_per_s': round(delivered / duration, 1),
+        'coalesced': max(0, emits.count - delivered),
+        'stale': stale,
+    })
+    return report
+
+def run_scenario(server, name, tabs, viewers, duration, rate_hz):
+    stop_event = threading.Event()
+    controls, joysticks = EmitLog(), EmitLog()
+    tab_threads = [GamepadTab(server.url, i, rate_hz, stop_event, controls, joysticks) for i in range(tabs)]
+    viewer_threads = [Viewer(server, stop_event) for _ in range(viewers)]
+    for tab in tab_threads: tab.connect()
+
+    cpu_start, wall_start = server.sampler.cpu_seconds(), time.monotonic()
+    since = time.time()
+    for thread in tab_threads + viewer_threads: thread.start()
+    time.sleep(duration)
+    stop_event.set()
+    until = time.time()
+    cpu_end, wall_end = server.sampler.cpu_seconds(), time.monotonic()
+    for thread in tab_threads + viewer_threads: thread.join(timeout=15)
+    time.sleep(0.5) # Let the last commands land before matching
+
+    result = {
+        'scenario': name,
+        'tabs': tabs,
+        'viewers': viewers,
+        'duration_s': round(wall_end - wall_start, 3),
+        'server': {
+            'cpu_percent': round((cpu_end - cpu_start) / (wall_end - wall_start) * 100, 1)
+                           if cpu_start is not None and cpu_end is not None else None,
+            'rss_mb': server.sampler.rss_mb(),
+        },
+    }
+    if tabs:
+        window = (since, until + 1.0)
+        result['control'] = command_report(controls, *match_commands(
+            server.rover.commands, *window, decode_rover, controls), duration)
+        result['gimbal'] = command_report(joysticks, *match_commands(
+            server.gimbal.commands, *window, decode_gimbal, joysticks), duration)
+        result['tab_errors'] = sum(t.emit_errors for t in tab_threads)
+        result['tab_late_frames'] = sum(t.late_frames for t in tab_threads)
+    if viewers:
+        latencies = [l for v in viewer_threads for l in v.latencies]
+        frames = sum(v.frames for v in viewer_threads)
+        video = summarize(latencies)
+        video.update({
+            'frames': frames,
+            'fps_per_viewer': round(frames / viewers / duration, 1),
+            'mbytes_per_s': round(sum(v.bytes for v in viewer_threads) / duration / 1e6, 2),
+            'dropped': sum(v.dropped for v in viewer_threads),
+            'repeated': sum(v.repeated for v in viewer_threads),
+            'untagged': sum(v.untagged for v in viewer_threads),
+            'first_frame_p50_ms': summarize([v.first_frame_s for v in viewer_threads
+                                             if v.first_frame_s is not None])['p50_ms'],
+            'errors': [v.error for v in viewer_threads if v.error],
+        })
+        result['video'] = video
+    return result
+
+def run_fleet(gateway, rovers, browsers, duration):
+    stop_event = threading.Event()
+    threads = [FleetBrowser(gateway.url, stop_event) for _ in range(browsers)]
+    for thread in threads: thread.start()
+    time.sleep(1) # Subscribed, and snapshot polling has started
+    before = gateway.get_json('/api/fleet')['rovers']
+    cpu_start, wall_start = gateway.sampler.cpu_seconds(), time.monotonic()
+    for thread in threads: thread.updates = thread.rover_entries = thread.bytes = 0
+    time.sleep(duration)
+    cpu_end, wall_end = gateway.sampler.cpu_seconds(), time.monotonic()
+    after = gateway.get_json('/api/fleet')['rovers']
+    clients = [rover.socket_clients() for rover in rovers] # With the browsers still on the gateway
+    stop_event.set()
+    for thread in threads: thread.join(timeout=15)
+
+    elapsed = wall_end - wall_start
+    per_s = lambda key: {rover_id: round((after[rover_id]['stats'][key] - before[rover_id]['stats'][key]) / elapsed, 2)
+                         for rover_id in after}
+    updates = sum(t.updates for t in threads)
+    return {
+        'scenario': f'fleet-{len(rovers)}',
+        'rovers': len(rovers),
+        'browsers': browsers,
+        'duration_s': round(elapsed, 3),
+        'server': {
+            'cpu_percent': round((cpu_end - cpu_start) / elapsed * 100, 1)
+                           if cpu_start is not None and cpu_end is not None else None,
+            'rss_mb': gateway.sampler.rss_mb(),
+        },
+        'browser': {
+            'updates_per_s': round(updates / browsers / elapsed, 2) if browsers else None,
+            'rovers_per_update': round(sum(t.rover_entries for t in threads) / updates, 2) if updates else None,
+            'kbytes_per_s': round(sum(t.bytes for t in threads) / browsers / elapsed / 1e3, 2) if browsers else None,
+            'rovers_seen': min((len(t.rovers) for t in threads), default=0),
+            'errors': [t.error for t in threads if t.error],
+        },
+        'rover': {
+            'socket_clients': clients,
+            'telemetry_per_s': per_s('received'),
+            'http_polls_per_s': per_s('requests'),
+            'connected': {rover_id: entry['connected'] for rover_id, entry in after.items()},
+        },
+    }
+
+def git_revision(path):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(result):
+    line = f"{result['scenario']:>14}: cpu {result['server']['cpu_percent']}%"
+    if 'browser' in result:
+        browser, rover = result['browser'], result['rover']
+        line += (f" | {browser['updates_per_s']} updates/s/browser, {browser['kbytes_per_s']} kB/s/browser"
+                 f" | rover clients {max(rover['socket_clients'], default=0)},"
+                 f" polls/s {max(rover['http_polls_per_s'].values(), default=0)}")
+    for path in ('control', 'gimbal', 'video'):
+        if path in result:
+            r = result[path]
+            line += f" | {path} p50 {r['p50_ms']}ms p99 {r['p99_ms']}ms"
+            if path == 'video': line += f" {r['fps_per_viewer']}fps dropped {r['dropped']}"
+            else: line += f" {r['delivered_per_s']}/s stale {r['stale']}"
+    print(line, file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark for the Insight server")
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per scenario")
+    parser.add_argument('--rate', type=float, default=60, help="gamepad emit rate per tab (Hz)")
+    parser.add_argument('--tabs', type=int, help="override gamepad tabs for every scenario that has any")
+    parser.add_argument('--viewers', type=int, help="override viewers for every scenario that has any")
+    parser.add_argument('--fps', type=float, default=30, help="synthetic camera frame rate")
+    parser.add_argument('--frame-bytes', type=int, default=30000, help="synthetic JPEG size")
+    parser.add_argument('--imu-rate', type=float, default=50, help="rover IMU sample rate (Hz)")
+    parser.add_argument('--server', default=os.path.join(HERE, 'server.py'), help="server.py to benchmark")
+    parser.add_argument('--fleet', type=int, default=0, metavar='N',
+                        help="benchmark a fleet gateway over N sim rovers instead (--viewers browsers, default 4)")
+    parser.add_argument('-o', '--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    if socketio is None:
+        sys.exit('bench.py needs the Socket.IO client: pip install "python-socketio[client]"')
+    if args.tabs is not None and not 0 <= args.tabs <= MAX_TABS:
+        sys.exit(f"--tabs must be between 0 and {MAX_TABS}")
+    if args.fleet:
+        return main_fleet(args)
+
+    server = BenchServer(os.path.abspath(args.server), args.imu_rate, args.fps, args.frame_bytes)
+    print(f"Starting {args.server} on port {server.port} (workdir {server.workdir})", file=sys.stderr)
+    results = {
+        'server': os.path.abspath(args.server),
+        'revision': git_revision(os.path.dirname(os.path.abspath(args.server))),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'scenario')},
+        'scenarios': [],
+    }
+    try:
+        server.start()
+        for name in args.scenario or list(SCENARIOS):
+            tabs, viewers = SCENARIOS[name]
+            if tabs and args.tabs is not None: tabs = args.tabs
+            if viewers and args.viewers is not None: viewers = args.viewers
+            result = run_scenario(server, name, tabs, viewers, args.duration, args.rate)
+            print_summary(result)
+            results['scenarios'].append(result)
+            time.sleep(1) # Dead-man stop and viewer teardown between scenarios
+        results['emulators'] = {'rover': server.rover.stats(), 'gimbal': server.gimbal.stats()}
+        results['server_stats'] = {path: server.get_json(f'/api/{path}') for path in ('stream', 'serial', 'gimbal')}
+    finally:
+        server.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+def main_fleet(args):
+    server_script = os.path.abspath(args.server)
+    rovers = [BenchServer(server_script, args.imu_rate, args.fps, args.frame_bytes) for _ in range(args.fleet)]
+    gateway = GatewayServer(server_script, rovers)
+    print(f"Starting {args.fleet} rovers and a gateway on port {gateway.port} (workdir {gateway.workdir})",
+          file=sys.stderr)
+    results = {
+        'server': server_script,
+        'revision': git_revision(os.path.dirname(server_script)),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'scenario')},
+        'scenarios': [],
+    }
+    try:
+        for rover in rovers: rover.start()
+        gateway.start()
+        result = run_fleet(gateway, rovers, args.viewers if args.viewers is not None else 4, args.duration)
+        print_summary(result)
+        results['scenarios'].append(result)
+    finally:
+        gateway.stop()
+        for rover in rovers: rover.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
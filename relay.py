@@ -0,0 +1,107 @@
+# Upstream fetcher for relay mode ("relay_upstream" in config.json).
+#
+# A relay's StreamManager runs this in place of gst-launch. Each output is an
+# HTTP stream from the upstream server (/video_feed?tier=..., /video.mp4)
+# copied verbatim to an inherited fd, so the relay's readers parse exactly
+# what they would read from a local pipeline, and the StreamManager's
+# supervision (first frame, stalls, backoff, idle stop) applies unchanged.
+#
+#   python relay.py --out 5=http://rover:5000/video.mp4 --tier 4=http://rover:5000/video_feed?tier=high
+#
+# --out streams are copied for as long as the process runs. --tier streams
+# are MJPEG tiers, fetched only while switched on: each line on stdin lists
+# the fds to copy, and the others are closed upstream after the part in
+# flight, so the relay's reader never sees a torn frame.
+#
+# Exits as soon as any upstream stream it wants ends or fails; the
+# StreamManager restarts it with backoff.
+
+import argparse
+import os
+import sys
+import threading
+import urllib.request
+
+CHUNK = 64 * 1024
+BOUNDARY = b'--frame'
+
+def write_all(out, data):
+    view = memoryview(data)
+    while view:
+        view = view[out.write(view):]
+
+def copy(fd, url, timeout):
+    """Copies one upstream response to `fd` until either side closes."""
+    with urllib.request.urlopen(url, timeout=timeout) as response, os.fdopen(fd, 'wb', buffering=0) as out:
+        while True:
+            data = response.read1(CHUNK)
+            if not data: return
+            write_all(out, data)
+
+def run(fd, url, timeout):
+    try:
+        copy(fd, url, timeout)
+        print(f"upstream closed {url}", file=sys.stderr, flush=True)
+    except Exception as e:
+        print(f"upstream {url} failed: {e}", file=sys.stderr, flush=True)
+    os._exit(1)
+
+class Tier:
+    """An MJPEG output that is only fetched while switched on."""
+
+    def __init__(self, fd, url, timeout):
+        self.url, self.timeout = url, timeout
+        self.out = os.fdopen(fd, 'wb', buffering=0)
+        self.wanted = threading.Event()
+
+    def run(self):
+        try:
+            while True:
+                self.wanted.wait()
+                self.copy()
+        except Exception as e:
+            print(f"upstream {self.url} failed: {e}", file=sys.stderr, flush=True)
+        os._exit(1)
+
+    def copy(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            while True:
+                data = response.read1(CHUNK)
+                if not data: raise EOFError("upstream closed")
+                if not self.wanted.is_set():
+                    # Finish the part in flight, then hang up
+                    end = data.find(BOUNDARY)
+                    if end >= 0:
+                        write_all(self.out, data[:end])
+                        return
+                write_all(self.out, data)
+
+def control(tiers):
+    """Reads lines of fds to copy from stdin; EOF leaves things as they are."""
+    for line in sys.stdin:
+        on = {int(fd) for fd in line.split()}
+        for fd, tier in tiers.items():
+            if fd in on: tier.wanted.set()
+            else: tier.wanted.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy upstream video streams to inherited fds")
+    parser.add_argument('--out', action='append', default=[], metavar='FD=URL', help="always copied")
+    parser.add_argument('--tier', action='append', default=[], metavar='FD=URL',
+                        help="MJPEG, copied while its fd is listed on stdin")
+    parser.add_argument('--timeout', type=float, default=10.0, help="connect/read timeout, seconds")
+    args = parser.parse_args()
+    for spec in args.out:
+        fd, _, url = spec.partition('=')
+        threading.Thread(target=run, args=(int(fd), url, args.timeout), daemon=True).start()
+    tiers = {}
+    for spec in args.tier:
+        fd, _, url = spec.partition('=')
+        tiers[int(fd)] = Tier(int(fd), url, args.timeout)
+        threading.Thread(target=tiers[int(fd)].run, daemon=True).start()
+    if tiers: control(tiers)
+    threading.Event().wait()
+
+if __name__ == '__main__':
+    try: main()
+    except KeyboardInterrupt: pass
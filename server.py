@@ -1,29 +1,146 @@
+# Everything runs on one gevent hub: patch sockets, threading, subprocess,
+# select and sleep into their cooperative versions before anything imports
+# the blocking originals. threading.Lock/Condition below are gevent's after
+# this, and blocking work that has no cooperative form (disk writes, mmap
+# scans) goes to io_pool, a small pool of real OS threads.
+from gevent import monkey
+monkey.patch_all()
+
 import serial
+import sys
 import time
 import threading
 import json
 import socket
 import struct
+import binascii
 import subprocess
 import os
 import signal
 import atexit
 import logging
-from flask import Flask, render_template, Response, request, jsonify
+import logging.handlers
+import queue
+import math
+import mmap
+import re
+import bisect
+import urllib.error
+import urllib.request
+import collections
+import gc
+import hmac
+from array import array
+from flask import Flask, render_template, Response, request, jsonify, send_file
 from flask_socketio import SocketIO
-from gpiozero import AngularServo
+import gevent
+import greenlet
+from gevent.socket import wait_read
+from gevent.threadpool import ThreadPool
+from gevent.fileobject import FileObject
 
 # --- Hardware Imports (Mockable) ---
 try:
-    # from gpiozero import AngularServo # Already imported above
+    from gpiozero import AngularServo
     GPIO_AVAILABLE = True
 except ImportError:
     GPIO_AVAILABLE = False
     print("⚠️ gpiozero not found. Servo control will be disabled.")
 
 # --- Configuration ---
-CONFIG_FILE = 'config.json'
-DEFAULT_CONFIG = {"camera_mode": "siyi"}
+CONFIG_FILE = os.environ.get('INSIGHT_CONFIG', 'config.json')
+DEFAULT_CONFIG = {
+    "camera_mode": "siyi",
+    # Video pipeline lifecycle (seconds)
+    "stream_idle_timeout": 10,     # Stop/pause GStreamer this long after the last viewer leaves
+    "stream_warm_standby": True,   # Pause the idle pipeline instead of killing it
+    "stream_standby_timeout": 300, # Fully stop a paused pipeline after this long
+    "stream_start_timeout": 15,    # Restart if no first frame arrives within this
+    "stream_stall_timeout": 5,     # Restart a running pipeline that stops producing frames
+    "stream_backoff_max": 30,      # Upper bound for the exponential restart delay
+    "stream_nice": 10,             # Run the pipeline at this niceness so encoding yields the CPU to control
+    # Seconds each subsystem may take to come up before /healthz calls it timed
+    # out; bring-up keeps retrying in the background either way
+    "startup_timeouts": {"serial": 5, "gimbal": 10, "camera": 20, "servo": 5, "upstream": 10, "fleet": 10},
+    # Rover motor commands
+    "control_rate_hz": 20,         # Max serial write rate for L/R setpoints (latest wins)
+    "control_deadman_s": 0.5,      # Stop the motors if no setpoint arrives for this long
+    "control_keepalive_s": 1.0,    # Re-send an unchanged non-zero setpoint this often
+    "gimbal_speed_rate_hz": 20,    # Max rate of SIYI speed commands (latest wins)
+    # Fused vehicle_state topic: IMU and gimbal interpolated to one tick
+    "vehicle_state_hz": 20,
+    "vehicle_state_delay_ms": 60,  # Tick this far in the past so both sources bracket it
+    "vehicle_state_max_age_ms": 500, # Older sources are reported as missing
+    "vehicle_state_record": True,  # Also write each tick to the flight recorder
+    # Pi Cam tilt servo (picam mode)
+    "servo_mode": "position",      # position: stick = angle | rate: stick = angular speed
+    "servo_rate_hz": 50,           # Servo update loop rate
+    "servo_max_speed_dps": 180,    # Slew limit, degrees/s
+    "servo_max_accel_dps2": 720,   # Acceleration limit, degrees/s^2 (0 = none)
+    "servo_resolution_deg": 0.5,   # Skip writes that change the angle by less than this
+    "servo_hw_pwm": True,          # Use pigpiod's hardware-timed PWM when it is running
+    # Logging: written in batches off the I/O paths, rate limited per message
+    "log_file": "server.log",
+    "log_level": "INFO",
+    "log_format": "text",          # text | json (one object per line)
+    "log_max_mb": 5,               # Rotate at this size...
+    "log_backups": 3,              # ...keeping this many old files
+    "log_burst": 5,                # Same message at most this many times...
+    "log_window_s": 10,            # ...per window; the rest are counted and summarized
+    # system_data resource monitor and the on-demand profiler (POST /api/profile)
+    "monitor_greenlet_s": 10,      # Greenlet count refresh; counting walks the whole heap
+    "profiler_token": None,        # Bearer token the profiler requires; unset = profiler off
+    "profiler_max_s": 30,          # Longest profile one request may run
+    # Telemetry flight recorder
+    "recorder_enabled": True,
+    "recorder_dir": "recordings/telemetry",
+    "recorder_segment_mb": 16,
+    "recorder_quota_mb": 512,
+    # Hardware backends: "sim"/"mock" use the stand-ins in sim.py and gpiozero's
+    # mock pins so the server can run (and be benchmarked) without a rover.
+    "serial_backend": "hw",        # hw | sim (pty rover emulator)
+    "gimbal_backend": "hw",        # hw | sim (local SIYI emulator)
+    "camera_backend": "gst",       # gst | sim (synthetic MJPEG source)
+    "servo_backend": "hw",         # hw | mock (gpiozero MockFactory)
+    "sim_imu_rate_hz": 50,
+    "sim_camera_fps": 30,
+    "sim_frame_bytes": 30000,
+    # H.264 passthrough (siyi mode): the camera's stream is also muxed, not
+    # transcoded, into fragmented MP4 for MSE players at /video.mp4
+    "h264_passthrough": True,
+    "h264_fragment_ms": 100,       # mp4mux fragment duration; shorter = lower latency
+    # MJPEG quality tiers, all from one decode. Only tiers with viewers are
+    # encoded, the rest idle in place; /video_feed?tier=<name>|auto picks one.
+    "video_tiers": {
+        "high": {"width": 640, "height": 360, "fps": 30, "quality": 85},
+        "low": {"width": 320, "height": 180, "fps": 10, "quality": 50},
+    },
+    "video_default_tier": "high",
+    # Server-side video recording while armed: the H.264 passthrough when
+    # available, else the MJPEG frames of video_record_tier (best if unset)
+    "video_record_on_arm": True,
+    "video_recorder_dir": "recordings/video",
+    "video_record_tier": None,
+    "video_segment_s": 60,
+    "video_quota_mb": 2048,
+    # Relay mode: serve video and telemetry from another InsightServer (e.g.
+    # "http://192.168.1.50:5000") instead of local hardware. Viewers connect
+    # here; the rover sees one client.
+    "relay_upstream": None,
+    "relay_h264": False,           # Also relay /video.mp4 (upstream must be in siyi mode)
+    "relay_driver_timeout_s": 5,   # Another client may take control after the driver is idle this long
+    # Fleet gateway: {rover id: server URL}. Keeps one link per rover and
+    # serves their merged telemetry, health and snapshots at /fleet.
+    "fleet_rovers": None,
+    "fleet_rates": {"vehicle_state": 2, "system_data": 0.5}, # Hz asked of every rover
+    "fleet_update_hz": 2,          # Batched fleet_update messages per second to browsers
+    "fleet_health_s": 10,          # /healthz poll per rover
+    "fleet_snapshot_s": 2,         # /snapshot.jpg poll per rover while /fleet is open (0 = off)
+    "fleet_snapshot_tier": None,   # e.g. "low" to save link bandwidth (the rovers' tier name)
+}
+
+# Hardware addresses below are defaults; config.json can override them with
+# "serial_port", "gimbal_ip", "gimbal_port" and "http_port" (bench.py does).
 
 # Rover Config
 SERIAL_PORT = '/dev/ttyS0' 
@@ -39,33 +156,126 @@ CAMERA_RTSP_URL = 'rtsp://192.168.144.25:8554/main.264'
 # Servo Config (Pi Cam Tilt)
 SERVO_PIN = 18
 
+# Simulation backends (see sim.py)
+SIM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim.py')
+
+# Relay mode upstream fetcher (see relay.py)
+RELAY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'relay.py')
+
 # --- GStreamer Commands ---
-def get_gstreamer_command(mode):
+def h264_supported(mode):
+    """True only when the camera backend for `mode` really delivers H.264 we
+    can pass through untouched, so /video.mp4 is never offered without it."""
+    if not config.get('h264_passthrough', True): return False
+    if relay_mode(): return config.get('relay_h264', False) # Upstream's mode isn't known here
+    # Only the SIYI camera encodes H.264; the sim stands in for whichever camera is selected
+    if mode != 'siyi': return False
+    if config.get('camera_backend') == 'sim': return True
+    # Without these the teed branch would take the whole siyi pipeline down.
+    # Probed once by camera_bringup; not offered until it answers.
+    return bool(gst_h264)
+
+gst_h264 = None # Whether gst-launch has the passthrough branch's elements
+
+def gst_has_elements(*names):
+    try:
+        return all(subprocess.run(['gst-inspect-1.0', '--exists', name], capture_output=True, timeout=10).returncode == 0
+                   for name in names)
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+def video_tiers():
+    """{name: {width, height, fps, quality}}, highest pixel rate first."""
+    tiers = config.get('video_tiers') or DEFAULT_CONFIG['video_tiers']
+    return dict(sorted(tiers.items(), key=lambda item: -item[1]['width'] * item[1]['height'] * item[1]['fps']))
+
+def default_tier():
+    tiers = video_tiers()
+    name = config.get('video_default_tier', 'high')
+    return name if name in tiers else next(iter(tiers))
+
+def tier_branches(tier_fds, encoder):
+    """One tee branch per tier: scale, drop to the tier's frame rate, encode
+    to JPEG and mux onto the tier's fd. The leaky queue lets a slow encoder
+    drop frames instead of holding up the other branches. It is also what
+    turns an unwatched tier off: once its reader stops draining the pipe,
+    fdsink blocks and the queue drops raw frames before they are scaled or
+    encoded."""
+    tiers = video_tiers()
+    command = []
+    for name, fd in tier_fds.items():
+        tier = tiers[name]
+        command += [
+            'raw.', '!', 'queue', 'leaky=downstream', 'max-size-buffers=2',
+            '!', 'videoscale', '!', 'videorate', 'drop-only=true',
+            '!', f"video/x-raw,width={tier['width']},height={tier['height']},framerate={tier['fps']}/1",
+            *encoder(tier['quality']),
+            '!', 'multipartmux', 'boundary=--frame',
+            '!', 'fdsink', f'fd={fd}',
+        ]
+    return command
+
+def get_gstreamer_command(mode, tier_fds, h264_fd=None):
+    """Builds the pipeline for `mode`. Each MJPEG tier in `tier_fds`
+    ({name: fd}) is written to its fd. With `h264_fd` (siyi mode), the same
+    RTSP ingest is also teed and its H.264 written there as fragmented MP4."""
+    tiers = video_tiers()
+    if relay_mode():
+        # Copies the upstream server's own outputs, already encoded, onto the fds
+        upstream = config['relay_upstream'].rstrip('/')
+        command = [sys.executable, RELAY_SCRIPT]
+        for name, fd in tier_fds.items():
+            # Fetched only while switched on over stdin (see StreamManager._apply_tiers)
+            command += ['--tier', f"{fd}={upstream}/video_feed?tier={name}"]
+        if h264_fd is not None: command += ['--out', f"{h264_fd}={upstream}/video.mp4"]
+        return command
+    if config.get('camera_backend') == 'sim':
+        # Same multipart output as the real pipelines, no camera needed
+        base = config.get('sim_frame_bytes', 30000)
+        command = [sys.executable, SIM_SCRIPT, 'mjpeg', '--fps', str(config.get('sim_camera_fps', 30))]
+        for name, fd in tier_fds.items():
+            tier = tiers[name]
+            # Scale the synthetic frame size like a real encoder roughly would
+            size = int(base * tier['width'] * tier['height'] / (640 * 360) * tier['quality'] / 85)
+            command += ['--out', f"{fd}:{tier['fps']}:{max(size, 1000)}"]
+        if h264_fd is not None: command += ['--h264-fd', str(h264_fd)]
+        return command
     if mode == 'siyi':
-        return [
+        command = [
             'gst-launch-1.0',
             'rtspsrc', f'location={CAMERA_RTSP_URL}', 'latency=0', 'tcp-timeout=5000000',
             '!', 'rtph264depay',
+        ]
+        if h264_fd is not None:
+            command += [
+                '!', 'tee', 'name=h264',
+                'h264.', '!', 'queue',
+                '!', 'h264parse', 'config-interval=-1',
+                '!', 'video/x-h264,stream-format=avc,alignment=au',
+                '!', 'mp4mux', f"fragment-duration={config.get('h264_fragment_ms', 100)}", 'streamable=true',
+                '!', 'fdsink', f'fd={h264_fd}',
+                'h264.', '!', 'queue',
+            ]
+        return command + [
             '!', 'h264parse',
             '!', 'v4l2h264dec',
-            '!', 'videoscale',
-            '!', 'video/x-raw,width=640,height=360',
-            '!', 'v4l2jpegenc',
-            '!', 'multipartmux', 'boundary=--frame',
-            '!', 'fdsink', 'fd=1'
-        ]
+            '!', 'tee', 'name=raw',
+        ] + tier_branches(tier_fds, lambda q: ['!', 'v4l2jpegenc', f'extra-controls=encode,compression_quality={q}'])
     elif mode == 'picam':
         # Using libcamerasrc for modern Pi OS (Pi Cam 3)
-        # Relaxed caps to allow auto-negotiation
+        # Relaxed caps to allow auto-negotiation. The sensor runs at the
+        # largest demanded tier; smaller tiers are scaled from it.
+        demanded = [tiers[name] for name in tier_fds]
+        width = max(t['width'] for t in demanded)
+        height = max(t['height'] for t in demanded)
+        fps = max(t['fps'] for t in demanded)
         return [
             'gst-launch-1.0',
             'libcamerasrc',
-            '!', 'video/x-raw,width=640,height=360,framerate=30/1',
+            '!', f'video/x-raw,width={width},height={height},framerate={fps}/1',
             '!', 'videoconvert',
-            '!', 'jpegenc',
-            '!', 'multipartmux', 'boundary=--frame',
-            '!', 'fdsink', 'fd=1'
-        ]
+            '!', 'tee', 'name=raw',
+        ] + tier_branches(tier_fds, lambda q: ['!', 'jpegenc', f'quality={q}'])
     return []
 
 # --- Global Objects ---
@@ -73,80 +283,583 @@ app = Flask(__name__)
 socketio = SocketIO(app, async_mode='gevent') 
 ser = None
 gimbal = None
-stream_process = None
 connected_clients_count = 0
 servo = None
 config = {}
+config_overrides = {} # What config.json itself sets; only this is saved back
+simulators = {} # Running sim.py emulators by backend name
+io_pool = ThreadPool(2) # OS threads for disk I/O; callers wait cooperatively
 
 # --- Config Management ---
 def load_config():
-    global config
+    global config, config_overrides
+    config_overrides = {}
     if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
+                config_overrides = json.load(f)
         except:
-            config = DEFAULT_CONFIG.copy()
-    else:
-        config = DEFAULT_CONFIG.copy()
+            config_overrides = {}
+    # Defaults stay out of config_overrides so a saved file keeps picking up new ones
+    config = {**DEFAULT_CONFIG, **config_overrides}
     print(f"Loaded Config: {config}")
 
+def relay_mode():
+    return bool(config.get('relay_upstream'))
+
+def fleet_mode():
+    return bool(config.get('fleet_rovers'))
+
+def local_hardware():
+    """False when the rover belongs to another server (relay or fleet gateway)."""
+    return not (relay_mode() or fleet_mode())
+
+def warm_standby():
+    """Only a server with its own camera keeps an idle pipeline; a paused
+    relay fetcher would still hold its upstream streams open."""
+    return config.get('stream_warm_standby', True) and local_hardware()
+
 def save_config():
     with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f)
+        json.dump(config_overrides, f)
+
+# --- Logging ---
+# logging calls only append the record to memory, from whichever greenlet or
+# thread makes them. Every FLUSH_INTERVAL the batch goes to io_pool, where it
+# is rate limited and written to a size-rotated file with one flush, so a
+# noisy serial line or gst-launch never waits on the SD card. Extras:
+#   key     rate-limit key (default: the message with digits masked, so
+#           "restart in 4s" and "restart in 8s" are the same message)
+#   fields  {name: value} written as key=value (text) or JSON members
+#   console also echo to stdout
+LOG_DIGITS = re.compile(r'\d+')
+
+class LogFormatter(logging.Formatter):
+    """The classic server.log line plus structured fields, or JSON lines."""
+
+    def __init__(self, style='text'):
+        super().__init__('%(asctime)s %(levelname)s: %(message)s')
+        self.json = style == 'json'
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if not self.json:
+            line = super().format(record)
+            return line + ''.join(f' {k}={v}' for k, v in fields.items()) if fields else line
+        entry = {'t': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+                 'msg': record.getMessage(), **fields}
+        if record.exc_info: entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class BatchFlushMixin:
+    # Flushed once per batch by AsyncLogHandler instead of once per record
+    def flush(self): pass
+
+    def flush_batch(self):
+        if self.stream: self.stream.flush()
+
+class BatchFileHandler(BatchFlushMixin, logging.handlers.RotatingFileHandler): pass
+class BatchStreamHandler(BatchFlushMixin, logging.StreamHandler): pass
+
+class AsyncLogHandler(logging.Handler):
+    """Root handler that defers all formatting and I/O to `run`.
+
+    Each key gets at most `log_burst` records per `log_window_s`; the rest
+    are counted, and when the window closes the last of them is written once
+    with "(repeated N times)".
+    """
+
+    FLUSH_INTERVAL = 1.0
+    MAX_PENDING = 10000 # Drop records rather than grow without bound if the disk stalls
+
+    def __init__(self):
+        super().__init__()
+        self.pending = collections.deque()
+        self.targets = [] # Batch*Handlers, set by setup_logging
+        self.windows = {} # key -> [window start, count, suppressed, last suppressed record]
+        self.write_lock = threading.Lock() # One batch on the disk at a time
+        self.records = 0
+        self.written = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def handle(self, record):
+        # No handler lock: a deque append is atomic, and this is called from
+        # greenlets and io_pool threads alike
+        if not self.filter(record): return False
+        self.emit(record)
+        return True
+
+    def emit(self, record):
+        if len(self.pending) >= self.MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+        self.records += 1
+
+    def flush_pending(self):
+        if not self.pending or not self.targets: return
+        with self.write_lock:
+            io_pool.apply(self._write, (time.monotonic(),))
+
+    @staticmethod
+    def _repeated(state):
+        record = logging.makeLogRecord(state[3].__dict__)
+        record.msg, record.args = f"{state[3].getMessage()} (repeated {state[2]} times)", None
+        return record
+
+    def _write(self, now, final=False):
+        # Runs on an io_pool thread: no gevent or Socket.IO calls in here
+        window = config.get('log_window_s', 10)
+        burst = config.get('log_burst', 5)
+        out = []
+        while self.pending:
+            record = self.pending.popleft()
+            key = getattr(record, 'key', None) or LOG_DIGITS.sub('#', str(record.msg))
+            state = self.windows.get(key)
+            if state is None or now - state[0] >= window:
+                if state and state[2]: out.append(self._repeated(state))
+                state = self.windows[key] = [now, 0, 0, None]
+            state[1] += 1
+            if state[1] <= burst:
+                out.append(record)
+            else:
+                state[2] += 1
+                state[3] = record
+                self.suppressed += 1
+        for key, state in list(self.windows.items()):
+            if final or now - state[0] >= window:
+                if state[2]: out.append(self._repeated(state))
+                del self.windows[key]
+        for record in out:
+            for target in self.targets:
+                if record.levelno >= target.level and target.filter(record):
+                    try: target.emit(record)
+                    except Exception: pass
+        for target in self.targets: target.flush_batch()
+        self.written += len(out)
+
+    def run(self):
+        while True:
+            socketio.sleep(self.FLUSH_INTERVAL)
+            try:
+                self.flush_pending()
+            except Exception as e:
+                print(f"🛑 Log write failed: {e}") # Not through logging, which is what failed
+
+    def shutdown(self):
+        """Writes everything still pending, on the calling thread (at exit)."""
+        with self.write_lock:
+            self._write(time.monotonic(), final=True)
+        for target in self.targets: target.close()
+
+    def stats(self):
+        return {'records': self.records, 'written': self.written, 'suppressed': self.suppressed,
+                'dropped': self.dropped, 'pending': len(self.pending)}
+
+log_handler = AsyncLogHandler()
+logging.getLogger().addHandler(log_handler)
+logging.getLogger().setLevel(logging.INFO)
+
+def setup_logging():
+    """(Re)creates the log writers from config. Records logged before this
+    are kept and written by the first flush."""
+    log_file = BatchFileHandler(config.get('log_file', 'server.log'), backupCount=config.get('log_backups', 3),
+                                maxBytes=int(config.get('log_max_mb', 5) * 1024 * 1024))
+    log_file.setFormatter(LogFormatter(config.get('log_format', 'text')))
+    console = BatchStreamHandler(sys.stdout)
+    console.addFilter(lambda record: getattr(record, 'console', False))
+    old, log_handler.targets = log_handler.targets, [log_file, console]
+    for target in old: target.close()
+    logging.getLogger().setLevel(config.get('log_level', 'INFO'))
+
+# --- Metrics ---
+# Hot paths record into fixed-bucket histograms: an observation is one bisect
+# and a few additions, without a lock. Greenlets are not preempted in between
+# and each reader thread records only into its own series, so the worst a
+# scrape can see is a sum one observation ahead of its buckets. Counters the
+# components already keep (packets, samples, malformed frames...) are read at
+# scrape time by collectors instead of being duplicated.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Cumulative histogram over fixed bucket bounds (seconds)."""
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, q, since=None):
+        """Upper bound of the bucket holding the q-quantile, counting only
+        observations made after the `since` snapshot of `counts`. Values past
+        the last bucket report the last bound. None if nothing was observed."""
+        counts = self.counts if since is None else [c - s for c, s in zip(self.counts, since)]
+        total = sum(counts)
+        if not total: return None
+        seen = 0
+        for bound, n in zip(self.bounds, counts):
+            seen += n
+            if seen >= q * total: return bound
+        return self.bounds[-1]
+
+class Metrics:
+    """Registry behind /metrics and the 'stats' telemetry topic.
+
+    Collectors are called at scrape time and yield
+    (name, type, help, [(labels, value), ...]).
+    """
+
+    def __init__(self):
+        self.histograms = {} # (name, labels) -> Histogram
+        self.help = {}
+        self.collectors = []
+
+    def histogram(self, name, help, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+            self.help[name] = help
+        return self.histograms[key]
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    @staticmethod
+    def _labels(labels, extra=''):
+        pairs = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        last_name = None
+        for (name, labels), hist in sorted(self.histograms.items()):
+            if name != last_name:
+                lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                last_name = name
+            counts = list(hist.counts)
+            cumulative = 0
+            for bound, n in zip(hist.bounds + (None,), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound is None else f'le="{bound:g}"'
+                lines.append(f'{name}_bucket{self._labels(labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {hist.sum:.6f}')
+            lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        for collect in self.collectors:
+            try:
+                for name, kind, help, samples in collect():
+                    lines.append(f'# HELP {name} {help}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for labels, value in samples:
+                        lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+            except Exception as e:
+                logging.error(f"Metrics collector error: {e}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# Hop latencies. Each hop is measured from the start of its path, so the last
+# hop of a path is its end-to-end latency.
+CONTROL_LATENCY_HELP = "Setpoint latency from socket.io receive to: schedule (picked for sending), write (written to the device)"
+rover_schedule_latency = metrics.histogram('insight_control_latency_seconds', CONTROL_LATENCY_HELP, path='rover', hop='schedule')
+rover_write_latency = metrics.histogram('insight_control_latency_seconds', CONTROL_LATENCY_HELP, path='rover', hop='write')
+gimbal_schedule_latency = metrics.histogram('insight_control_latency_seconds', CONTROL_LATENCY_HELP, path='gimbal', hop='schedule')
+gimbal_write_latency = metrics.histogram('insight_control_latency_seconds', CONTROL_LATENCY_HELP, path='gimbal', hop='write')
+TELEMETRY_LATENCY_HELP = "Rover telemetry latency from serial read to: parse (JSON decoded), emit (published to socket.io rooms)"
+telemetry_parse_latency = metrics.histogram('insight_telemetry_latency_seconds', TELEMETRY_LATENCY_HELP, hop='parse')
+telemetry_emit_latency = metrics.histogram('insight_telemetry_latency_seconds', TELEMETRY_LATENCY_HELP, hop='emit')
+VIDEO_LATENCY_HELP = "Video latency from frame read off the pipeline to: dispatch (picked up by a viewer), write (sent to the viewer)"
+video_dispatch_latency = metrics.histogram('insight_video_latency_seconds', VIDEO_LATENCY_HELP, hop='dispatch')
+video_write_latency = metrics.histogram('insight_video_latency_seconds', VIDEO_LATENCY_HELP, hop='write')
+
+# --- Command Rate Limits ---
+class SendSlot:
+    """At most one command per 1/`rate_key` seconds, sent from the handler
+    that received it.
+
+    A setpoint is written as soon as it arrives if the slot is open, so its
+    latency is the event path alone rather than the phase of a timer (which
+    the hub may also run late while it is busy with video). One that arrives
+    while the slot is closed waits, latest wins, and is sent by the owner's
+    loop once the slot has reopened and it has waited half an interval,
+    unless a newer one arrives first and is sent on arrival.
+    """
+
+    def __init__(self, rate_key):
+        self.rate_key = rate_key
+        self.last = 0
+
+    @property
+    def interval(self):
+        return 1.0 / config.get(self.rate_key, 20)
+
+    def open(self, now):
+        return now - self.last >= self.interval
+
+    def wait(self, now, received):
+        """Seconds until a setpoint received at `received` is due."""
+        return max(self.last + self.interval, received + self.interval / 2) - now
+
+    def sent(self, now):
+        self.last = now
 
 # --- Servo Setup ---
+SERVO_RANGE = 90.0 # Standard servo range: -90 to 90 degrees
+
+class ServoController:
+    """Moves the tilt servo from a fixed-rate loop instead of per joystick event.
+
+    Joystick events only update the input (latest wins). `run` steps the
+    commanded angle towards the target at `servo_rate_hz` under the speed and
+    acceleration limits, and writes it only when it moved by at least
+    `servo_resolution_deg`. In rate mode the stick sets an angular speed that
+    moves the target; it stops if input stops for `control_deadman_s`.
+    `step` has no side effects on the servo, so it can be driven directly
+    with gpiozero's MockFactory.
+    """
+
+    def __init__(self):
+        self.servo = None
+        self.input = 0.0 # Latest stick value, -1..1
+        self.last_input_time = 0
+        self.target = 0.0
+        self.position = 0.0
+        self.velocity = 0.0
+        self.last_written = None
+        self.inputs = 0
+        self.writes = 0
+        self.skipped = 0
+
+    def attach(self, servo):
+        self.servo = servo
+        self.position = self.target = servo.angle if servo.angle is not None else 0.0
+        self.velocity = 0.0
+        self.last_written = None
+
+    def detach(self):
+        self.servo = None
+
+    def set_input(self, value):
+        """Stick deflection -1..1: an angle in position mode, a speed in rate mode."""
+        self.inputs += 1
+        self.last_input_time = time.monotonic()
+        self.input = max(-1.0, min(1.0, float(value)))
+        if config.get('servo_mode', 'position') != 'rate':
+            # Invert the input if needed based on mechanical setup
+            self.target = self.input * SERVO_RANGE
+
+    def step(self, dt):
+        """Advances the commanded angle by `dt` seconds and returns it."""
+        max_speed = config.get('servo_max_speed_dps', 180)
+        accel = config.get('servo_max_accel_dps2', 720)
+        if config.get('servo_mode', 'position') == 'rate':
+            if time.monotonic() - self.last_input_time > config.get('control_deadman_s', 0.5):
+                self.input = 0.0
+            self.target = max(-SERVO_RANGE, min(SERVO_RANGE, self.target + self.input * max_speed * dt))
+        error = self.target - self.position
+        # Fastest speed that can still stop at the target, braking by accel * dt per tick
+        stoppable = accel * (math.sqrt(dt * dt / 4 + 2 * abs(error) / accel) - dt / 2) if accel else max_speed
+        desired = math.copysign(min(max_speed, stoppable), error)
+        if accel:
+            desired = max(self.velocity - accel * dt, min(self.velocity + accel * dt, desired))
+        self.velocity = desired
+        moved = self.position + self.velocity * dt
+        if (self.target - moved) * error <= 0: # Reached or overshot
+            moved, self.velocity = self.target, 0.0
+        self.position = moved
+        return self.position
+
+    def _tick(self, dt):
+        previous = self.position
+        angle = self.step(dt)
+        last = self.last_written
+        # Small steps are skipped while moving, but where it comes to rest is written exactly
+        if last is not None and (angle == last or (abs(angle - last) < config.get('servo_resolution_deg', 0.5)
+                                                   and angle != previous)):
+            self.skipped += 1
+            return
+        self.servo.angle = angle
+        self.last_written = angle
+        self.writes += 1
+
+    def run(self):
+        last = time.monotonic()
+        while True:
+            socketio.sleep(1.0 / config.get('servo_rate_hz', 50))
+            now = time.monotonic()
+            dt, last = now - last, now
+            if not self.servo: continue
+            try:
+                self._tick(dt)
+            except Exception as e:
+                logging.error(f"Servo loop error: {e}")
+
+    def stats(self):
+        return {
+            'attached': self.servo is not None,
+            'mode': config.get('servo_mode', 'position'),
+            'target': round(self.target, 2),
+            'position': round(self.position, 2),
+            'velocity': round(self.velocity, 2),
+            'inputs': self.inputs,
+            'writes': self.writes,
+            'skipped_writes': self.skipped,
+        }
+
+servo_controller = ServoController()
+
+def servo_pin_factory():
+    """gpiozero's MockFactory for the mock backend; otherwise pigpiod's
+    hardware-timed PWM when the daemon is reachable, else gpiozero's default
+    (software PWM, which jitters under CPU load)."""
+    if config.get('servo_backend') == 'mock':
+        from gpiozero.pins.mock import MockFactory, MockPWMPin
+        return MockFactory(pin_class=MockPWMPin)
+    if config.get('servo_hw_pwm', True):
+        try:
+            from gpiozero.pins.pigpio import PiGPIOFactory
+            return PiGPIOFactory()
+        except Exception as e:
+            logging.info(f"pigpio unavailable, servo uses software PWM: {e}")
+    return None
+
 def init_servo():
     global servo
     if GPIO_AVAILABLE and config.get('camera_mode') == 'picam':
+        if servo: return
         try:
-            # Standard servo range: -90 to 90 degrees
-            servo = AngularServo(SERVO_PIN, min_angle=-90, max_angle=90)
-            print(f"✅ Servo initialized on GPIO {SERVO_PIN}")
+            servo = AngularServo(SERVO_PIN, min_angle=-SERVO_RANGE, max_angle=SERVO_RANGE,
+                                 pin_factory=servo_pin_factory())
+            servo_controller.attach(servo)
+            logging.info(f"✅ Servo initialized on GPIO {SERVO_PIN} ({type(servo.pin_factory).__name__})", extra={'console': True})
         except Exception as e:
-            print(f"🛑 Error initializing servo: {e}")
+            logging.error(f"🛑 Error initializing servo: {e}", extra={'console': True})
             servo = None
     else:
         if servo:
+            servo_controller.detach()
             servo.close()
             servo = None
 
 # --- SIYI TCP Protocol ---
+# Packet: STX(0x55 0x66) CTRL(1) DATA_LEN(2, LE) SEQ(2, LE) CMD_ID(1) DATA(n) CRC16(2, LE)
+# The CRC is CRC-16/XMODEM (poly 0x1021, init 0) over everything before it,
+# which is exactly what binascii.crc_hqx computes in C. The lookup table this
+# replaced had entry 228 wrong (0xbdca, should be 0xbdaa), so frames whose CRC
+# ran through that entry now carry, and are checked against, the correct value.
+SIYI_STX = b'\x55\x66'
+SIYI_OVERHEAD = 10 # Header (8) + CRC (2)
+SIYI_MAX_DATA_LEN = 1024 # Longest real payload is well below this
+
+def siyi_crc16(data, crc=0):
+    return binascii.crc_hqx(data, crc)
+
+class SiyiFramer:
+    """Incremental packet framer over a preallocated receive buffer.
+
+    Bytes are received straight into the buffer with recv_into, packets are
+    yielded as memoryviews into it (valid until the next receive) and the
+    unconsumed tail is only moved when the buffer end is reached.
+    """
+
+    def __init__(self, size=8192):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.packets = 0
+        self.crc_errors = 0
+        self.malformed = 0
+        self.skipped_bytes = 0
+
+    def recv_into(self, sock):
+        """Receives once from the socket. Returns the byte count (0 on EOF)."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            pending = self.end - self.start
+            self.buf[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def frames(self):
+        """Yields every complete, CRC-valid packet currently buffered."""
+        buf, view = self.buf, self.view
+        while True:
+            start, end = self.start, self.end
+            avail = end - start
+            if avail < 2: return
+            if buf[start] != 0x55 or buf[start + 1] != 0x66:
+                idx = buf.find(SIYI_STX, start, end)
+                if idx < 0:
+                    # Keep a trailing 0x55, it may be the first half of an STX
+                    idx = end - 1 if buf[end - 1] == 0x55 else end
+                self.skipped_bytes += idx - start
+                self.start = idx
+                continue
+            if avail < SIYI_OVERHEAD: return
+            data_len = buf[start + 3] | (buf[start + 4] << 8)
+            if data_len > SIYI_MAX_DATA_LEN:
+                self.malformed += 1
+                self.start = start + 1 # Resync past this false STX
+                continue
+            packet_len = SIYI_OVERHEAD + data_len
+            if avail < packet_len: return
+            crc_pos = start + packet_len - 2
+            if siyi_crc16(view[start:crc_pos]) != buf[crc_pos] | (buf[crc_pos + 1] << 8):
+                self.crc_errors += 1
+                self.start = start + 1
+                continue
+            self.start = start + packet_len
+            self.packets += 1
+            yield view[start:start + packet_len]
+
+    def stats(self):
+        return {
+            'packets': self.packets,
+            'crc_errors': self.crc_errors,
+            'malformed': self.malformed,
+            'skipped_bytes': self.skipped_bytes,
+        }
+
+class SiyiRequest:
+    """An outstanding request waiting for the gimbal's response."""
+    __slots__ = ('cmd_id', 'sent', 'event', 'response')
+
+    def __init__(self, cmd_id):
+        self.cmd_id = cmd_id
+        self.sent = time.monotonic()
+        self.event = socketio.server.eio.create_event()
+        self.response = None
+
 class SiyiTCPProtocol:
-    CRC16_TAB = [
-        0x0, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
-        0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
-        0x1231, 0x210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6,
-        0x9339, 0x8318, 0xb37b, 0xa35a, 0xd3bd, 0xc39c, 0xf3ff, 0xe3de,
-        0x2462, 0x3443, 0x420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485,
-        0xa56a, 0xb54b, 0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d,
-        0x3653, 0x2672, 0x1611, 0x630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
-        0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc,
-        0x48c4, 0x58e5, 0x6886, 0x78a7, 0x840, 0x1861, 0x2802, 0x3823,
-        0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b,
-        0x5af5, 0x4ad4, 0x7ab7, 0x6a96, 0x1a71, 0xa50, 0x3a33, 0x2a12,
-        0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a,
-        0x6ca6, 0x7c87, 0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0xc60, 0x1c41,
-        0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
-        0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0xe70,
-        0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a, 0x9f59, 0x8f78,
-        0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f,
-        0x1080, 0xa1, 0x30c2, 0x20e3, 0x5004, 0x4025, 0x7046, 0x6067,
-        0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e,
-        0x2b1, 0x1290, 0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256,
-        0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
-        0x34e2, 0x24c3, 0x14a0, 0x481, 0x7466, 0x6447, 0x5424, 0x4405,
-        0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e, 0xc71d, 0xd73c,
-        0x26d3, 0x36f2, 0x691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634,
-        0xd94c, 0xc96d, 0xf90e, 0xe92f, 0x99c8, 0x89e9, 0xb98a, 0xa9ab,
-        0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x8e1, 0x3882, 0x28a3,
-        0xcb7d, 0xdb5c, 0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a,
-        0x4a75, 0x5a54, 0x6a37, 0x7a16, 0xaf1, 0x1ad0, 0x2ab3, 0x3a92,
-        0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdca, 0xad8b, 0x9de8, 0x8dc9,
-        0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83, 0x1ce0, 0xcc1,
-        0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8,
-        0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0xed1, 0x1ef0
-    ]
+    """SIYI gimbal client.
+
+    `start` runs three background tasks: a single writer draining a bounded
+    outbound queue, a receiver per connection, and a supervisor that paces
+    speed commands, sends heartbeats and reconnects with backoff whenever the
+    link drops or goes silent. Requests that expect a reply are matched to
+    responses by SEQ (falling back to the oldest pending request with the same
+    CMD_ID, for firmware that does not echo SEQ) so round-trip time can be
+    measured.
+    """
+
+    OUTBOX_SIZE = 32
+    CONNECT_TIMEOUT = 1.0
+    LINK_TIMEOUT = 1.0 # The attitude stream runs at 20Hz, silence means the link is gone
+    HEARTBEAT_INTERVAL = 1.0
+    RECONNECT_MIN = 0.1
+    RECONNECT_MAX = 5.0
 
     def __init__(self, ip, port):
         self.ip = ip
@@ -154,72 +867,194 @@ class SiyiTCPProtocol:
         self.sock = None
         self.seq = 0
         self.lock = threading.Lock() 
-        self.is_recording = False # Internal state tracker
-        self.last_gimbal_emit = 0 # Rate limiter
+        self.is_recording = False # Confirmed by the gimbal (0x0A record_sta)
+        self.framer = SiyiFramer()
+        self.outbox = socketio.server.eio.create_queue(self.OUTBOX_SIZE)
+        self.pending = {} # seq -> SiyiRequest
+        self.speed_target = (0, 0)
+        self.speed_sent = None
+        self.speed_received = None # Monotonic receive time of an unsent speed_target
+        self.speed_slot = SendSlot('gimbal_speed_rate_hz')
+        self.tx_packets = 0
+        self.last_rx = 0
+        self.connects = 0
+        self.dropped_packets = 0
+        self.request_timeouts = 0
+        self.rtt_ms = None
+
+    def start(self):
+        socketio.start_background_task(self.writer_loop)
+        socketio.start_background_task(self.supervisor_loop)
 
     def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.ip, self.port))
-            self.sock.settimeout(2.0)
-            print(f"✅ Connected to gimbal at {self.ip}:{self.port}")
-            return True
+            sock.settimeout(self.CONNECT_TIMEOUT)
+            sock.connect((self.ip, self.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(2.0)
         except Exception as e:
-            print(f"🛑 Error connecting to gimbal: {e}")
+            sock.close()
+            logging.warning(f"Gimbal connect to {self.ip}:{self.port} failed: {e}")
             return False
+        self.framer = SiyiFramer()
+        self.sock = sock
+        self.last_rx = time.monotonic()
+        self.speed_sent = None # Re-send the current speed on the new link
+        self.connects += 1
+        logging.info(f"✅ Connected to gimbal at {self.ip}:{self.port}", extra={'console': True})
+        socketio.start_background_task(self.receive_loop, sock)
+        self.request_attitude_stream()
+        return True
+
+    def _link_down(self, sock, reason):
+        if self.sock is not sock: return # Already handled
+        self.sock = None
+        try: sock.close()
+        except Exception: pass
+        logging.warning(f"Gimbal link down: {reason}", extra={'console': True})
 
     def _crc16(self, data):
-        crc = 0
-        for byte in data:
-            temp = (crc >> 8) & 0xFF
-            oldcrc16 = self.CRC16_TAB[byte ^ temp]
-            crc = (crc << 8) ^ oldcrc16
-        return crc & 0xFFFF
+        return siyi_crc16(data)
 
     def _get_seq(self):
         with self.lock:
             self.seq = (self.seq + 1) % 65536
             return self.seq
 
-    def _build_packet(self, cmd_id, data):
+    def _build_packet(self, cmd_id, data, seq=None, need_ack=False):
         stx = b'\x55\x66'
-        ctrl = b'\x00'
+        ctrl = b'\x01' if need_ack else b'\x00'
         data_len = struct.pack('<H', len(data))
-        seq = struct.pack('<H', self._get_seq())
+        seq = struct.pack('<H', self._get_seq() if seq is None else seq)
         cmd = struct.pack('B', cmd_id)
         packet_no_crc = stx + ctrl + data_len + seq + cmd + data
         crc = struct.pack('<H', self._crc16(packet_no_crc))
         return packet_no_crc + crc
 
-    def send(self, packet):
+    def send(self, packet, received=None):
+        """Queues a packet for the writer. Drops it if the link is down or the
+        queue is full; stale gimbal commands are worse than lost ones.
+        `received` is the monotonic time of the setpoint it carries, if any."""
+        if self.sock is None:
+            self.dropped_packets += 1
+            return False
         try:
-            with self.lock:
-                self.sock.sendall(packet)
-        except Exception as e:
-            print(f"Error sending packet: {e}")
+            self.outbox.put_nowait((packet, received))
+            return True
+        except queue.Full:
+            self.dropped_packets += 1
+            return False
+
+    def writer_loop(self):
+        while True:
+            packet, received = self.outbox.get()
+            sock = self.sock
+            if sock is None:
+                self.dropped_packets += 1
+                continue
+            try:
+                sock.sendall(packet)
+                self.tx_packets += 1
+                if received is not None:
+                    gimbal_write_latency.observe(time.monotonic() - received)
+            except Exception as e:
+                self._link_down(sock, f"send failed: {e}")
+
+    def request(self, cmd_id, data=b'', timeout=1.0):
+        """Sends a command and waits for its response. Returns the response
+        payload, or None on timeout."""
+        seq = self._get_seq()
+        pending = SiyiRequest(cmd_id)
+        self.pending[seq] = pending
+        try:
+            if not self.send(self._build_packet(cmd_id, data, seq, need_ack=True)):
+                return None
+            if not pending.event.wait(timeout):
+                self.request_timeouts += 1
+                return None
+            return pending.response
+        finally:
+            self.pending.pop(seq, None)
+
+    def _resolve(self, packet, seq, cmd_id, data_len):
+        pending = self.pending.get(seq)
+        if pending is None or pending.cmd_id != cmd_id:
+            pending = next((p for p in self.pending.values()
+                            if p.cmd_id == cmd_id and p.response is None), None)
+            if pending is None: return
+        pending.response = bytes(packet[8:8 + data_len])
+        self.rtt_ms = (time.monotonic() - pending.sent) * 1000
+        pending.event.set()
 
     def send_heartbeat(self):
         heartbeat_packet = b'\x55\x66\x01\x01\x00\x00\x00\x00\x00\x59\x8B'
         self.send(heartbeat_packet)
 
     def send_gimbal_speed(self, yaw_speed, pitch_speed):
-        data = struct.pack('<bb', yaw_speed, pitch_speed)
-        packet = self._build_packet(0x07, data)
-        self.send(packet)
+        """Sets the target speed, sent at once if the `gimbal_speed_rate_hz`
+        slot is open, else by the supervisor when due (see SendSlot);
+        stopping is sent immediately."""
+        target = (max(-100, min(100, int(yaw_speed))), max(-100, min(100, int(pitch_speed))))
+        now = time.monotonic()
+        self.speed_target = target
+        if target == self.speed_sent:
+            self.speed_received = None
+        elif target == (0, 0) or self.speed_slot.open(now):
+            self.speed_received = now
+            self._send_speed(target)
+        else:
+            self.speed_received = now
+
+    def stop_motion(self):
+        """Writes a zero-speed command directly, bypassing the queue (for shutdown)."""
+        self.speed_target = self.speed_sent = (0, 0)
+        self.speed_received = None
+        sock = self.sock
+        if sock is None: return
+        try: sock.sendall(self._build_packet(0x07, b'\x00\x00'))
+        except Exception: pass
+
+    def _send_speed(self, target):
+        received, self.speed_received = self.speed_received, None
+        if received is not None:
+            gimbal_schedule_latency.observe(time.monotonic() - received)
+        data = struct.pack('<bb', *target)
+        if self.send(self._build_packet(0x07, data), received):
+            self.speed_sent = target
+            self.speed_slot.sent(time.monotonic())
     
     def toggle_recording(self):
         """Sends Command 0x0C with payload 0x02 to toggle video recording."""
+        cmd_id = 0x0C
+        data = struct.pack('B', 0x02) # Payload 0x02 = Toggle Record
+        self.send(self._build_packet(cmd_id, data))
+
+    def query_recording(self):
+        """Asks the gimbal for its configuration (0x0A). Returns True/False for
+        the recording state, or None if it did not answer."""
+        response = self.request(0x0A)
+        if not response or len(response) < 4: return None
+        return response[3] == 1 # record_sta: 0 idle, 1 recording, 2 no TF card, 3 data loss
+
+    def set_recording(self, wanted):
+        """Toggles SD card recording until the gimbal reports `wanted`."""
         try:
-            cmd_id = 0x0C
-            data = struct.pack('B', 0x02) # Payload 0x02 = Toggle Record
-            packet = self._build_packet(cmd_id, data)
-            self.send(packet)
-            
-            self.is_recording = not self.is_recording
-            status = "STARTED" if self.is_recording else "STOPPED"
-            print(f"🎥 Camera recording {status}")
+            state = self.query_recording()
+            if state is None: state = self.is_recording
+            if state != wanted:
+                self.toggle_recording()
+                socketio.sleep(0.3)
+                state = self.query_recording()
+                if state is None:
+                    logging.warning("Gimbal did not confirm recording state")
+                    state = wanted
+            self.is_recording = state
+            status = "STARTED" if state else "STOPPED"
+            logging.info(f"🎥 Camera recording {status}", extra={'console': True})
+            socketio.emit('recording_status', {'recording': state})
         except Exception as e:
-            print(f"Error toggling recording: {e}")
+            logging.error(f"Error toggling recording: {e}", extra={'console': True})
 
     def request_attitude_stream(self):
         data_type = 1
@@ -227,410 +1062,3106 @@ class SiyiTCPProtocol:
         data = struct.pack('<BB', data_type, data_freq)
         packet = self._build_packet(0x25, data)
         self.send(packet)
-        print("Requested 20Hz gimbal attitude stream.")
+        logging.info("Requested 20Hz gimbal attitude stream.", extra={'console': True})
 
-    def receive_loop(self):
-        buffer = b''
+    def supervisor_loop(self):
+        backoff = self.RECONNECT_MIN
+        next_attempt = 0
+        last_heartbeat = 0
         while True:
             try:
-                data = self.sock.recv(1024)
-                if not data:
-                    print("Gimbal disconnected.")
-                    break
-                buffer += data
-                while len(buffer) > 10: 
-                    if buffer[0:2] == b'\x55\x66':
-                        data_len = struct.unpack('<H', buffer[3:5])[0]
-                        packet_len = 10 + data_len
-                        if len(buffer) >= packet_len:
-                            packet = buffer[0:packet_len]
-                            self.parse_packet(packet)
-                            buffer = buffer[packet_len:]
+                now = time.monotonic()
+                sock = self.sock
+                if sock is None:
+                    if now >= next_attempt:
+                        if self.connect():
+                            backoff = self.RECONNECT_MIN
                         else:
-                            break
-                    else:
-                        buffer = buffer[1:]
+                            next_attempt = now + backoff
+                            backoff = min(backoff * 2, self.RECONNECT_MAX)
+                elif now - self.last_rx > self.LINK_TIMEOUT:
+                    self._link_down(sock, "no data from gimbal")
+                    next_attempt = 0
+                else:
+                    if now - last_heartbeat >= self.HEARTBEAT_INTERVAL:
+                        self.send_heartbeat()
+                        last_heartbeat = now
+                    received = self.speed_received
+                    if self.speed_target != self.speed_sent and (
+                            received is None or self.speed_slot.wait(now, received) <= 0):
+                        self._send_speed(self.speed_target)
+            except Exception as e:
+                logging.error(f"Gimbal supervisor error: {e}")
+            delay = self.speed_slot.interval
+            received = self.speed_received
+            if received is not None and self.sock is not None:
+                delay = min(delay, self.speed_slot.wait(time.monotonic(), received))
+            socketio.sleep(max(0.001, delay))
+
+    def receive_loop(self, sock):
+        framer = self.framer
+        while self.sock is sock:
+            try:
+                if not framer.recv_into(sock):
+                    self._link_down(sock, "closed by gimbal")
+                    break
+                self.last_rx = time.monotonic()
+                for packet in framer.frames():
+                    self.parse_packet(packet)
             except socket.timeout:
                 continue
             except Exception as e:
-                print(f"Error in gimbal receive loop: {e}")
+                self._link_down(sock, f"receive error: {e}")
                 break
 
     def parse_packet(self, packet):
+        """Handles one CRC-checked packet (a memoryview, valid only during the call)."""
         cmd_id = packet[7]
-        data_len = struct.unpack('<H', packet[3:5])[0]
-        data = packet[8:8 + data_len]
+        data_len = packet[3] | (packet[4] << 8)
         if cmd_id == 0x0D and data_len >= 6:
-            # Rate Limit: Max 10Hz (0.1s)
-            now = time.time()
-            if now - self.last_gimbal_emit > 0.1:
-                yaw_raw, pitch_raw, roll_raw = struct.unpack('<hhh', data[0:6])
-                socketio.emit('gimbal_attitude', {
+            yaw_raw, pitch_raw, roll_raw = struct.unpack_from('<hhh', packet, 8)
+            recorder.record(REC_ATTITUDE, (yaw_raw / 10.0, pitch_raw / 10.0, roll_raw / 10.0))
+            # last_rx is this packet's arrival time
+            vehicle_state.add_gimbal(self.last_rx, yaw_raw / 10.0, pitch_raw / 10.0, roll_raw / 10.0)
+            if telemetry.wants('gimbal_attitude'):
+                telemetry.publish('gimbal_attitude', {
                     'pitch': pitch_raw / 10.0,
                     'roll': roll_raw / 10.0,
                     'yaw': yaw_raw / 10.0
                 })
-                self.last_gimbal_emit = now
+        elif self.pending:
+            self._resolve(packet, packet[5] | (packet[6] << 8), cmd_id, data_len)
 
-# --- Background Threads ---
-def heartbeat_loop(gimbal_obj):
-    while True:
-        try:
-            gimbal_obj.send_heartbeat()
-            socketio.sleep(2) 
-        except Exception as e:
-            break
+    def stats(self):
+        return {
+            'connected': self.sock is not None,
+            'connects': self.connects,
+            'rtt_ms': self.rtt_ms,
+            'request_timeouts': self.request_timeouts,
+            'dropped_packets': self.dropped_packets,
+            'queued_packets': self.outbox.qsize(),
+            'tx_packets': self.tx_packets,
+            'recording': self.is_recording,
+            **self.framer.stats(),
+        }
 
+# --- Background Threads ---
 
-def init_serial():
+def init_serial(report=True):
     global ser
+    port = config.get('serial_port', SERIAL_PORT)
     try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+        if config.get('serial_backend') == 'sim':
+            import sim
+            if 'rover' not in simulators:
+                simulators['rover'] = sim.RoverEmulator(config.get('sim_imu_rate_hz', 50)).start()
+            port = simulators['rover'].port
+        ser = serial.Serial(port, BAUD_RATE, timeout=1)
         ser.reset_input_buffer() # Flush old data
-        print(f"✅ Opened rover serial port {SERIAL_PORT}.")
+        logging.info(f"✅ Opened rover serial port {port}.", extra={'console': True})
         return True
     except Exception as e:
-        print(f"🛑 Error opening serial port: {e}")
+        if report: logging.error(f"🛑 Error opening serial port: {e}", extra={'console': True})
         return False
 
-# --- GStreamer ---
-# --- Logging ---
-import logging
-logging.basicConfig(filename='server.log', level=logging.INFO, 
-                    format='%(asctime)s %(levelname)s: %(message)s')
+def serial_bringup():
+    """Opens the rover port, retrying while it is absent (a USB adapter can
+    enumerate after we start), then reads it."""
+    delay = 0.25
+    attempts = 0
+    while not init_serial(report=attempts == 0):
+        attempts += 1
+        socketio.sleep(delay)
+        delay = min(delay * 2, 5.0)
+    read_serial_thread()
 
-# --- GStreamer ---
-class FrameReader(threading.Thread):
-    def __init__(self, process):
-        super().__init__()
-        self.process = process
-        self.latest_frame = None
-        self.running = True
-        self.daemon = True
+# --- Telemetry Subscriptions ---
+class Decimator:
+    """Lets through at most `rate` events per second on average. An event is
+    accepted from half an interval before its slot, so a source running at
+    about the same rate (a relay's upstream, a 50 Hz IMU into a 50 Hz room)
+    isn't halved by jitter."""
+    __slots__ = ('interval', 'due')
 
-    def run(self):
-        while self.running and self.process.poll() is None:
-            try:
-                # Read frame header (multipart boundary)
-                # This is a simplified reader assuming MJPEG multipart stream
-                # In a robust production env, we might want a more sophisticated parser
-                # But for now, we just read chunks to keep the pipe draining
-                chunk = self.process.stdout.read(4096)
-                if not chunk: break
-                # We are not actually parsing frames here to save CPU, 
-                # just draining the pipe. 
-                # For the actual video feed, we might need a different approach 
-                # if we want to broadcast to multiple clients.
-                # However, the original issue is BLOCKING.
-                # So let's just ensure we read everything.
-                
-                # WAIT! The original code yielded chunks directly to the client.
-                # If no client is connected, the pipe fills up and blocks.
-                # We need to buffer the LATEST frame and yield that.
-                pass 
-            except Exception as e:
-                logging.error(f"FrameReader Error: {e}")
-                break
-        logging.info("FrameReader thread stopped")
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.due = 0.0
 
-# Actually, a better approach for MJPEG stream from GStreamer to Flask 
-# is to let GStreamer push to a UDP sink or similar, OR just read and discard if no clients.
-# But to keep it simple and compatible with the current setup:
-# We will use a global variable to store the latest frame (if we were parsing)
-# OR we just read and discard if no one is listening?
-# The issue is `generate_frames` is only called when a client connects.
-# If no client, `stream_process` is running but stdout is not being read. -> BLOCK.
+    def ready(self, now):
+        if now < self.due - self.interval / 2: return False
+        # Slots follow the schedule, so early events can't add up to a burst
+        self.due = max(self.due, now) + self.interval
+        return True
 
-# FIXED APPROACH:
-# Start a background thread that ALWAYS reads stdout.
-# It puts chunks into a queue or just broadcasts them?
-# Since Flask `Response` needs a generator, we can use a specialized class.
+# Binary telemetry (opt-in per client, event 'telemetry_bin'):
+#   header  <BBH  topic id, record count, frame sequence
+#   record  <I + one float32 per field  (timestamp in ms of the server's monotonic clock)
+# All little-endian. templates/dashboard.html carries the matching decoder.
+BINARY_HEADER = struct.Struct('<BBH')
+NAN = float('nan')
+VEHICLE_STATE_FIELDS = ('roll', 'pitch', 'yaw', 'voltage', 'battery_percent',
+                        'gimbal_yaw', 'gimbal_pitch', 'gimbal_roll', 'camera_heading', 'camera_tilt',
+                        'imu_age_ms', 'gimbal_age_ms')
+# Scalar system_data fields (cpu_cores is JSON only); see SystemMonitor
+SYSTEM_DATA_FIELDS = ('cpu_temp', 'cpu_percent', 'cpu_mhz', 'throttled', 'mem_percent', 'load1',
+                      'gst_cpu', 'gst_rss_mb', 'proc_cpu', 'proc_rss_mb', 'threads', 'greenlets')
+BINARY_LAYOUTS = {
+    'imu_data': (1, ('roll', 'pitch', 'yaw', 'voltage', 'battery_percent')),
+    'gimbal_attitude': (2, ('yaw', 'pitch', 'roll')),
+    'system_data': (3, SYSTEM_DATA_FIELDS),
+    'vehicle_state': (4, VEHICLE_STATE_FIELDS),
+}
+BINARY_RECORDS = {topic: struct.Struct('<I' + 'f' * len(fields))
+                  for topic, (_, fields) in BINARY_LAYOUTS.items()}
+BINARY_FLUSH_HZ = 10 # Faster binary subscriptions are batched down to this many frames/s
 
-class NonBlockingStreamReader:
-    def __init__(self, stream):
-        self.stream = stream
-        self.q = [] # We'll just keep the last few chunks? No, that's complex.
-        # Simple fix: Just read continuously in a thread.
-        # If a client is connected, they get the data.
-        # If not, data is dropped? 
-        # But we need the data for the client!
-        
-        # Let's use a list of active queues (one per client)
-        self.clients = []
-        self.lock = threading.Lock()
-        self.running = True
-        self.thread = threading.Thread(target=self._populate_queues)
-        self.thread.daemon = True
-        self.thread.start()
+class TelemetryChannel:
+    """One Socket.IO room per (topic, rate, encoding). Members share the
+    decimation and the encoded output: JSON rooms track what they were last
+    sent so deltas are computed once per room rather than once per socket,
+    binary rooms batch fixed-size records."""
+    __slots__ = ('topic', 'rate', 'encoding', 'room', 'decimator', 'last', 'members',
+                 'batch', 'pending', 'count', 'seq')
 
-    def _populate_queues(self):
-        while self.running:
-            try:
-                chunk = self.stream.read(4096)
-                if not chunk: break
-                with self.lock:
-                    if self.clients:
-                        for q in self.clients:
-                            try: q.put_nowait(chunk)
-                            except: pass # Queue full, drop frame for that client
-            except Exception as e:
-                logging.error(f"StreamReader Error: {e}")
-                break
+    def __init__(self, topic, rate, encoding):
+        self.topic = topic
+        self.rate = rate
+        self.encoding = encoding
+        self.room = f"{topic}@{rate:g}" + (':bin' if encoding == 'binary' else '')
+        self.decimator = Decimator(rate)
+        self.last = {}
+        self.members = 0
+        self.batch = max(1, round(rate / BINARY_FLUSH_HZ))
+        self.pending = bytearray()
+        self.count = 0
+        self.seq = 0
 
-    def get_client_queue(self):
-        import queue
-        q = queue.Queue(maxsize=10)
-        with self.lock:
-            self.clients.append(q)
-        return q
+    def add_record(self, data, now):
+        """Appends one binary record; returns a complete frame once the batch is full."""
+        fields = BINARY_LAYOUTS[self.topic][1]
+        # Missing values (None) go out as NaN
+        self.pending += BINARY_RECORDS[self.topic].pack(
+            int(now * 1000) & 0xFFFFFFFF, *[NAN if (v := data.get(f, 0.0)) is None else v for f in fields])
+        self.count += 1
+        if self.count < self.batch: return None
+        self.seq = (self.seq + 1) & 0xFFFF
+        frame = BINARY_HEADER.pack(BINARY_LAYOUTS[self.topic][0], self.count, self.seq) + self.pending
+        self.pending.clear()
+        self.count = 0
+        return frame
 
-    def remove_client_queue(self, q):
-        with self.lock:
-            if q in self.clients:
-                self.clients.remove(q)
+class TelemetryHub:
+    """Per-client telemetry subscriptions.
 
-reader = None
+    Clients emit `subscribe` with {topic: rate_hz}, optionally with
+    'encoding': 'binary'. Rates are snapped down to RATES so clients asking
+    for similar rates share a room. JSON rooms get the topic's fields that
+    changed since their previous update (a client joining first receives the
+    room's full state); binary rooms get batched fixed-layout records.
+    """
 
-def start_streamer():
-    global stream_process, reader
-    
-    # Stop existing stream if any
-    if stream_process:
-        stream_process.terminate()
-        stream_process.wait()
-        stream_process = None
-        reader = None
+    # topic: (default Hz, max Hz)
+    TOPICS = {
+        'imu_data': (10, 50),
+        'gimbal_attitude': (10, 20),
+        'system_data': (0.5, 1),
+        'vehicle_state': (10, 20), # IMU + gimbal fused per tick (see VehicleState)
+        'stats': (0, 1), # Server metrics summary, opt-in
+    }
+    RATES = (0.5, 1, 2, 5, 10, 20, 30, 50)
+    ENCODINGS = ('json', 'binary')
 
-    mode = config.get('camera_mode', 'siyi')
-    command = get_gstreamer_command(mode)
-    logging.info(f"Starting GStreamer in [{mode}] mode...")
-    print(f"Starting GStreamer in [{mode}] mode...")
-    
-    try:
-        stream_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=10**8)
-        logging.info(f"GStreamer started PID: {stream_process.pid}")
-        
-        # Start the non-blocking reader
-        reader = NonBlockingStreamReader(stream_process.stdout)
+    def __init__(self):
+        self.channels = {topic: {} for topic in self.TOPICS} # topic -> {(rate, encoding): channel}
+        self.clients = {} # sid -> {topic: channel}
+        self.encodings = {} # sid -> encoding
 
-        def log_errors():
-            if stream_process and stream_process.stderr:
-                for line in stream_process.stderr: 
-                    msg = line.decode('utf-8', errors='ignore').strip()
-                    # Silence common GStreamer INFO/Camera noise
-                    if "INFO" in msg or "Camera" in msg or "RPI" in msg or "IPAProxy" in msg:
-                        continue
-                    print(f"[gst] {msg}")
-                    logging.error(f"[gst] {msg}")
-        socketio.start_background_task(log_errors)
-    except Exception as e:
-        logging.error(f"GStreamer failed: {e}")
-        print(f"🛑 GStreamer failed: {e}")
+    def snap_rate(self, topic, rate):
+        rate = min(rate, self.TOPICS[topic][1])
+        allowed = [r for r in self.RATES if r <= rate]
+        return allowed[-1] if allowed else self.RATES[0]
 
-def generate_frames():
-    global reader
-    if not reader: return
-    
-    q = reader.get_client_queue()
-    try:
-        while True:
-            chunk = q.get()
-            yield chunk
-    except GeneratorExit:
-        reader.remove_client_queue(q)
-    except Exception:
-        reader.remove_client_queue(q)
+    def set_encoding(self, sid, encoding):
+        """Switches every current subscription of `sid` to `encoding`.
+        Topics without a binary layout stay JSON."""
+        self.encodings[sid] = encoding
+        for topic, channel in list(self.clients.get(sid, {}).items()):
+            if topic in BINARY_LAYOUTS and channel.encoding != encoding:
+                self.subscribe(sid, topic, channel.rate)
 
-# --- Routes & Events ---
-@app.route('/')
-def index(): return render_template('dashboard.html')
+    def subscribe(self, sid, topic, rate):
+        """Moves `sid` to the room for `rate` (0 unsubscribes). Returns the
+        granted rate."""
+        subscriptions = self.clients.setdefault(sid, {})
+        self._leave(sid, subscriptions.pop(topic, None))
+        if rate <= 0: return 0
+        rate = self.snap_rate(topic, rate)
+        encoding = self.encodings.get(sid, 'json') if topic in BINARY_LAYOUTS else 'json'
+        channel = self.channels[topic].get((rate, encoding))
+        if channel is None:
+            channel = self.channels[topic][rate, encoding] = TelemetryChannel(topic, rate, encoding)
+        socketio.server.enter_room(sid, channel.room, namespace='/')
+        channel.members += 1
+        subscriptions[topic] = channel
+        if channel.last:
+            socketio.emit(topic, channel.last, to=sid)
+        return rate
 
-@app.route('/config')
-def config_page():
-    return render_template('config.html', mode=config.get('camera_mode', 'siyi'))
+    def _leave(self, sid, channel):
+        if channel is None: return
+        socketio.server.leave_room(sid, channel.room, namespace='/')
+        channel.members -= 1
+        if not channel.members:
+            del self.channels[channel.topic][channel.rate, channel.encoding]
 
-@app.route('/api/config', methods=['POST'])
-def update_config():
-    data = request.json
-    if 'camera_mode' in data:
-        config['camera_mode'] = data['camera_mode']
-        save_config()
-        
-        # Re-init hardware based on new config
-        init_servo()
-        start_streamer()
-        
-        return jsonify({"status": "ok", "mode": config['camera_mode']})
-    return jsonify({"status": "error"}), 400
+    def remove_client(self, sid):
+        self.encodings.pop(sid, None)
+        for channel in self.clients.pop(sid, {}).values():
+            self._leave(sid, channel)
 
-@app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=--frame')
+    def wants(self, topic):
+        return bool(self.channels[topic])
 
-@app.route('/joystick_debug')
-def joystick_debug():
-    return render_template('joystick_debug.html')
+    def publish(self, topic, data, now=None):
+        channels = self.channels[topic]
+        if not channels: return
+        if now is None: now = time.monotonic()
+        for channel in list(channels.values()):
+            if not channel.decimator.ready(now): continue
+            if channel.encoding == 'binary':
+                frame = channel.add_record(data, now)
+                if frame: socketio.emit('telemetry_bin', frame, to=channel.room)
+                continue
+            last = channel.last
+            delta = {k: v for k, v in data.items() if k not in last or last[k] != v}
+            if delta:
+                last.update(delta)
+                socketio.emit(topic, delta, to=channel.room)
 
-@socketio.on('connect')
-def handle_connect():
-    global connected_clients_count, ser
-    connected_clients_count += 1
-    if ser:
-        socketio.emit('serial_status', {'status': 'connected'})
-        if connected_clients_count == 1:
-            try: ser.write(b'{"T": 131, "cmd": 1}\n')
-            except: pass
-    else:
-        socketio.emit('serial_status', {'status': 'disconnected'})
+telemetry = TelemetryHub()
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    global connected_clients_count, ser, gimbal
-    connected_clients_count -= 1
-    if connected_clients_count == 0:
-        if ser:
-            try: ser.write(b'{"T": 131, "cmd": 0}\n')
-            except: pass
-        if gimbal:
-            try: gimbal.send_gimbal_speed(0, 0)
-            except: pass
+# --- Rover Telemetry ---
+class ImuSample:
+    """One rover telemetry frame, timestamped (monotonic) on arrival."""
+    __slots__ = ('t', 'roll', 'pitch', 'yaw', 'voltage', 'battery_percent')
+    FIELDS = ('roll', 'pitch', 'yaw', 'voltage', 'battery_percent')
 
-@socketio.on('control')
-def handle_control(data):
-    global ser
-    if ser:
-        try:
-            cmd = json.dumps({"T": 1, "L": data['L'], "R": data['R']}) + '\n'
-            ser.write(cmd.encode('utf-8'))
-        except: pass
+    def __init__(self, t, roll=0.0, pitch=0.0, yaw=0.0, voltage=0.0, battery_percent=0.0):
+        self.t = t
+        self.roll = roll
+        self.pitch = pitch
+        self.yaw = yaw
+        self.voltage = voltage
+        self.battery_percent = battery_percent
 
-@socketio.on('joystick_command')
-def handle_joystick(data):
-    global gimbal, servo
-    mode = config.get('camera_mode', 'siyi')
-    
-    yaw_val = data.get('yaw', 0.0)
-    pitch_val = data.get('pitch', 0.0)
+    @classmethod
+    def from_json(cls, t, obj):
+        get = obj.get
+        return cls(t, float(get('roll', 0.0)), float(get('pitch', 0.0)), float(get('yaw', 0.0)),
+                   float(get('voltage', 0.0)), float(get('battery_percent', 0.0)))
 
-    if mode == 'siyi' and gimbal:
-        try:
-            gimbal.send_gimbal_speed(int(yaw_val*100), int(pitch_val*100))
-        except: pass
-        
-    elif mode == 'picam' and servo:
-        # Map pitch (-1.0 to 1.0) to servo angle (-90 to 90)
-        # Invert pitch if needed based on mechanical setup
-        angle = pitch_val * 90 
-        try:
-            servo.angle = angle
-        except: pass
+    def to_dict(self):
+        return {'roll': self.roll, 'pitch': self.pitch, 'yaw': self.yaw,
+                'voltage': self.voltage, 'battery_percent': self.battery_percent}
 
-@socketio.on('set_arm_state')
-def handle_arm_state(data):
-    global gimbal
-    if not gimbal: return
-    is_armed = data.get('state', False)
-    
-    # Auto-Recording Logic (Only for SIYI for now)
-    if is_armed and not gimbal.is_recording:
-        print("ARMED: Starting Recording")
-        gimbal.toggle_recording()
-    elif not is_armed and gimbal.is_recording:
-        print("DISARMED: Stopping Recording")
-        gimbal.toggle_recording()
+class SerialIngest:
+    """Frames newline-terminated JSON from raw serial bytes and parses every
+    frame. Full-rate samples go to every subscribed sink; rate limiting for
+    the UI is a sink's own business."""
 
-def cleanup():
-    global ser, gimbal, stream_process, servo
-    if stream_process: stream_process.terminate()
-    if ser: ser.write(b'{"T": 131, "cmd": 0}\n')
-    if gimbal: gimbal.send_gimbal_speed(0, 0)
-    if servo: servo.close()
+    MAX_LINE = 1024 # Longer than any real frame: the line is garbage
 
-    print("🛑 Server stopping...")
+    def __init__(self):
+        self.buffer = bytearray()
+        self.sinks = []
+        self.latest = None
+        self.bytes_read = 0
+        self.lines = 0
+        self.samples = 0
+        self.json_errors = 0
+        self.garbage_lines = 0
+        self.dropped_bytes = 0
 
-# --- System Monitoring ---
-def get_cpu_temp():
+    def subscribe(self, sink):
+        self.sinks.append(sink)
+
+    def feed(self, data, t):
+        """Consumes a chunk of serial bytes received at monotonic time `t`."""
+        self.bytes_read += len(data)
+        buf = self.buffer
+        buf += data
+        start = 0
+        while True:
+            nl = buf.find(b'\n', start)
+            if nl < 0: break
+            self._handle_line(buf, start, nl, t)
+            start = nl + 1
+        if start: del buf[:start]
+        if len(buf) > self.MAX_LINE:
+            self.dropped_bytes += len(buf)
+            buf.clear()
+
+    def _handle_line(self, buf, start, end, t):
+        self.lines += 1
+        # Robust Extraction: Find first '{' and last '}'
+        first = buf.find(b'{', start, end)
+        last = buf.rfind(b'}', start, end)
+        if first < 0 or last < first:
+            if buf[start:end].strip():
+                self.garbage_lines += 1
+                # Checked first so a noisy line costs no formatting unless DEBUG is on
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug(f"IGNORED SERIAL: {bytes(buf[start:end])!r}", extra={'key': 'serial_ignored'})
+            return
+        try:
+            obj = json.loads(buf[first:last + 1])
+            sample = ImuSample.from_json(t, obj)
+        except (ValueError, TypeError, AttributeError):
+            self.json_errors += 1
+            return
+        self.samples += 1
+        self.latest = sample
+        telemetry_parse_latency.observe(time.monotonic() - t)
+        for sink in self.sinks:
+            try: sink(sample)
+            except Exception as e: logging.error(f"Serial sink error: {e}")
+
+    def stats(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'lines': self.lines,
+            'samples': self.samples,
+            'json_errors': self.json_errors,
+            'garbage_lines': self.garbage_lines,
+            'dropped_bytes': self.dropped_bytes,
+        }
+
+serial_ingest = SerialIngest()
+
+def emit_imu_ui(sample):
+    if telemetry.wants('imu_data'):
+        telemetry.publish('imu_data', sample.to_dict(), sample.t)
+        telemetry_emit_latency.observe(time.monotonic() - sample.t)
+
+serial_ingest.subscribe(emit_imu_ui)
+
+# --- Rover Motor Control ---
+class ControlScheduler:
+    """Writes the latest L/R setpoint to the rover serial port at a fixed rate.
+
+    Browsers emit `control` on every animation frame, from every open tab.
+    A new setpoint is written at once if the `control_rate_hz` slot is open,
+    else it overwrites the target (latest wins) and `run` writes it when it
+    is due (see SendSlot); values already sent are skipped. Zero-speed
+    commands bypass the limit, and the dead-man timer stops the motors when
+    setpoints stop arriving.
+    """
+
+    ZERO_COMMAND = b'{"T":1,"L":0,"R":0}\n'
+    STOP = (0.0, 0.0)
+
+    def __init__(self):
+        self.target = self.STOP
+        self.last_sent = None
+        self.last_sent_time = 0
+        self.last_setpoint_time = 0
+        self.target_received = None # Receive time of a target not yet written
+        self.slot = SendSlot('control_rate_hz')
+        self.setpoints = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.deadman_stops = 0
+
+    @staticmethod
+    def encode(left, right):
+        if left == 0 and right == 0:
+            return ControlScheduler.ZERO_COMMAND
+        return b'{"T":1,"L":%.3f,"R":%.3f}\n' % (left, right)
+
+    def set(self, left, right):
+        self.setpoints += 1
+        self.last_setpoint_time = time.monotonic()
+        target = (round(float(left), 3), round(float(right), 3))
+        self.target = target
+        recorder.record(REC_CONTROL, target)
+        if target == self.last_sent:
+            self.target_received = None
+        elif target == self.STOP or self.slot.open(self.last_setpoint_time):
+            self._write(target, self.last_setpoint_time)
+        else:
+            self.target_received = self.last_setpoint_time
+
+    def stop(self):
+        self.target = self.STOP
+        self._write(self.STOP)
+
+    def _write(self, setpoint, received=None):
+        """Writes `setpoint`; `received` is its socket.io receive time, for
+        the latency histograms (None for dead-man stops and keepalives)."""
+        self.target_received = None
+        if not ser: return
+        now = time.monotonic()
+        if received is not None:
+            rover_schedule_latency.observe(now - received)
+        # Taken before the write, which can yield to another handler, and
+        # counted as sent even on error so a dead port is not retried at full rate
+        self.last_sent = setpoint
+        self.last_sent_time = now
+        self.slot.sent(now)
+        try:
+            ser.write(self.encode(*setpoint))
+            self.writes += 1
+            if received is not None:
+                rover_write_latency.observe(time.monotonic() - received)
+        except Exception as e:
+            self.write_errors += 1
+            logging.error(f"Serial write error: {e}")
+
+    def _tick(self):
+        now = time.monotonic()
+        if self.target != self.STOP and now - self.last_setpoint_time > config.get('control_deadman_s', 0.5):
+            self.target = self.STOP
+            self.target_received = None
+            self.deadman_stops += 1
+            logging.warning("Control dead-man timeout: stopping motors")
+        target = self.target
+        if target != self.last_sent:
+            if self.target_received is None or self.slot.wait(now, self.target_received) <= 0:
+                self._write(target, self.target_received)
+        elif target != self.STOP and now - self.last_sent_time > config.get('control_keepalive_s', 1.0):
+            self._write(target)
+
+    def run(self):
+        while True:
+            try:
+                self._tick()
+            except Exception as e:
+                logging.error(f"Control scheduler error: {e}")
+            # Wake when a waiting setpoint is due, else poll for the dead-man and keepalive
+            delay = self.slot.interval
+            received = self.target_received
+            if received is not None:
+                delay = min(delay, self.slot.wait(time.monotonic(), received))
+            socketio.sleep(max(0.001, delay))
+
+    def stats(self):
+        return {
+            'setpoints': self.setpoints,
+            'writes': self.writes,
+            'write_errors': self.write_errors,
+            'deadman_stops': self.deadman_stops,
+            'target': self.target,
+        }
+
+control_scheduler = ControlScheduler()
+
+# --- Telemetry Flight Recorder ---
+# Segments are append-only files named after their first record (unix ms):
+#   <ms>.bin  records: <dBB wall time, type, n> + n float32 values
+#   <ms>.idx  sparse index: <dQ time of the first record in a flush, byte offset>
+# One index entry is written per flush, so a time lookup is a binary search
+# in the index followed by a short forward scan.
+RECORD_HEADER = struct.Struct('<dBB')
+RECORD_INDEX = struct.Struct('<dQ')
+REC_IMU, REC_ATTITUDE, REC_CONTROL, REC_STATE = 1, 2, 3, 4
+RECORD_TYPES = {
+    REC_IMU: ('imu', ImuSample.FIELDS),
+    REC_ATTITUDE: ('attitude', ('yaw', 'pitch', 'roll')),
+    REC_CONTROL: ('control', ('L', 'R')),
+    REC_STATE: ('vehicle_state', VEHICLE_STATE_FIELDS), # NaN where a source was missing
+}
+
+class FlightRecorder:
+    """Records telemetry to segmented binary logs without blocking ingest.
+
+    `record` only packs into an in-memory buffer; `run` flushes it every
+    FLUSH_INTERVAL, rotates segments at `recorder_segment_mb` and deletes
+    the oldest segments beyond `recorder_quota_mb`. Reads go through mmap.
+    """
+
+    FLUSH_INTERVAL = 0.5
+    MAX_BUFFER = 4 * 1024 * 1024 # Drop records rather than grow without bound if the disk stalls
+    MAX_POINTS = 10000 # Per type and query; bounds the response a plot can ask for
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.first_t = None
+        self.write_lock = threading.Lock() # One flush on the disk at a time
+        self.segment = None
+        self.index = None
+        self.segment_size = 0
+        self.records = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.structs = {rec_type: struct.Struct(RECORD_HEADER.format + 'f' * len(fields))
+                        for rec_type, (_, fields) in RECORD_TYPES.items()}
+
+    @property
+    def directory(self):
+        return config.get('recorder_dir', 'recordings/telemetry')
+
+    def record(self, rec_type, values, t=None):
+        if not config.get('recorder_enabled', True): return
+        if len(self.buffer) > self.MAX_BUFFER:
+            self.dropped += 1
+            return
+        if t is None: t = time.time()
+        if self.first_t is None: self.first_t = t
+        self.buffer += self.structs[rec_type].pack(t, rec_type, len(values), *values)
+        self.records += 1
+
+    def flush(self):
+        """Swaps out the buffer and writes it on io_pool, yielding until done."""
+        if not self.buffer: return
+        data, first_t = self.buffer, self.first_t
+        self.buffer, self.first_t = bytearray(), None
+        with self.write_lock:
+            io_pool.apply(self._write, (data, first_t))
+
+    def _write(self, data, first_t):
+        # Runs on an io_pool thread: no gevent or Socket.IO calls in here
+        if self.segment is None or self.segment_size + len(data) > config.get('recorder_segment_mb', 16) * 1024 * 1024:
+            self._rotate(first_t)
+        self.index.write(RECORD_INDEX.pack(first_t, self.segment_size))
+        self.segment.write(data)
+        self.segment.flush()
+        self.index.flush()
+        self.segment_size += len(data)
+
+    def _rotate(self, t):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, str(int(t * 1000)))
+        self.segment = open(base + '.bin', 'ab')
+        self.index = open(base + '.idx', 'ab')
+        self.segment_size = self.segment.tell()
+        self._enforce_quota()
+
+    def close(self):
+        if self.segment: self.segment.close()
+        if self.index: self.index.close()
+        self.segment = self.index = None
+
+    def _enforce_quota(self):
+        segments = self.segments()
+        quota = config.get('recorder_quota_mb', 512) * 1024 * 1024
+        total = sum(size for _, _, size in segments)
+        # Never delete the segment being written (the newest)
+        for _, base, size in segments[:-1]:
+            if total <= quota: break
+            for ext in ('.bin', '.idx'):
+                try: os.remove(base + ext)
+                except OSError: pass
+            total -= size
+            self.evicted += 1
+
+    def segments(self):
+        """[(start_time, base_path, size)] sorted oldest first."""
+        try: names = os.listdir(self.directory)
+        except OSError: return []
+        segments = []
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext != '.bin' or not stem.isdigit(): continue
+            path = os.path.join(self.directory, name)
+            segments.append((int(stem) / 1000.0, os.path.join(self.directory, stem), os.path.getsize(path)))
+        return sorted(segments)
+
+    def run(self):
+        while True:
+            socketio.sleep(self.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Recorder flush failed: {e}")
+
+    def _seek(self, base, start):
+        """Byte offset of the last flush that began at or before `start`."""
+        try:
+            with open(base + '.idx', 'rb') as f:
+                index = f.read()
+        except OSError:
+            return 0
+        lo, hi = 0, len(index) // RECORD_INDEX.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD_INDEX.unpack_from(index, mid * RECORD_INDEX.size)[0] <= start: lo = mid + 1
+            else: hi = mid
+        return RECORD_INDEX.unpack_from(index, (lo - 1) * RECORD_INDEX.size)[1] if lo else 0
+
+    def query(self, start, end, rec_types, max_points=1000):
+        """Returns {type name: {'t': [...], field: [...]}} for records in
+        [start, end], keeping at most one record per type per time bucket of
+        (end - start) / max_points, max_points clamped to 1..MAX_POINTS."""
+        max_points = min(max(max_points, 1), self.MAX_POINTS)
+        bucket = (end - start) / max_points
+        next_t = {rec_type: start for rec_type in rec_types}
+        result = {}
+        for rec_type in rec_types:
+            name, fields = RECORD_TYPES[rec_type]
+            result[name] = {'t': [], **{f: [] for f in fields}}
+        columns = {rec_type: [result[RECORD_TYPES[rec_type][0]][f] for f in ('t',) + RECORD_TYPES[rec_type][1]]
+                   for rec_type in rec_types}
+
+        segments = self.segments()
+        for i, (seg_start, base, size) in enumerate(segments):
+            seg_end = segments[i + 1][0] if i + 1 < len(segments) else float('inf')
+            if seg_end < start or seg_start > end or not size: continue
+            with open(base + '.bin', 'rb') as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                offset = self._seek(base, start)
+                while offset + RECORD_HEADER.size <= size:
+                    t, rec_type, n = RECORD_HEADER.unpack_from(mm, offset)
+                    payload = offset + RECORD_HEADER.size
+                    offset = payload + 4 * n
+                    if offset > size or t > end: break
+                    if t < next_t.get(rec_type, float('inf')): continue
+                    next_t[rec_type] = t + bucket
+                    cols = columns[rec_type]
+                    cols[0].append(t)
+                    for col, value in zip(cols[1:], struct.unpack_from('<%df' % n, mm, payload)):
+                        col.append(None if value != value else round(value, 4)) # NaN -> null
+        return result
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'dropped': self.dropped,
+            'evicted_segments': self.evicted,
+            'buffered_bytes': len(self.buffer),
+            'segment_bytes': self.segment_size,
+        }
+
+recorder = FlightRecorder()
+
+def record_imu(sample):
+    recorder.record(REC_IMU, (sample.roll, sample.pitch, sample.yaw, sample.voltage, sample.battery_percent))
+
+serial_ingest.subscribe(record_imu)
+
+# --- Vehicle State ---
+def wrap_angle(deg):
+    """-180 <= deg < 180"""
+    return (deg + 180.0) % 360.0 - 180.0
+
+class SampleRing:
+    """The last SIZE samples of one source, in flat preallocated arrays, so
+    recording a sample allocates nothing. Fields listed in `angles` are
+    interpolated along the shorter arc."""
+    SIZE = 16
+    __slots__ = ('width', 'times', 'values', 'angles', 'head', 'count')
+
+    def __init__(self, width, angles=()):
+        self.width = width
+        self.times = array('d', bytes(8 * self.SIZE))
+        self.values = array('d', bytes(8 * self.SIZE * width))
+        self.angles = angles
+        self.head = 0
+        self.count = 0
+
+    def add(self, t, values):
+        base = self.head * self.width
+        self.times[self.head] = t
+        for k, v in enumerate(values): self.values[base + k] = v
+        self.head = (self.head + 1) % self.SIZE
+        self.count = min(self.count + 1, self.SIZE)
+
+    @property
+    def newest(self):
+        return self.times[(self.head - 1) % self.SIZE] if self.count else None
+
+    def sample(self, t, out, offset):
+        """Writes the values at time `t` into out[offset:], interpolated
+        between the samples around `t` (the nearest one outside the buffered
+        span; no extrapolation). Returns False if there are no samples."""
+        if not self.count: return False
+        newer = None
+        older = None
+        for n in range(self.count):
+            i = (self.head - 1 - n) % self.SIZE
+            if self.times[i] <= t:
+                older = i
+                break
+            newer = i
+        w, values = self.width, self.values
+        if older is None or newer is None:
+            base = (older if newer is None else newer) * w
+            for k in range(w): out[offset + k] = values[base + k]
+            return True
+        t0, t1 = self.times[older], self.times[newer]
+        f = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+        a, b = older * w, newer * w
+        for k in range(w):
+            v0, v1 = values[a + k], values[b + k]
+            d = wrap_angle(v1 - v0) if k in self.angles else v1 - v0
+            out[offset + k] = v0 + d * f
+        for k in self.angles: out[offset + k] = wrap_angle(out[offset + k])
+        return True
+
+class VehicleState:
+    """Fuses rover IMU and gimbal attitude into one `vehicle_state` message per tick.
+
+    Sources only record (monotonic arrival time, values) into their rings.
+    `run` ticks at `vehicle_state_hz` and evaluates both sources at the same
+    instant, `vehicle_state_delay_ms` in the past, so that a sample on either
+    side usually exists and the values are interpolated rather than merely
+    the latest. Derived values (camera world heading and tilt) come from the
+    fused row. The tick goes to `vehicle_state` subscribers and, with
+    `vehicle_state_record`, to the flight recorder.
+    """
+
+    IMU, GIMBAL = 0, len(ImuSample.FIELDS) # Offsets into the fused row
+
+    def __init__(self):
+        self.imu = SampleRing(len(ImuSample.FIELDS), angles=(0, 1, 2)) # roll, pitch, yaw
+        self.gimbal = SampleRing(3, angles=(0, 1, 2)) # yaw, pitch, roll
+        self.row = [0.0] * (self.GIMBAL + 3)
+        self.ticks = 0
+
+    def add_imu(self, sample):
+        self.imu.add(sample.t, (sample.roll, sample.pitch, sample.yaw, sample.voltage, sample.battery_percent))
+
+    def add_gimbal(self, t, yaw, pitch, roll):
+        self.gimbal.add(t, (yaw, pitch, roll))
+
+    def compute(self, now):
+        """{field: value or None} at `now` minus the delay, or None if no
+        source has data."""
+        t = now - config.get('vehicle_state_delay_ms', 60) / 1000.0
+        max_age = config.get('vehicle_state_max_age_ms', 500) / 1000.0
+        row = self.row
+        imu_ok = self.imu.sample(t, row, self.IMU) and now - self.imu.newest <= max_age
+        gimbal_ok = self.gimbal.sample(t, row, self.GIMBAL) and now - self.gimbal.newest <= max_age
+        if not imu_ok and not gimbal_ok: return None
+        roll, pitch, yaw, voltage, battery, g_yaw, g_pitch, g_roll = row
+        if config.get('camera_mode', 'siyi') == 'siyi':
+            # SIYI reports yaw relative to the gimbal base, which turns with the rover
+            heading = wrap_angle(yaw + g_yaw) if imu_ok and gimbal_ok else None
+            tilt = g_pitch if gimbal_ok else None
+        else:
+            heading = yaw if imu_ok else None
+            tilt = servo_controller.position if servo_controller.servo else None
+        r = lambda v, ok=True: round(v, 2) if ok and v is not None else None
+        return {
+            'roll': r(roll, imu_ok), 'pitch': r(pitch, imu_ok), 'yaw': r(yaw, imu_ok),
+            'voltage': r(voltage, imu_ok), 'battery_percent': r(battery, imu_ok),
+            'gimbal_yaw': r(g_yaw, gimbal_ok), 'gimbal_pitch': r(g_pitch, gimbal_ok),
+            'gimbal_roll': r(g_roll, gimbal_ok),
+            'camera_heading': r(heading), 'camera_tilt': r(tilt),
+            'imu_age_ms': round((now - self.imu.newest) * 1000) if self.imu.count else None,
+            'gimbal_age_ms': round((now - self.gimbal.newest) * 1000) if self.gimbal.count else None,
+        }
+
+    def run(self):
+        while True:
+            socketio.sleep(1.0 / config.get('vehicle_state_hz', 20))
+            record = config.get('vehicle_state_record', True) and config.get('recorder_enabled', True)
+            if not record and not telemetry.wants('vehicle_state'): continue
+            try:
+                now = time.monotonic()
+                data = self.compute(now)
+                if data is None: continue
+                self.ticks += 1
+                telemetry.publish('vehicle_state', data, now)
+                if record:
+                    recorder.record(REC_STATE, [NAN if data[f] is None else data[f] for f in VEHICLE_STATE_FIELDS])
+            except Exception as e:
+                logging.error(f"Vehicle state error: {e}")
+
+vehicle_state = VehicleState()
+serial_ingest.subscribe(vehicle_state.add_imu)
+
+# --- GStreamer ---
+GST_NOISE = re.compile(rb'INFO|Camera|RPI|IPAProxy')
+
+# gst-launch writes a multipartmux stream to stdout. Each part looks like:
+#   --<boundary>\r\nContent-Type: image/jpeg\r\nContent-Length: N\r\n\r\n<N bytes of JPEG>
+# We parse whole parts and keep only the newest complete frame, so a slow
+# viewer skips frames instead of receiving torn ones.
+FRAME_BOUNDARY = b'frame'
+MAX_FRAME_SIZE = 4 * 1024 * 1024 # Anything larger is a corrupt Content-Length
+MAX_HEADER_LINE = 1024
+
+class Frame:
+    """A complete JPEG, pre-wrapped once as a multipart part for all viewers."""
+    __slots__ = ('seq', 'jpeg', 'part', 'timestamp')
+
+    def __init__(self, seq, jpeg):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.part = (b'--' + FRAME_BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                     + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+        self.timestamp = time.monotonic()
+
+class FrameClient:
+    """Per-viewer cursor into the shared latest-frame slot."""
+    __slots__ = ('id', 'last_seq', 'frames_sent', 'frames_skipped')
+
+    def __init__(self, id):
+        self.id = id
+        self.last_seq = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+class NonBlockingStreamReader:
+    """Drains the GStreamer pipe in a background greenlet and publishes whole
+    frames into a single versioned slot shared by every viewer. The pipe is
+    gevent's cooperative file object, so waiting on it never blocks the hub.
+
+    While `draining` is off the pipe is left to fill, which switches the
+    tier's branch off inside the pipeline (see tier_branches).
+    """
+
+    CATCH_UP_GAP = 0.005 # Parts arriving closer together than this were queued in the pipe
+
+    def __init__(self):
+        self.stream = None
+        self.draining = True
+        self.catching_up = False
+        self.stale_dropped = 0
+        self.clients = []
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.latest = None
+        self.seq = 0
+        self.bytes_read = 0
+        self.malformed_frames = 0
+        self.frames_skipped = 0 # Over all viewers, including departed ones
+        self.next_client_id = 1
+        self.running = False
+        self.thread = None
+        self.on_clients_changed = None # Called whenever a viewer joins or leaves
+
+    def attach(self, stream):
+        """Starts draining a new pipeline's stdout. Viewers and the last frame
+        are kept across pipeline restarts."""
+        self.stream = stream
+        self.running = True
+        self.catching_up = False
+        self.thread = socketio.start_background_task(self._read_frames, stream)
+
+    def set_draining(self, on):
+        with self.new_frame:
+            if on and not self.draining: self.catching_up = True
+            self.draining = on
+            self.new_frame.notify_all()
+
+    def detach(self):
+        with self.new_frame:
+            self.stream = None
+            self.running = False
+            self.new_frame.notify_all()
+
+    def _read_part(self, stream):
+        """Reads one multipart part. Returns the JPEG, b'' if the part was
+        unusable, or None at end of stream."""
+        # Resync on the next boundary line
+        line = stream.readline(MAX_HEADER_LINE)
+        while not line.startswith(b'--'):
+            if not line: return None
+            line = stream.readline(MAX_HEADER_LINE)
+
+        length = -1
+        while True:
+            line = stream.readline(MAX_HEADER_LINE)
+            if not line: return None
+            line = line.strip()
+            if not line: break
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                try: length = int(value)
+                except ValueError: pass
+
+        if length <= 0 or length > MAX_FRAME_SIZE:
+            return b''
+        jpeg = stream.read(length)
+        if len(jpeg) < length: return None
+        if not jpeg.startswith(b'\xff\xd8'):
+            return b''
+        return jpeg
+
+    def _read_frames(self, stream):
+        try:
+            while self.stream is stream:
+                try:
+                    with self.new_frame:
+                        self.new_frame.wait_for(lambda: self.draining or self.stream is not stream)
+                    if self.stream is not stream: break
+                    started = time.monotonic()
+                    jpeg = self._read_part(stream)
+                    if jpeg is None: break
+                    if not jpeg:
+                        self.malformed_frames += 1
+                        continue
+                    if self.catching_up:
+                        # What filled the pipe while it was off was encoded back then
+                        if time.monotonic() - started < self.CATCH_UP_GAP:
+                            self.stale_dropped += 1
+                            continue
+                        self.catching_up = False
+                    self.bytes_read += len(jpeg)
+                    with self.new_frame:
+                        self.seq += 1
+                        self.latest = Frame(self.seq, jpeg)
+                        self.new_frame.notify_all()
+                except Exception as e:
+                    logging.error(f"StreamReader Error: {e}")
+                    break
+        finally:
+            # Release the pipe now rather than whenever the FileObject is collected
+            try: stream.close()
+            except Exception: pass
+        with self.new_frame:
+            if self.stream is stream:
+                self.running = False
+                self.new_frame.notify_all()
+
+    def next_frame(self, client, timeout=None):
+        """Blocks until a frame newer than the client's last one exists and
+        returns the newest. Returns None on timeout."""
+        with self.new_frame:
+            self.new_frame.wait_for(lambda: self.seq > client.last_seq, timeout)
+            frame = self.latest
+        if frame is None or frame.seq <= client.last_seq:
+            return None
+        if client.last_seq:
+            skipped = frame.seq - client.last_seq - 1
+            client.frames_skipped += skipped
+            self.frames_skipped += skipped
+        client.last_seq = frame.seq
+        client.frames_sent += 1
+        return frame
+
+    def get_client_queue(self):
+        with self.lock:
+            client = FrameClient(self.next_client_id)
+            self.next_client_id += 1
+            self.clients.append(client)
+        if self.on_clients_changed: self.on_clients_changed()
+        return client
+
+    def remove_client_queue(self, client):
+        with self.lock:
+            if client not in self.clients: return
+            self.clients.remove(client)
+        if self.on_clients_changed: self.on_clients_changed()
+
+# --- H.264 Passthrough ---
+# mp4mux writes ftyp + moov once (the init segment), then a moof + mdat pair
+# per fragment. Fragments are kept in a short ring shared by all viewers; a
+# viewer joining, falling too far behind or crossing a pipeline restart
+# resumes at the newest fragment that starts with a keyframe, since skipping
+# arbitrary H.264 (unlike JPEGs) breaks decoding until the next IDR.
+MP4_MAX_BOX = 16 * 1024 * 1024
+MP4_NON_SYNC_SAMPLE = 0x00010000
+MP4_KEEPALIVE = b'\x00\x00\x00\x08free' # Empty top-level box, ignored by players
+
+def mp4_boxes(data, start, end):
+    """Yields (type, payload offset, box end) for the boxes in data[start:end]."""
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from('>Q', data, start + 8)[0], 16
+        if size < header or start + size > end: return
+        yield kind, start + header, start + size
+        start += size
+
+def mp4_starts_with_keyframe(moof):
+    """Whether a fragment's first sample is a sync sample, going by the
+    trun first-sample/per-sample flags or the tfhd defaults. Assumes it is
+    when the muxer wrote no flags at all."""
+    try:
+        for kind, start, end in mp4_boxes(moof, 8, len(moof)):
+            if kind != b'traf': continue
+            default_flags = None
+            for kind, pos, _ in mp4_boxes(moof, start, end):
+                flags = struct.unpack_from('>I', moof, pos)[0] & 0xFFFFFF
+                pos += 8 # version/flags, then track_ID (tfhd) or sample_count (trun)
+                if kind == b'tfhd':
+                    for bit, size in ((0x01, 8), (0x02, 4), (0x08, 4), (0x10, 4)):
+                        if flags & bit: pos += size
+                    if flags & 0x20: default_flags = struct.unpack_from('>I', moof, pos)[0]
+                elif kind == b'trun':
+                    if flags & 0x01: pos += 4 # data_offset
+                    if flags & 0x04:
+                        sample_flags = struct.unpack_from('>I', moof, pos)[0]
+                    elif flags & 0x400:
+                        pos += 4 * bool(flags & 0x100) + 4 * bool(flags & 0x200)
+                        sample_flags = struct.unpack_from('>I', moof, pos)[0]
+                    elif default_flags is not None:
+                        sample_flags = default_flags
+                    else:
+                        return True
+                    return not sample_flags & MP4_NON_SYNC_SAMPLE
+    except struct.error:
+        pass
+    return True
+
+def mp4_codec(init):
+    """RFC 6381 codec string ('avc1.PPCCLL') from the avcC box, for MSE."""
+    idx = init.find(b'avcC')
+    if idx < 0 or idx + 8 > len(init): return None
+    return 'avc1.%02X%02X%02X' % (init[idx + 5], init[idx + 6], init[idx + 7])
+
+class Fragment:
+    """One moof + mdat, with the init segment it decodes against."""
+    __slots__ = ('seq', 'data', 'key', 'init', 'timestamp')
+
+    def __init__(self, seq, data, key, init):
+        self.seq = seq
+        self.data = data
+        self.key = key
+        self.init = init
+        self.timestamp = time.monotonic()
+
+class FragmentClient:
+    """Per-viewer cursor into the fragment ring."""
+    __slots__ = ('id', 'last_seq', 'need_key', 'fragments_sent', 'fragments_skipped')
+
+    def __init__(self, id):
+        self.id = id
+        self.last_seq = 0
+        self.need_key = True
+        self.fragments_sent = 0
+        self.fragments_skipped = 0
+
+class Mp4FragmentReader:
+    """Drains the pipeline's fragmented MP4 pipe in a background greenlet and
+    fans fragments out to /video.mp4 viewers."""
+
+    RING = 128
+    MAX_LAG = 30 # Fragments behind the newest before a viewer skips ahead to a keyframe
+
+    def __init__(self):
+        self.stream = None
+        self.clients = []
+        self.lock = threading.Lock()
+        self.new_fragment = threading.Condition(self.lock)
+        self.ring = collections.deque(maxlen=self.RING)
+        self.codec = None
+        self.seq = 0
+        self.bytes_read = 0
+        self.malformed = 0
+        self.fragments_skipped = 0
+        self.next_client_id = 1
+        self.on_clients_changed = None
+
+    def attach(self, stream):
+        """Starts draining a new pipeline's MP4 pipe. Fragments of the old one
+        are dropped; current viewers resume at the new stream's first keyframe."""
+        with self.new_fragment:
+            self.stream = stream
+            self.ring.clear()
+            for client in self.clients: client.need_key = True
+        socketio.start_background_task(self._read_boxes, stream)
+
+    def detach(self):
+        with self.new_fragment:
+            self.stream = None
+            self.new_fragment.notify_all()
+
+    def _read_box(self, stream):
+        """Returns (type, whole box), or (None, None) at end of stream."""
+        header = stream.read(8)
+        if len(header) < 8: return None, None
+        size, kind = struct.unpack('>I4s', header)
+        if size == 1:
+            large = stream.read(8)
+            if len(large) < 8: return None, None
+            size = struct.unpack('>Q', large)[0]
+            header += large
+        if size < len(header) or size > MP4_MAX_BOX:
+            raise ValueError(f"bad {kind!r} box size {size}")
+        body = stream.read(size - len(header))
+        if len(body) < size - len(header): return None, None
+        return kind, header + body
+
+    def _read_boxes(self, stream):
+        init, init_boxes, moof = None, [], None
+        try:
+            # Don't stop reading while the pipeline runs: a full pipe would
+            # block the tee and with it the MJPEG branch
+            while self.stream is stream:
+                kind, box = self._read_box(stream)
+                if box is None: break
+                self.bytes_read += len(box)
+                if kind == b'ftyp':
+                    init_boxes = [box]
+                elif kind == b'moov':
+                    init = b''.join(init_boxes + [box])
+                    self.codec = mp4_codec(init)
+                elif kind == b'moof':
+                    moof = box
+                elif kind == b'mdat':
+                    if moof is None or init is None:
+                        self.malformed += 1
+                        continue
+                    self._publish(moof + box, mp4_starts_with_keyframe(moof), init)
+                    moof = None
+        except Exception as e:
+            # Box framing can't be resynced; the next pipeline start recovers
+            self.malformed += 1
+            logging.error(f"MP4 reader error: {e}")
+        finally:
+            try: stream.close()
+            except Exception: pass
+
+    def _publish(self, data, key, init):
+        with self.new_fragment:
+            self.seq += 1
+            self.ring.append(Fragment(self.seq, data, key, init))
+            self.new_fragment.notify_all()
+
+    def _pick(self, client):
+        ring = self.ring
+        if not ring or ring[-1].seq <= client.last_seq: return None
+        if not client.need_key and client.last_seq + 1 >= ring[0].seq and ring[-1].seq - client.last_seq <= self.MAX_LAG:
+            return ring[client.last_seq + 1 - ring[0].seq]
+        for fragment in reversed(ring):
+            if fragment.seq <= client.last_seq: break
+            if fragment.key: return fragment
+        return None
+
+    def next_fragment(self, client, timeout=None):
+        """Blocks until the client's next fragment exists and returns it.
+        Returns None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.new_fragment:
+            while True:
+                fragment = self._pick(client)
+                if fragment is not None: break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0: return None
+                self.new_fragment.wait(remaining)
+        if client.last_seq and fragment.seq > client.last_seq + 1:
+            skipped = fragment.seq - client.last_seq - 1
+            client.fragments_skipped += skipped
+            self.fragments_skipped += skipped
+        client.need_key = False
+        client.last_seq = fragment.seq
+        client.fragments_sent += 1
+        return fragment
+
+    def get_client(self):
+        with self.lock:
+            client = FragmentClient(self.next_client_id)
+            self.next_client_id += 1
+            self.clients.append(client)
+        if self.on_clients_changed: self.on_clients_changed()
+        return client
+
+    def remove_client(self, client):
+        with self.lock:
+            if client not in self.clients: return
+            self.clients.remove(client)
+        if self.on_clients_changed: self.on_clients_changed()
+
+    def stats(self):
+        return {
+            'codec': self.codec,
+            'viewers': len(self.clients),
+            'fragments': self.seq,
+            'bytes_read': self.bytes_read,
+            'malformed': self.malformed,
+            'fragments_skipped': self.fragments_skipped,
+        }
+
+h264_reader = Mp4FragmentReader()
+
+class StreamManager:
+    """Supervises the GStreamer process. Nothing here blocks the caller:
+    requests only change the desired state and `monitor_loop` converges on it.
+
+    - The pipeline starts when the reader registers its first viewer and is
+      stopped `stream_idle_timeout` seconds after the last one leaves. With
+      `stream_warm_standby` the idle pipeline is paused (SIGSTOP) instead, so
+      the next viewer only waits for a SIGCONT rather than RTSP/camera
+      negotiation.
+    - Camera mode switches happen in the background; viewers keep receiving
+      the last good frame until the new pipeline produces one.
+    - Viewers of either output (MJPEG or H.264 passthrough) keep the one
+      pipeline running; health is judged on the MJPEG frames.
+    - Each MJPEG tier has its own reader. Every tier branch is linked in the
+      pipeline, but only tiers with viewers (or with viewers in the last
+      `stream_idle_timeout` seconds) are drained and so encoded; the rest
+      are switched off in place. A change in the demanded tiers never
+      restarts the pipeline, so the other tiers and the H.264 passthrough
+      are not interrupted.
+    - A pipeline that exits, never produces a first frame, or stops producing
+      frames is restarted with exponential backoff.
+    """
+
+    BACKOFF_BASE = 1.0
+    STOP_GRACE = 3.0 # Seconds between SIGTERM and SIGKILL
+
+    def __init__(self, h264_reader):
+        self.readers = {} # Tier name -> NonBlockingStreamReader, created on first use
+        self.h264_reader = h264_reader
+        self.tiers = [] # Tiers in the current pipeline
+        self.tier_seen = {} # Tier name -> last time it had viewers
+        self.tier_fds = {} # Tier name -> fd number in the pipeline process
+        self.drained = [] # Tiers currently switched on
+        self.process = None
+        self.mode = None # Mode of the running pipeline
+        self.state = 'stopped' # stopped | starting | running | standby | backoff
+        self.lock = threading.Lock()
+        self.dying = [] # (process, kill_deadline) waiting to be reaped
+        self.idle_since = None
+        self.standby_since = None
+        self.start_time = None
+        self.start_seq = 0
+        self.first_frame_ms = None
+        self.last_frame_time = None
+        self.last_frame_seq = 0
+        self.failures = 0 # Consecutive, reset by the first frame
+        self.next_start = 0
+        self.restarts = 0
+        self.stalls = 0
+        self.switches = 0
+        self.fps = 0.0
+        self.bytes_per_s = 0.0
+        self._rate_time = time.monotonic()
+        self._rate_seq = 0
+        self._rate_bytes = 0
+        h264_reader.on_clients_changed = self.on_viewers_changed
+
+    def reader(self, tier=None):
+        """The frame reader for `tier` (default tier if None)."""
+        tier = tier or default_tier()
+        if tier not in self.readers:
+            reader = NonBlockingStreamReader()
+            reader.on_clients_changed = self.on_viewers_changed
+            self.readers[tier] = reader
+        return self.readers[tier]
+
+    @property
+    def viewers(self):
+        return sum(len(r.clients) for r in self.readers.values()) + len(self.h264_reader.clients)
+
+    @property
+    def frames(self):
+        return sum(r.seq for r in self.readers.values())
+
+    def _wanted_tiers(self, now):
+        """Tiers with viewers now or within the idle timeout, best first."""
+        for name, reader in self.readers.items():
+            if reader.clients: self.tier_seen[name] = now
+        idle_timeout = config.get('stream_idle_timeout', 10)
+        wanted = [name for name in video_tiers() if now - self.tier_seen.get(name, -idle_timeout - 1) <= idle_timeout]
+        return wanted or [default_tier()] # Health is judged on frames, so something is always drained
+
+    def _apply_tiers(self, now):
+        """Switches tier branches on and off inside the running pipeline.
+        A gst or sim branch turns itself off once its pipe fills; the relay
+        fetcher is told on stdin which upstream tiers to keep open."""
+        wanted = [name for name in self._wanted_tiers(now) if name in self.tiers]
+        for name in self.tiers: self.reader(name).set_draining(name in wanted)
+        if wanted == self.drained: return
+        self.drained = wanted
+        if self.process and self.process.stdin:
+            try:
+                self.process.stdin.write((' '.join(str(self.tier_fds[name]) for name in wanted) + '\n').encode())
+                self.process.stdin.flush()
+            except OSError as e:
+                logging.error(f"Relay tier switch failed: {e}")
+
+    def on_viewers_changed(self):
+        if self.viewers > 0:
+            self.idle_since = None
+            with self.lock:
+                if self.state == 'stopped': self._start()
+                elif self.state == 'standby': self._resume()
+                if self.state in ('starting', 'running'): self._apply_tiers(time.monotonic())
+        elif self.idle_since is None:
+            self.idle_since = time.monotonic()
+
+    @staticmethod
+    def _lower_priority():
+        """Runs in the forked child, so every pipeline thread inherits it."""
+        try: os.nice(config.get('stream_nice', 10))
+        except OSError: pass
+
+    def _start(self):
+        mode = config.get('camera_mode', 'siyi')
+        tiers = list(video_tiers()) # All linked; _apply_tiers picks the ones encoded
+        # Every output comes back on a pipe of its own; the child keeps the write ends' fd numbers
+        pipes = {name: os.pipe() for name in tiers}
+        h264_read, h264_write = os.pipe() if h264_supported(mode) else (None, None)
+        write_fds = [w for _, w in pipes.values()] + ([h264_write] if h264_write is not None else [])
+        command = get_gstreamer_command(mode, {name: w for name, (_, w) in pipes.items()}, h264_write)
+        logging.info(f"Starting GStreamer in [{mode}] mode, tiers {', '.join(tiers)}...", extra={'console': True})
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                       stdin=subprocess.PIPE if relay_mode() else subprocess.DEVNULL,
+                                       pass_fds=write_fds, preexec_fn=self._lower_priority)
+        except Exception as e:
+            logging.error(f"🛑 GStreamer failed: {e}", extra={'console': True})
+            for r, _ in pipes.values(): os.close(r)
+            if h264_read is not None: os.close(h264_read)
+            self._fail()
+            return False
+        finally:
+            for w in write_fds: os.close(w)
+        logging.info(f"GStreamer started PID: {process.pid}")
+        self.process = process
+        self.mode = mode
+        self.tiers = tiers
+        self.tier_fds = {name: w for name, (_, w) in pipes.items()}
+        self.drained = None # Not yet told
+        for name, (r, _) in pipes.items():
+            self.reader(name).attach(FileObject(r, 'rb'))
+        if h264_read is not None:
+            self.h264_reader.attach(FileObject(h264_read, 'rb'))
+        self._mark_starting()
+        self._apply_tiers(time.monotonic())
+
+        def log_errors():
+            for line in process.stderr:
+                # Silence common GStreamer INFO/Camera noise before paying for a decode
+                if GST_NOISE.search(line): continue
+                msg = line.decode('utf-8', errors='ignore').strip()
+                if msg: logging.error(f"[gst] {msg}", extra={'console': True, 'fields': {'pid': process.pid}})
+        socketio.start_background_task(log_errors)
+        return True
+
+    def _mark_starting(self):
+        self.state = 'starting'
+        self.start_time = time.monotonic()
+        self.start_seq = self.frames
+
+    def _pause(self):
+        try:
+            os.kill(self.process.pid, signal.SIGSTOP)
+        except Exception as e:
+            logging.error(f"GStreamer pause failed: {e}")
+            self._stop()
+            return
+        self.state = 'standby'
+        self.standby_since = time.monotonic()
+        logging.info("GStreamer paused (warm standby)")
+
+    def _resume(self):
+        try:
+            os.kill(self.process.pid, signal.SIGCONT)
+        except Exception as e:
+            logging.error(f"GStreamer resume failed: {e}")
+            self._stop()
+            self._start()
+            return
+        self._mark_starting()
+        logging.info("GStreamer resumed from standby")
+
+    def _stop(self, state='stopped'):
+        """Signals the process and leaves reaping to the monitor loop."""
+        process, self.process = self.process, None
+        paused = self.state == 'standby'
+        self.state = state
+        for reader in self.readers.values(): reader.detach()
+        self.h264_reader.detach()
+        if not process: return
+        try:
+            process.terminate()
+            if paused: os.kill(process.pid, signal.SIGCONT) # Let it handle SIGTERM
+        except Exception as e:
+            logging.error(f"GStreamer stop failed: {e}")
+        self.dying.append((process, time.monotonic() + self.STOP_GRACE))
+
+    def _fail(self, reason=None):
+        """Tears the pipeline down and schedules a restart with backoff."""
+        if reason:
+            logging.warning(f"⚠️ GStreamer {reason}", extra={'console': True})
+        self._stop('backoff')
+        delay = min(self.BACKOFF_BASE * 2 ** self.failures, config.get('stream_backoff_max', 30))
+        self.failures += 1
+        self.next_start = time.monotonic() + delay
+        logging.info(f"GStreamer restart in {delay:.0f}s (failure #{self.failures})")
+
+    def _reap(self, now):
+        for entry in list(self.dying):
+            process, deadline = entry
+            if process.poll() is not None:
+                self.dying.remove(entry)
+                if process.stdin: process.stdin.close()
+                logging.info(f"GStreamer PID {process.pid} exited")
+            elif now > deadline:
+                process.kill()
+
+    def _update_rates(self, now):
+        elapsed = now - self._rate_time
+        if elapsed < 1.0: return
+        frames, bytes_read = self.frames, sum(r.bytes_read for r in self.readers.values())
+        self.fps = (frames - self._rate_seq) / elapsed
+        self.bytes_per_s = (bytes_read - self._rate_bytes) / elapsed
+        self._rate_time, self._rate_seq, self._rate_bytes = now, frames, bytes_read
+
+    def request_mode(self, mode):
+        """Switches camera source in the background; returns immediately."""
+        with self.lock:
+            config['camera_mode'] = mode
+            if self.mode == mode and self.state != 'stopped': return
+            self.switches += 1
+            self.failures = 0
+            self._stop()
+            if self.viewers:
+                self._start()
+            elif warm_standby():
+                self.idle_since = 0.0
+                self._start()
+
+    def prime(self):
+        """Starts the pipeline once without viewers so a warm standby exists
+        before the first viewer connects."""
+        with self.lock:
+            if self.state != 'stopped' or not warm_standby(): return
+            self.idle_since = 0.0 # Already idle: pause as soon as the first frame arrives
+            self._start()
+
+    def stop(self, wait=False):
+        with self.lock:
+            self._stop()
+            if not wait: return
+            for process, _ in self.dying:
+                try: process.wait(timeout=self.STOP_GRACE)
+                except subprocess.TimeoutExpired: process.kill()
+            self.dying = []
+
+    def _tick(self):
+        now = time.monotonic()
+        self._reap(now)
+        self._update_rates(now)
+        idle_timeout = config.get('stream_idle_timeout', 10)
+        warm = warm_standby()
+
+        if self.process and self.process.poll() is not None:
+            code = self.process.returncode
+            self.process = None
+            self._fail(f"exited with code {code}")
+
+        if self.state == 'backoff':
+            if now < self.next_start: return
+            self.state = 'stopped'
+            if self.viewers or warm:
+                self.restarts += 1
+                self._start()
+            return
+
+        if self.state == 'stopped':
+            if self.viewers: self._start()
+            return
+
+        frames = self.frames
+        if frames != self.last_frame_seq:
+            self.last_frame_seq = frames
+            self.last_frame_time = now
+
+        if self.state == 'starting':
+            if frames > self.start_seq:
+                self.first_frame_ms = (now - self.start_time) * 1000
+                self.last_frame_time = now
+                self.state = 'running'
+                self.failures = 0
+                logging.info(f"🎬 GStreamer first frame after {self.first_frame_ms:.0f} ms", extra={'console': True})
+            elif now - self.start_time > config.get('stream_start_timeout', 15):
+                self._fail("produced no frames after start")
+                return
+
+        if self.state == 'running' and now - self.last_frame_time > config.get('stream_stall_timeout', 5):
+            self.stalls += 1
+            self._fail(f"stalled ({self.fps:.1f} fps, {self.bytes_per_s:.0f} B/s)")
+            return
+
+        if self.state == 'standby':
+            if now - self.standby_since > config.get('stream_standby_timeout', 300):
+                self._stop()
+            return
+
+        # Switch off tiers whose viewers left more than stream_idle_timeout ago
+        if self.state in ('starting', 'running'): self._apply_tiers(now)
+
+        if not self.viewers and self.idle_since is not None and now - self.idle_since > idle_timeout:
+            if not warm: self._stop()
+            elif self.state == 'running': self._pause()
+
+    def monitor_loop(self):
+        while True:
+            try:
+                with self.lock:
+                    self._tick()
+            except Exception as e:
+                logging.error(f"StreamManager error: {e}")
+            socketio.sleep(0.25)
+
+    def status(self):
+        return {
+            'state': self.state,
+            'mode': self.mode,
+            'requested_mode': config.get('camera_mode', 'siyi'),
+            'viewers': self.viewers,
+            'pid': self.process.pid if self.process else None,
+            'first_frame_ms': self.first_frame_ms,
+            'fps': round(self.fps, 1),
+            'bytes_per_s': round(self.bytes_per_s),
+            'frames': self.frames,
+            'malformed_frames': sum(r.malformed_frames for r in self.readers.values()),
+            'tiers': {name: {**tier, 'active': name in (self.drained or []) and self.process is not None,
+                             'viewers': len(self.readers[name].clients) if name in self.readers else 0,
+                             'frames': self.readers[name].seq if name in self.readers else 0,
+                             'stale_dropped': self.readers[name].stale_dropped if name in self.readers else 0}
+                      for name, tier in video_tiers().items()},
+            'h264': self.h264_reader.stats() if h264_supported(config.get('camera_mode', 'siyi')) else None,
+            'restarts': self.restarts,
+            'stalls': self.stalls,
+            'failures': self.failures,
+            'switches': self.switches,
+            'retry_in': round(max(0, self.next_start - time.monotonic()), 1) if self.state == 'backoff' else None,
+        }
+
+stream_manager = StreamManager(h264_reader)
+
+def camera_bringup():
+    """Probes gst-launch's H.264 elements once, off the viewers' path
+    (gst-inspect can take seconds on a Pi), then primes the pipeline."""
+    global gst_h264
+    if local_hardware() and config.get('camera_backend') != 'sim':
+        gst_h264 = gst_has_elements('h264parse', 'mp4mux', 'fdsink')
+        logging.info(f"GStreamer H.264 passthrough {'available' if gst_h264 else 'unavailable'}")
+        # A viewer that arrived during the probe got a pipeline without the branch
+        if gst_h264 and h264_supported(config.get('camera_mode', 'siyi')) and stream_manager.process \
+                and h264_reader.stream is None:
+            stream_manager.stop()
+    stream_manager.prime()
+
+class AutoTier:
+    """Tier choice for /video_feed?tier=auto, judged on how many frames the
+    viewer skips because its connection can't drain them: one tier down when
+    it skips over half in a window, one tier up after a long calm spell."""
+
+    WINDOW = 5.0
+    DOWNGRADE_RATIO = 0.5
+    UPGRADE_RATIO = 0.05
+    UPGRADE_AFTER = 30.0
+
+    def __init__(self, tier):
+        self.tier = tier
+        self.track(time.monotonic())
+
+    def track(self, now):
+        """Starts measuring a fresh client (after joining a tier)."""
+        self.window_start = self.calm_since = now
+        self.sent = self.skipped = 0
+
+    def update(self, client, now):
+        """Returns the tier to move to, or None to stay."""
+        if now - self.window_start < self.WINDOW: return None
+        sent, skipped = client.frames_sent - self.sent, client.frames_skipped - self.skipped
+        self.window_start, self.sent, self.skipped = now, client.frames_sent, client.frames_skipped
+        ratio = skipped / max(1, sent + skipped)
+        names = list(video_tiers())
+        index = names.index(self.tier) if self.tier in names else 0
+        if ratio > self.DOWNGRADE_RATIO: index += 1
+        elif ratio < self.UPGRADE_RATIO and now - self.calm_since >= self.UPGRADE_AFTER: index -= 1
+        else:
+            if ratio >= self.UPGRADE_RATIO: self.calm_since = now
+            return None
+        self.calm_since = now
+        if not 0 <= index < len(names): return None
+        self.tier = names[index]
+        return self.tier
+
+def generate_frames(tier=None, auto=False):
+    reader = stream_manager.reader(tier)
+    client = reader.get_client_queue()
+    selector = AutoTier(tier or default_tier()) if auto else None
+    try:
+        while True:
+            frame = reader.next_frame(client, timeout=5.0)
+            if frame is None:
+                # Re-send the last frame so a vanished viewer is noticed
+                # (and unregistered) even while the pipeline is idle.
+                frame = reader.latest
+                if frame is not None: yield frame.part
+                continue
+            if client.frames_sent == 1:
+                # A new viewer starts with the cached latest frame, however old
+                yield frame.part
+                continue
+            video_dispatch_latency.observe(time.monotonic() - frame.timestamp)
+            yield frame.part
+            # The WSGI server has written the part by the time we resume
+            now = time.monotonic()
+            video_write_latency.observe(now - frame.timestamp)
+            new_tier = selector.update(client, now) if selector else None
+            if new_tier:
+                logging.info(f"Viewer {client.id} moving to tier {new_tier}")
+                reader.remove_client_queue(client)
+                reader = stream_manager.reader(new_tier)
+                client = reader.get_client_queue()
+                selector.track(now)
+    finally:
+        reader.remove_client_queue(client)
+
+def generate_fragments():
+    """One endless fragmented MP4: the init segment, then fragments from a
+    keyframe on. A new init segment is sent whenever the pipeline restarts."""
+    client = h264_reader.get_client()
+    sent_init = None
+    try:
+        while True:
+            fragment = h264_reader.next_fragment(client, timeout=5.0)
+            if fragment is None:
+                # Write something so a vanished viewer is noticed while idle
+                if sent_init is not None: yield MP4_KEEPALIVE
+                continue
+            if fragment.init is not sent_init:
+                yield fragment.init
+                sent_init = fragment.init
+            yield fragment.data
+    finally:
+        h264_reader.remove_client(client)
+
+# --- Video Recorder ---
+# Records what the pipeline already produces, without re-encoding, into
+# segments named after their first frame (unix ms) in video_recorder_dir:
+#   <ms>.mp4    fragmented MP4, init segment first, when H.264 is available
+#   <ms>.mjpeg  concatenated JPEGs otherwise (ffmpeg/VLC play it as raw MJPEG)
+#   <ms>.idx    RECORD_INDEX entries <dQ wall time, byte offset>, one per
+#               random access point: every JPEG, or every keyframe fragment
+# The recorder is an ordinary viewer of its reader, so a slow disk makes it
+# skip frames the way a slow viewer would; live fan-out never waits on it.
+VIDEO_SEGMENT_NAME = re.compile(r'^\d+\.(mp4|mjpeg)$')
+
+class VideoRecorder:
+    """Records segments between `start` and `stop`. The capture greenlet
+    only appends to in-memory chunks; `run` hands them to io_pool every
+    FLUSH_INTERVAL. Segments rotate every `video_segment_s` (at a keyframe
+    for H.264, or when the pipeline restarts with a new init segment) and
+    the oldest are deleted beyond `video_quota_mb`."""
+
+    FLUSH_INTERVAL = 1.0
+    MAX_BUFFER = 16 * 1024 * 1024 # Drop frames rather than grow without bound if the disk stalls
+
+    def __init__(self):
+        self.recording = False
+        self.session = 0 # A quick disarm/re-arm must not leave two capture loops running
+        self.pending = [] # [segment name, bytearray, [(wall time, offset in chunk)]]
+        self.buffered = 0
+        self.segment_start = None
+        self.write_lock = threading.Lock() # One flush on the disk at a time
+        self.file = None
+        self.index = None
+        self.file_name = None
+        self.file_size = 0
+        self.frames = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.started_at = None
+
+    @property
+    def directory(self):
+        return config.get('video_recorder_dir', 'recordings/video')
+
+    def start(self):
+        if self.recording: return
+        self.recording = True
+        self.session += 1
+        self.started_at = time.time()
+        socketio.start_background_task(self._capture, self.session)
+        logging.info("Video recording started")
+
+    def stop(self):
+        self.recording = False
+
+    def _active(self, session):
+        return self.recording and self.session == session
+
+    def _source(self):
+        return '.mp4' if h264_supported(config.get('camera_mode', 'siyi')) else '.mjpeg'
+
+    def _capture(self, session):
+        # A camera mode switch can change what is available, so the source is re-picked
+        try:
+            while self._active(session):
+                self.segment_start = None # Each source starts a segment of its own
+                if self._source() == '.mp4': self._capture_h264(session)
+                else: self._capture_mjpeg(session)
+        except Exception as e:
+            logging.error(f"Video recording failed: {e}")
+            if self.session == session: self.recording = False
+        finally:
+            if self.session == session and not self.recording: self.segment_start = None
+            self.flush()
+            with self.write_lock:
+                io_pool.apply(self.close)
+            logging.info("Video recording stopped")
+
+    def _capture_h264(self, session):
+        client = h264_reader.get_client()
+        # Fragments already in the ring (warm-standby priming, an earlier
+        # arm) predate this recording, like the MJPEG path's cached frame
+        since_seq, since = h264_reader.seq, time.monotonic()
+        init = None
+        resync = True # Start at the first fresh keyframe
+        try:
+            while self._active(session) and self._source() == '.mp4':
+                fragment = h264_reader.next_fragment(client, timeout=1.0)
+                if fragment is None or fragment.seq <= since_seq or fragment.timestamp < since: continue
+                if fragment.init is not init: resync = True # New pipeline: wait for its first keyframe
+                if resync and not fragment.key: continue
+                t = time.time() - (time.monotonic() - fragment.timestamp)
+                if fragment.key and (fragment.init is not init or self.segment_start is None
+                                     or t - self.segment_start >= config.get('video_segment_s', 60)):
+                    self._begin_segment(t, '.mp4', fragment.init)
+                    init = fragment.init
+                resync = not self._append(fragment.data, t if fragment.key else None)
+        finally:
+            h264_reader.remove_client(client)
+
+    def _capture_mjpeg(self, session):
+        reader = stream_manager.reader(config.get('video_record_tier') or next(iter(video_tiers())))
+        client = reader.get_client_queue()
+        try:
+            while self._active(session) and self._source() == '.mjpeg':
+                frame = reader.next_frame(client, timeout=1.0)
+                # The first frame is the cached latest one, however old
+                if frame is None or client.frames_sent == 1: continue
+                t = time.time() - (time.monotonic() - frame.timestamp)
+                if self.segment_start is None or t - self.segment_start >= config.get('video_segment_s', 60):
+                    self._begin_segment(t, '.mjpeg', b'')
+                self._append(frame.jpeg, t)
+        finally:
+            reader.remove_client_queue(client)
+
+    def _begin_segment(self, t, ext, header):
+        self.segment_start = t
+        self.pending.append([f"{int(t * 1000)}{ext}", bytearray(header), []])
+        self.buffered += len(header)
+
+    def _append(self, data, t=None):
+        """Buffers `data`, indexed at wall time `t` if it is a random access
+        point. Returns False if it was dropped."""
+        if self.buffered > self.MAX_BUFFER:
+            self.dropped += 1
+            return False
+        _, chunk, index = self.pending[-1]
+        if t is not None: index.append((t, len(chunk)))
+        chunk += data
+        self.buffered += len(data)
+        self.frames += 1
+        return True
+
+    def flush(self):
+        """Swaps out the buffered chunks and writes them on io_pool, yielding until done."""
+        if not self.pending or not any(chunk for _, chunk, _ in self.pending): return
+        pending = self.pending
+        # Later frames keep going to the segment that is open
+        self.pending = [[pending[-1][0], bytearray(), []]] if self.segment_start is not None else []
+        self.buffered = 0
+        with self.write_lock:
+            io_pool.apply(self._write, (pending,))
+
+    def _write(self, pending):
+        # Runs on an io_pool thread: no gevent or Socket.IO calls in here
+        for name, chunk, index in pending:
+            if not chunk: continue
+            if name != self.file_name: self._open(name)
+            self.index.write(b''.join(RECORD_INDEX.pack(t, self.file_size + offset) for t, offset in index))
+            self.file.write(chunk)
+            self.file.flush()
+            self.index.flush()
+            self.file_size += len(chunk)
+            self.bytes_written += len(chunk)
+
+    def _open(self, name):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        self.file = open(path, 'ab')
+        self.index = open(os.path.splitext(path)[0] + '.idx', 'ab')
+        self.file_name = name
+        self.file_size = self.file.tell()
+        self._enforce_quota()
+
+    def close(self):
+        if self.file: self.file.close()
+        if self.index: self.index.close()
+        self.file = self.index = self.file_name = None
+
+    def _enforce_quota(self):
+        segments = self.segments()
+        quota = config.get('video_quota_mb', 2048) * 1024 * 1024
+        total = sum(size for _, _, size in segments)
+        for _, path, size in segments:
+            if total <= quota: break
+            if os.path.basename(path) == self.file_name: continue # Never the one being written
+            for victim in (path, os.path.splitext(path)[0] + '.idx'):
+                try: os.remove(victim)
+                except OSError: pass
+            total -= size
+            self.evicted += 1
+
+    def segments(self):
+        """[(start_time, path, size)] sorted oldest first."""
+        try: names = os.listdir(self.directory)
+        except OSError: return []
+        segments = []
+        for name in names:
+            if not VIDEO_SEGMENT_NAME.match(name): continue
+            path = os.path.join(self.directory, name)
+            try: segments.append((int(name.split('.')[0]) / 1000.0, path, os.path.getsize(path)))
+            except OSError: pass # Evicted meanwhile
+        return sorted(segments)
+
+    def read_range(self, path, start, end):
+        """[(offset, length)] of `path` covering [start, end]: the header (the
+        MP4 init segment) plus everything from the last random access point
+        at or before `start` to the first one after `end`."""
+        size = os.path.getsize(path)
+        try:
+            with open(os.path.splitext(path)[0] + '.idx', 'rb') as f:
+                index = [RECORD_INDEX.unpack_from(data) for data in iter(lambda: f.read(RECORD_INDEX.size), b'')
+                         if len(data) == RECORD_INDEX.size]
+        except OSError:
+            index = []
+        if not index: return [(0, size)]
+        header = index[0][1]
+        first = max((offset for t, offset in index if t <= start), default=header)
+        last = min((offset for t, offset in index if t > end), default=size)
+        ranges = [(0, header)] if header else []
+        if last > first: ranges.append((first, last - first))
+        return ranges
+
+    def run(self):
+        while True:
+            socketio.sleep(self.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Video recorder flush failed: {e}")
+
+    def stats(self):
+        return {
+            'recording': self.recording,
+            'format': self._source() if self.recording else None,
+            'started_at': self.started_at if self.recording else None,
+            'frames': self.frames,
+            'bytes_written': self.bytes_written,
+            'dropped': self.dropped,
+            'evicted_segments': self.evicted,
+            'buffered_bytes': self.buffered,
+            'segment': self.file_name,
+        }
+
+video_recorder = VideoRecorder()
+
+# --- Upstream Links ---
+class UpstreamLink:
+    """One Socket.IO client connection to another InsightServer, kept up with
+    backoff. Upstream's JSON deltas are merged into per-topic `state`;
+    subclasses choose the rates to ask for (`wanted_rates`) and handle
+    updates (`on_state`, `on_event`). Needs python-socketio's client."""
+
+    TOPICS = [topic for topic in TelemetryHub.TOPICS if topic != 'stats'] # stats are per server
+    EVENTS = ('serial_status', 'recording_status') # Cached, and replayed to new clients
+    BACKOFF_MAX = 30
+
+    def __init__(self, name='upstream'):
+        self.name = name
+        self.url = None
+        self.client = None
+        self.connected = False
+        self.state = {topic: {} for topic in self.TOPICS}
+        self.events = {} # event -> last payload
+        self.rates = {} # topic -> rate asked of upstream
+        self.connects = 0
+        self.received = 0
+
+    def start(self, url):
+        """Connects (and reconnects) in the background."""
+        try:
+            from socketio import Client # python-socketio's client, only needed here
+        except ImportError:
+            logging.error('🛑 Upstream links need python-socketio\'s client: pip install "python-socketio[client]"', extra={'console': True})
+            return False
+        self.url = url
+        self.client = Client(reconnection=False)
+        self.client.on('connect', self._on_connect)
+        self.client.on('disconnect', self._on_disconnect)
+        for topic in self.TOPICS:
+            self.client.on(topic, lambda data, topic=topic: self._on_telemetry(topic, data))
+        for event in self.EVENTS:
+            self.client.on(event, lambda data, event=event: self._on_event(event, data))
+        socketio.start_background_task(self.run)
+        return True
+
+    def run(self):
+        failures = 0
+        while True:
+            try:
+                self.client.connect(self.url, wait_timeout=10)
+                failures = 0
+                self.client.wait() # Until the connection drops
+            except Exception as e:
+                logging.warning(f"{self.name} {self.url} unreachable: {e}", extra={'key': f"unreachable {self.name}"})
+            delay = min(2 ** failures, self.BACKOFF_MAX)
+            failures += 1
+            socketio.sleep(delay)
+
+    def stop(self):
+        if self.client and self.connected:
+            try: self.client.disconnect()
+            except Exception: pass
+
+    def _on_connect(self):
+        self.connected = True
+        self.connects += 1
+        logging.info(f"🔗 Connected to {self.name} {self.url}", extra={'console': True})
+        self.rates = {} # Upstream subscribed us at its defaults
+        self.sync_rates()
+        self.on_link(True)
+
+    def _on_disconnect(self, *reason):
+        if not self.connected: return
+        self.connected = False
+        logging.warning(f"⚠️ Lost {self.name} {self.url}", extra={'console': True})
+        self.on_link(False)
+        self._on_event('serial_status', {'status': 'disconnected'})
+
+    def _on_telemetry(self, topic, delta):
+        self.received += 1
+        self.state[topic].update(delta)
+        self.on_state(topic, delta)
+
+    def _on_event(self, event, data):
+        self.events[event] = data
+        self.on_event(event, data)
+
+    def sync_rates(self):
+        """Sends `wanted_rates` upstream if they changed; other topics are 0."""
+        rates = {topic: 0 for topic in self.TOPICS}
+        rates.update(self.wanted_rates())
+        if not self.connected or rates == self.rates: return
+        try: self.client.emit('subscribe', {**rates, 'encoding': 'json'})
+        except Exception as e:
+            logging.warning(f"{self.name} subscribe failed: {e}")
+            return
+        self.rates = rates
+
+    def emit(self, event, data):
+        """Sends to upstream; False if the link is down."""
+        if not self.connected: return False
+        try: self.client.emit(event, data)
+        except Exception as e:
+            logging.warning(f"{self.name} {event} failed: {e}", extra={'key': f"send {self.name}"})
+            return False
+        return True
+
+    def wanted_rates(self): return {}
+    def on_link(self, connected): pass
+    def on_state(self, topic, delta): pass
+    def on_event(self, event, data): pass
+
+# --- Relay Mode ---
+class UpstreamRelay(UpstreamLink):
+    """Relay mode: one link to the upstream server (the rover, or another
+    relay) feeds every local client.
+
+    - Upstream's telemetry is republished through the local TelemetryHub, so
+      local clients keep their own rates, encodings and deltas. Upstream is
+      asked for each topic at the highest rate any local client subscribes
+      to, and for nothing without clients.
+    - Commands go upstream from one driver at a time. A client becomes the
+      driver with a non-zero command while the seat is free or the driver has
+      sent none for `relay_driver_timeout_s`, or with `claim_driver`
+      {'force': true}. Other clients' commands are dropped. When the driver
+      leaves, the rover is sent a stop.
+    - Video isn't handled here: the StreamManager runs relay.py, which copies
+      the upstream streams into the usual readers.
+    """
+
+    COMMAND_AXES = {'control': ('L', 'R'), 'joystick_command': ('yaw', 'pitch')} # Non-zero = active
+    REPEAT_INTERVAL = 0.2 # Identical commands are forwarded at most this often
+
+    def __init__(self):
+        super().__init__('upstream')
+        self.driver = None # sid
+        self.driver_active = 0.0 # Last non-zero command from the driver
+        self.sent = {} # event -> (payload, time) last forwarded
+        self.forwarded = 0
+        self.rejected = 0
+
+    def wanted_rates(self):
+        return {topic: max((rate for rate, _ in telemetry.channels[topic]), default=0) for topic in self.TOPICS}
+
+    def on_state(self, topic, delta):
+        telemetry.publish(topic, self.state[topic])
+
+    def on_event(self, event, data):
+        socketio.emit(event, data)
+
+    def replay(self, sid):
+        """Brings a new local client up to date."""
+        for event, data in self.events.items():
+            socketio.emit(event, data, to=sid)
+        socketio.emit('driver_status', {'driver': False, 'occupied': self.driver is not None}, to=sid)
+
+    def _active(self, event, data):
+        axes = self.COMMAND_AXES.get(event)
+        if axes is None: return True # Arming is always deliberate
+        try: return any(float(data.get(axis, 0)) for axis in axes)
+        except (TypeError, ValueError): return False
+
+    def _set_driver(self, sid):
+        previous, self.driver = self.driver, sid
+        if previous == sid: return
+        logging.info(f"Relay driver is now {sid}")
+        for member in (previous, sid):
+            if member: socketio.emit('driver_status', {'driver': member == sid, 'occupied': sid is not None}, to=member)
+
+    def claim(self, sid, force=False):
+        """Takes the seat if it's free, idle, or `force`. Returns whether `sid` drives."""
+        idle = time.monotonic() - self.driver_active > config.get('relay_driver_timeout_s', 5)
+        if self.driver in (None, sid) or idle or force:
+            self._set_driver(sid)
+            self.driver_active = time.monotonic()
+        return self.driver == sid
+
+    def forward(self, sid, event, data):
+        """Sends `sid`'s command upstream if it is (or may become) the driver."""
+        if not isinstance(data, dict): return
+        now = time.monotonic()
+        active = self._active(event, data)
+        if sid != self.driver:
+            idle = self.driver is None or now - self.driver_active > config.get('relay_driver_timeout_s', 5)
+            if not (active and idle):
+                self.rejected += 1
+                return
+            self._set_driver(sid)
+        if active: self.driver_active = now
+        last = self.sent.get(event)
+        if last and last[0] == data and now - last[1] < self.REPEAT_INTERVAL: return
+        self._send(event, data, now)
+
+    def _send(self, event, data, now):
+        if not self.emit(event, data):
+            self.rejected += 1
+            return
+        self.sent[event] = (data, now)
+        self.forwarded += 1
+
+    def client_left(self, sid):
+        """Stops the rover if its driver disconnected."""
+        if sid != self.driver: return
+        self.driver = None
+        now = time.monotonic()
+        self._send('control', {'L': 0, 'R': 0}, now)
+        self._send('joystick_command', {'yaw': 0, 'pitch': 0}, now)
+
+    def stats(self):
+        return {'upstream': self.url or config.get('relay_upstream'), 'connected': self.connected,
+                'connects': self.connects, 'rates': self.rates, 'driver': self.driver,
+                'received': self.received, 'forwarded': self.forwarded, 'rejected': self.rejected}
+
+relay = UpstreamRelay()
+
+# --- Fleet Gateway ---
+class RoverLink(UpstreamLink):
+    """A fleet gateway's link to one rover server: telemetry at the fixed
+    `fleet_rates` over Socket.IO, plus /healthz every `fleet_health_s` and
+    /snapshot.jpg every `fleet_snapshot_s` (revalidated by ETag, and only
+    while someone has the fleet view open) over HTTP. What changed since the
+    last batch collects in `changes`."""
+
+    def __init__(self, rover_id):
+        super().__init__(f"rover {rover_id}")
+        self.rover_id = rover_id
+        self.changes = {}
+        self.health = None # {'status', 'subsystems': {name: state}}, or {'status': 'unreachable'}
+        self.snapshot = None # JPEG bytes
+        self.snapshot_etag = None # The rover's
+        self.snapshot_seq = 0
+        self.snapshot_time = None # Monotonic, when the rover's frame was taken
+        self.requests = 0
+        self.not_modified = 0
+
+    def wanted_rates(self):
+        return {topic: rate for topic, rate in (config.get('fleet_rates') or {}).items() if topic in self.TOPICS}
+
+    def on_link(self, connected):
+        self.changes['connected'] = connected
+
+    def on_state(self, topic, delta):
+        self.changes.setdefault('state', {}).setdefault(topic, {}).update(delta)
+
+    def on_event(self, event, data):
+        self.changes.setdefault('events', {})[event] = data
+
+    def snapshot_info(self):
+        if self.snapshot is None: return None
+        return {'seq': self.snapshot_seq, 'age_s': round(time.monotonic() - self.snapshot_time, 1),
+                'url': f"/fleet/{self.rover_id}/snapshot.jpg"}
+
+    def summary(self):
+        return {'url': self.url, 'connected': self.connected, 'health': self.health,
+                'state': {topic: dict(state) for topic, state in self.state.items() if state},
+                'events': dict(self.events), 'snapshot': self.snapshot_info()}
+
+    def _get(self, path, headers=None):
+        """(status, headers, body) of a GET on the rover; status 0 if unreachable."""
+        self.requests += 1
+        req = urllib.request.Request(self.url.rstrip('/') + path, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=5) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+        except (OSError, ValueError) as e:
+            return 0, {}, str(e).encode()
+
+    def poll_health(self):
+        status, _, body = self._get('/healthz')
+        try:
+            report = json.loads(body)
+            health = {'status': report['status'],
+                      'subsystems': {name: entry['state'] for name, entry in report['subsystems'].items()}}
+        except (ValueError, KeyError, TypeError):
+            health = {'status': 'unreachable' if not status else f"http {status}"}
+        if health != self.health:
+            self.health = self.changes['health'] = health
+
+    def poll_snapshot(self):
+        tier = config.get('fleet_snapshot_tier')
+        headers = {'If-None-Match': self.snapshot_etag} if self.snapshot_etag else {}
+        status, response_headers, body = self._get('/snapshot.jpg' + (f"?tier={tier}" if tier else ''), headers)
+        if status == 304:
+            self.not_modified += 1
+        elif status == 200:
+            try: age = float(response_headers.get('Age', 0))
+            except ValueError: age = 0.0
+            self.snapshot = body
+            self.snapshot_etag = response_headers.get('ETag')
+            self.snapshot_seq += 1
+            self.snapshot_time = time.monotonic() - age
+            self.changes['snapshot'] = self.snapshot_info()
+
+    def poll(self):
+        next_health = next_snapshot = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_health:
+                next_health = now + config.get('fleet_health_s', 10)
+                self.poll_health()
+            snapshot_s = config.get('fleet_snapshot_s', 2)
+            if snapshot_s and fleet.viewers and now >= next_snapshot:
+                next_snapshot = now + snapshot_s
+                self.poll_snapshot()
+            socketio.sleep(0.25)
+
+    def stats(self):
+        return {'url': self.url, 'connected': self.connected, 'connects': self.connects,
+                'received': self.received, 'requests': self.requests, 'not_modified': self.not_modified,
+                'health': self.health, 'snapshot': self.snapshot_info()}
+
+class FleetGateway:
+    """Fleet mode ("fleet_rovers"): one RoverLink per rover server, merged
+    into a single stream for browsers.
+
+    Browsers emit `fleet_subscribe`, get the whole fleet once, then one
+    `fleet_update` per 1/`fleet_update_hz` carrying everything that changed
+    on any rover since the previous one: {'rovers': {id: {'state': {topic:
+    delta}, 'events', 'connected', 'health', 'snapshot'}}}. Messages per
+    browser don't grow with the fleet, and each rover serves one connection
+    and a fixed poll rate however many browsers watch.
+    """
+
+    ROOM = 'fleet'
+
+    def __init__(self):
+        self.links = {} # rover id -> RoverLink
+        self.viewers = set() # sids in ROOM
+        self.batches = 0
+
+    def start(self):
+        for rover_id, url in (config.get('fleet_rovers') or {}).items():
+            link = RoverLink(str(rover_id))
+            if not link.start(url): return False
+            self.links[link.rover_id] = link
+            socketio.start_background_task(link.poll)
+        socketio.start_background_task(self.run)
+        logging.info(f"🛰️ Fleet gateway for {len(self.links)} rovers: {', '.join(self.links)}", extra={'console': True})
+        return True
+
+    def join(self, sid):
+        socketio.server.enter_room(sid, self.ROOM, namespace='/')
+        self.viewers.add(sid)
+        socketio.emit('fleet_update', {'full': True, 'rovers': {rover_id: link.summary()
+                                                                 for rover_id, link in self.links.items()}}, to=sid)
+
+    def leave(self, sid):
+        if sid not in self.viewers: return
+        self.viewers.discard(sid)
+        socketio.server.leave_room(sid, self.ROOM, namespace='/')
+
+    def run(self):
+        while True:
+            socketio.sleep(1.0 / config.get('fleet_update_hz', 2))
+            changes = {}
+            for rover_id, link in self.links.items():
+                if link.changes: changes[rover_id], link.changes = link.changes, {}
+            # Without viewers the changes are only dropped: joining sends everything
+            if changes and self.viewers:
+                socketio.emit('fleet_update', {'rovers': changes}, to=self.ROOM)
+                self.batches += 1
+
+    def stats(self):
+        return {'viewers': len(self.viewers), 'batches': self.batches,
+                'rovers': {rover_id: link.stats() for rover_id, link in self.links.items()}}
+
+fleet = FleetGateway()
+
+# --- Health ---
+class Readiness:
+    """Bring-up state of each subsystem, for /healthz and the startup log.
+
+    Subsystems come up concurrently in their own greenlets; this only polls
+    cheap checks. One that isn't ready within its `startup_timeouts` entry is
+    reported as timed out but keeps being checked, so a late USB enumeration
+    or gimbal boot still turns it ready. States: starting | ready | timeout |
+    down (was ready, lost since) | off (not needed in this configuration).
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self):
+        self.boot = time.monotonic()
+        self.checks = {} # name -> (check() -> (ready, detail), required() -> bool)
+        self.states = {} # name -> {'state', 'ready_ms', 'detail'}
+
+    def register(self, name, check, required=lambda: True):
+        self.checks[name] = (check, required)
+        self.states[name] = {'state': 'starting', 'ready_ms': None, 'detail': None}
+
+    def update(self):
+        now = time.monotonic()
+        timeouts = config.get('startup_timeouts') or {}
+        for name, (check, required) in self.checks.items():
+            entry = self.states[name]
+            try: ready, entry['detail'] = check()
+            except Exception as e: ready, entry['detail'] = False, str(e)
+            if not required():
+                entry['state'] = 'off'
+            elif ready:
+                if entry['ready_ms'] is None:
+                    entry['ready_ms'] = round((now - self.boot) * 1000)
+                    logging.info(f"✅ {name} ready after {entry['ready_ms']} ms", extra={'console': True})
+                entry['state'] = 'ready'
+            elif entry['ready_ms'] is not None:
+                entry['state'] = 'down'
+            elif now - self.boot > timeouts.get(name, 10):
+                if entry['state'] != 'timeout':
+                    logging.warning(f"⚠️ {name} not ready after {timeouts.get(name, 10)}s: {entry['detail']}", extra={'console': True})
+                entry['state'] = 'timeout'
+
+    def run(self):
+        while True:
+            self.update()
+            socketio.sleep(self.INTERVAL)
+
+    def report(self):
+        states = [entry['state'] for entry in self.states.values()]
+        if all(state in ('ready', 'off') for state in states): status = 'ok'
+        elif 'starting' in states and not any(state in ('timeout', 'down') for state in states): status = 'starting'
+        else: status = 'degraded'
+        return {'status': status, 'uptime_s': round(time.monotonic() - self.boot, 1),
+                'subsystems': {name: dict(entry) for name, entry in self.states.items()}}
+
+readiness = Readiness()
+readiness.register('serial', lambda: (ser is not None, f"{serial_ingest.lines} lines" if ser else "port not open"),
+                   required=local_hardware)
+readiness.register('gimbal',
+                   lambda: (bool(gimbal and gimbal.sock and gimbal.framer.packets),
+                            "no gimbal" if not gimbal else "not connected" if not gimbal.sock
+                            else f"{gimbal.framer.packets} packets"),
+                   required=lambda: config.get('camera_mode', 'siyi') == 'siyi' and local_hardware())
+readiness.register('camera',
+                   lambda: (stream_manager.frames > 0 and stream_manager.state != 'backoff', stream_manager.state),
+                   # Without warm standby the pipeline only starts for a viewer
+                   required=warm_standby)
+readiness.register('servo', lambda: (servo is not None, None),
+                   required=lambda: GPIO_AVAILABLE and config.get('camera_mode') == 'picam' and local_hardware())
+readiness.register('upstream', lambda: (relay.connected, config.get('relay_upstream')), required=relay_mode)
+readiness.register('fleet',
+                   lambda: (all(link.connected for link in fleet.links.values()) and bool(fleet.links),
+                            f"{sum(link.connected for link in fleet.links.values())}/{len(fleet.links)} rovers connected"),
+                   required=fleet_mode)
+
+# --- Routes & Events ---
+@app.route('/')
+def index(): return render_template('dashboard.html')
+
+@app.route('/config')
+def config_page():
+    return render_template('config.html', mode=config.get('camera_mode', 'siyi'))
+
+@app.route('/api/config', methods=['POST'])
+def update_config():
+    data = request.json
+    if not local_hardware():
+        return jsonify({"status": "error", "message": "Camera mode is set on the rover's own server"}), 409
+    if data.get('camera_mode') in ('siyi', 'picam'):
+        mode = data['camera_mode']
+        # Re-init hardware based on new config. The pipeline switch runs in
+        # the background so this request returns immediately.
+        stream_manager.request_mode(mode)
+        config_overrides['camera_mode'] = mode
+        save_config()
+        init_servo()
+        
+        return jsonify({"status": "ok", "mode": mode, "stream": stream_manager.status()})
+    return jsonify({"status": "error"}), 400
+
+@app.route('/healthz')
+def healthz():
+    """200 once every subsystem needed in this configuration is ready, 503 until then."""
+    report = readiness.report()
+    return jsonify(report), 200 if report['status'] == 'ok' else 503
+
+@app.route('/api/stream')
+def stream_status():
+    return jsonify(stream_manager.status())
+
+@app.route('/api/gimbal')
+def gimbal_status():
+    if not gimbal: return jsonify({'connected': False})
+    return jsonify(gimbal.stats())
+
+@app.route('/api/servo')
+def servo_status():
+    return jsonify(servo_controller.stats())
+
+@app.route('/api/serial')
+def serial_status():
+    return jsonify({'connected': ser is not None, **serial_ingest.stats(),
+                    'control': control_scheduler.stats()})
+
+@app.route('/api/telemetry/segments')
+def telemetry_segments():
+    return jsonify({
+        'segments': [{'start': start, 'name': os.path.basename(base), 'bytes': size}
+                     for start, base, size in recorder.segments()],
+        **recorder.stats(),
+    })
+
+@app.route('/api/telemetry/range')
+def telemetry_range():
+    """?start=&end= (unix seconds, default the last minute), types=imu,attitude,control,
+    max_points= per type, 1 to 10000 (server-side downsampling)."""
+    names = {name: rec_type for rec_type, (name, _) in RECORD_TYPES.items()}
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 60))
+        max_points = int(request.args.get('max_points', 1000))
+        rec_types = [names[t] for t in request.args.get('types', ','.join(names)).split(',') if t]
+        if not 1 <= max_points <= recorder.MAX_POINTS: raise ValueError
+    except (ValueError, KeyError):
+        return jsonify({"status": "error"}), 400
+    recorder.flush() # Include what is still buffered
+    result = io_pool.apply(recorder.query, (start, end, rec_types, max_points))
+    return jsonify({'start': start, 'end': end, **result})
+
+@app.route('/api/recordings')
+def recordings_list():
+    """Video segments overlapping ?start=&end= (unix seconds, default all)."""
+    try:
+        start = float(request.args.get('start', 0))
+        end = float(request.args.get('end', 'inf'))
+    except ValueError:
+        return jsonify({"status": "error"}), 400
+    segments = []
+    for seg_start, path, size in video_recorder.segments():
+        try: seg_end = os.path.getmtime(path) # Last write
+        except OSError: continue
+        if seg_end < start or seg_start > end: continue
+        segments.append({'name': os.path.basename(path), 'start': seg_start, 'end': seg_end, 'bytes': size})
+    return jsonify({'segments': segments, **video_recorder.stats()})
+
+@app.route('/api/recordings/<name>')
+def recording_download(name):
+    """The whole segment, or with ?start=&end= only the part covering that
+    range (from the preceding keyframe, playable on its own)."""
+    if not VIDEO_SEGMENT_NAME.match(name):
+        return jsonify({"status": "error", "message": "Unknown segment"}), 404
+    path = os.path.join(video_recorder.directory, name)
+    if not os.path.exists(path):
+        return jsonify({"status": "error", "message": "Unknown segment"}), 404
+    mimetype = 'video/mp4' if name.endswith('.mp4') else 'video/x-motion-jpeg'
+    if 'start' not in request.args and 'end' not in request.args:
+        return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True, conditional=True)
+    try:
+        start = float(request.args.get('start', 0))
+        end = float(request.args.get('end', 'inf'))
+    except ValueError:
+        return jsonify({"status": "error"}), 400
+    ranges = io_pool.apply(video_recorder.read_range, (path, start, end))
+
+    def generate():
+        with open(path, 'rb') as f:
+            for offset, length in ranges:
+                f.seek(offset)
+                while length > 0:
+                    data = io_pool.apply(f.read, (min(length, 1024 * 1024),))
+                    if not data: return
+                    length -= len(data)
+                    yield data
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+@app.route('/api/relay')
+def relay_status():
+    return jsonify(relay.stats())
+
+@app.route('/fleet')
+def fleet_page():
+    return render_template('fleet.html')
+
+@app.route('/api/fleet')
+def fleet_status():
+    """Every rover's latest state, health and snapshot info, plus link stats."""
+    return jsonify({'rovers': {rover_id: {**link.summary(), 'stats': link.stats()}
+                               for rover_id, link in fleet.links.items()},
+                    'viewers': len(fleet.viewers), 'batches': fleet.batches})
+
+@app.route('/fleet/<rover_id>/snapshot.jpg')
+def fleet_snapshot(rover_id):
+    """The gateway's cached copy of a rover's newest snapshot."""
+    link = fleet.links.get(rover_id)
+    if link is None:
+        return jsonify({"status": "error", "message": "Unknown rover"}), 404
+    if link.snapshot is None:
+        return jsonify({"status": "error", "message": "No frame yet"}), 503
+    etag = f'"{SNAPSHOT_EPOCH}-{rover_id}-{link.snapshot_seq}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache',
+               'Age': str(int(time.monotonic() - link.snapshot_time))}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(link.snapshot, mimetype='image/jpeg', headers=headers)
+
+@app.route('/api/sim')
+def sim_status():
+    return jsonify({name: emulator.stats() for name, emulator in simulators.items()})
+
+def socketio_queue_depths():
+    """Packets waiting in each Engine.IO client's outbound queue."""
+    return {sid: sock.queue.qsize() for sid, sock in list(socketio.server.eio.sockets.items())}
+
+@metrics.collector
+def collect_component_metrics():
+    counter, gauge = 'counter', 'gauge'
+    yield ('insight_serial_bytes_total', counter, "Bytes read from the rover serial port",
+           [({}, serial_ingest.bytes_read)])
+    yield ('insight_serial_lines_total', counter, "Lines framed from the rover serial port",
+           [({}, serial_ingest.lines)])
+    yield ('insight_serial_errors_total', counter, "Rover serial lines or bytes discarded, by kind",
+           [({'kind': 'json'}, serial_ingest.json_errors),
+            ({'kind': 'garbage'}, serial_ingest.garbage_lines),
+            ({'kind': 'overflow_bytes'}, serial_ingest.dropped_bytes)])
+    yield ('insight_control_writes_total', counter, "Setpoints written to the rover",
+           [({}, control_scheduler.writes)])
+    yield ('insight_control_write_errors_total', counter, "Failed rover serial writes",
+           [({}, control_scheduler.write_errors)])
+    yield ('insight_control_deadman_stops_total', counter, "Motor stops forced by the dead-man timer",
+           [({}, control_scheduler.deadman_stops)])
+    if gimbal:
+        framer = gimbal.framer # Per connection: resets on reconnect
+        yield ('insight_gimbal_packets_total', counter, "SIYI packets by direction",
+               [({'direction': 'rx'}, framer.packets), ({'direction': 'tx'}, gimbal.tx_packets)])
+        yield ('insight_gimbal_errors_total', counter, "SIYI packets lost or rejected, by kind",
+               [({'kind': 'crc'}, framer.crc_errors), ({'kind': 'malformed'}, framer.malformed),
+                ({'kind': 'dropped'}, gimbal.dropped_packets),
+                ({'kind': 'request_timeout'}, gimbal.request_timeouts)])
+        yield ('insight_gimbal_connects_total', counter, "SIYI TCP connections established",
+               [({}, gimbal.connects)])
+        yield ('insight_gimbal_queue_depth', gauge, "Packets waiting for the SIYI writer",
+               [({}, gimbal.outbox.qsize())])
+        yield ('insight_gimbal_connected', gauge, "1 while the SIYI link is up",
+               [({}, int(gimbal.sock is not None))])
+    readers = list(stream_manager.readers.items())
+    yield ('insight_servo_writes_total', counter, "Tilt servo angle writes, and loop ticks that skipped one",
+           [({'result': 'written'}, servo_controller.writes), ({'result': 'skipped'}, servo_controller.skipped)])
+    yield ('insight_video_frames_total', counter, "Frames read from the video pipeline, by tier",
+           [({'tier': tier}, r.seq) for tier, r in readers])
+    yield ('insight_video_bytes_total', counter, "JPEG bytes read from the video pipeline, by tier",
+           [({'tier': tier}, r.bytes_read) for tier, r in readers])
+    yield ('insight_video_malformed_frames_total', counter, "Unusable multipart parts from the pipeline, by tier",
+           [({'tier': tier}, r.malformed_frames) for tier, r in readers])
+    yield ('insight_video_frames_skipped_total', counter, "Frames viewers skipped because they were behind, by tier",
+           [({'tier': tier}, r.frames_skipped) for tier, r in readers])
+    yield ('insight_video_viewer_lag_frames', gauge, "Frames each viewer is behind the newest one",
+           [({'tier': tier, 'viewer': client.id}, r.seq - client.last_seq)
+            for tier, r in readers for client in list(r.clients)])
+    yield ('insight_video_tier_active', gauge, "1 for each tier encoded by the running pipeline",
+           [({'tier': tier}, int(tier in (stream_manager.drained or []) and stream_manager.process is not None))
+            for tier in video_tiers()])
+    yield ('insight_video_fps', gauge, "Pipeline frame rate", [({}, stream_manager.fps)])
+    yield ('insight_h264_fragments_total', counter, "fMP4 fragments read from the passthrough branch",
+           [({}, h264_reader.seq)])
+    yield ('insight_h264_bytes_total', counter, "fMP4 bytes read from the passthrough branch",
+           [({}, h264_reader.bytes_read)])
+    yield ('insight_h264_fragments_skipped_total', counter, "Fragments viewers skipped to resync on a keyframe",
+           [({}, h264_reader.fragments_skipped)])
+    yield ('insight_h264_viewers', gauge, "Connected /video.mp4 viewers", [({}, len(h264_reader.clients))])
+    yield ('insight_video_recording', gauge, "1 while the server records video",
+           [({}, int(video_recorder.recording))])
+    yield ('insight_video_recorder_bytes_total', counter, "Video bytes written to recordings",
+           [({}, video_recorder.bytes_written)])
+    yield ('insight_video_recorder_dropped_total', counter, "Frames not recorded because the disk fell behind",
+           [({}, video_recorder.dropped)])
+    log = log_handler.stats()
+    yield ('insight_log_records_total', counter, "Log records, by outcome",
+           [({'result': result}, log[result]) for result in ('written', 'suppressed', 'dropped')])
+    yield ('insight_snapshot_requests_total', counter, "/snapshot.jpg responses, by result",
+           [({'result': result}, count) for result, count in snapshot_counts.items()])
+    if relay_mode():
+        yield ('insight_relay_connected', gauge, "1 while the upstream Socket.IO link is up",
+               [({}, int(relay.connected))])
+        yield ('insight_relay_connects_total', counter, "Upstream connections established",
+               [({}, relay.connects)])
+        yield ('insight_relay_events_total', counter, "Relayed Socket.IO events, by direction and result",
+               [({'direction': 'down', 'result': 'received'}, relay.received),
+                ({'direction': 'up', 'result': 'forwarded'}, relay.forwarded),
+                ({'direction': 'up', 'result': 'rejected'}, relay.rejected)])
+    if fleet_mode():
+        links = list(fleet.links.items())
+        yield ('insight_fleet_rover_connected', gauge, "1 while the gateway's link to each rover is up",
+               [({'rover': rover_id}, int(link.connected)) for rover_id, link in links])
+        yield ('insight_fleet_events_total', counter, "Telemetry messages received from each rover",
+               [({'rover': rover_id}, link.received) for rover_id, link in links])
+        yield ('insight_fleet_requests_total', counter, "HTTP polls (health, snapshot) sent to each rover",
+               [({'rover': rover_id}, link.requests) for rover_id, link in links])
+        yield ('insight_fleet_batches_total', counter, "fleet_update messages sent to browsers",
+               [({}, fleet.batches)])
+    yield ('insight_socketio_queue_depth', gauge, "Packets queued for each Socket.IO client",
+           [({'sid': sid}, depth) for sid, depth in socketio_queue_depths().items()])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profile', methods=['POST'])
+def profile():
+    """Samples the running server's stacks for ?seconds= (default 10, at most
+    profiler_max_s) at ?hz= (default 100) and returns them folded, one
+    "root;frame;...;frame count" line per stack, for flamegraph.pl, inferno
+    or speedscope. Needs 'Authorization: Bearer <profiler_token>'."""
+    token = config.get('profiler_token')
+    if not token:
+        return jsonify({"status": "error", "message": "Profiler disabled: no profiler_token set"}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401, {'WWW-Authenticate': 'Bearer'}
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        hz = float(request.args.get('hz', 100))
+    except ValueError:
+        return jsonify({"status": "error"}), 400
+    if not (0 < seconds <= config.get('profiler_max_s', 30) and 0 < hz <= 1000):
+        return jsonify({"status": "error", "message": f"seconds must be in (0, {config.get('profiler_max_s', 30)}], "
+                                                      "hz in (0, 1000]"}), 400
+    if not profiler_lock.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+    try:
+        stacks, samples = profiler_pool.apply(sample_stacks, (seconds, hz))
+    finally:
+        profiler_lock.release()
+    logging.info(f"Profiled {seconds:g}s at {hz:g} Hz: {samples} samples, {len(stacks)} stacks")
+    return Response(''.join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+                    mimetype='text/plain', headers={'X-Profile-Samples': str(samples)})
+
+@app.route('/video_feed')
+def video_feed():
+    """MJPEG. ?tier=<name> picks a quality tier (default video_default_tier);
+    ?tier=auto starts there and follows the viewer's connection."""
+    if fleet_mode():
+        return jsonify({"status": "error", "message": "A fleet gateway has no video; see /fleet"}), 404
+    tier = request.args.get('tier')
+    auto = tier == 'auto'
+    if auto: tier = None
+    elif tier is not None and tier not in video_tiers():
+        return jsonify({"status": "error", "message": f"Unknown tier '{tier}'", "tiers": list(video_tiers())}), 400
+    return Response(generate_frames(tier, auto), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/video.mp4')
+def video_mp4():
+    """H.264 passthrough for Media Source Extensions players. /video_feed
+    (MJPEG) stays available for everything else."""
+    if fleet_mode() or not h264_supported(config.get('camera_mode', 'siyi')):
+        return jsonify({"status": "error", "message": "This camera backend provides no H.264 passthrough"}), 404
+    return Response(generate_fragments(), mimetype='video/mp4', headers={'Cache-Control': 'no-store'})
+
+# Snapshots never register a viewer: they read the shared latest-frame slot,
+# which readers keep after the pipeline stops, so polling doesn't start it.
+SNAPSHOT_EPOCH = format(int(time.time()), 'x') # Keeps ETags unique across server restarts
+snapshot_counts = {'served': 0, 'not_modified': 0}
+
+def latest_snapshot(tier=None):
+    """(tier, Frame) for the newest frame of `tier`, or of any tier if that
+    one has none yet. (None, None) if no frame was ever read."""
+    name = tier or default_tier()
+    frame = stream_manager.readers[name].latest if name in stream_manager.readers else None
+    if frame is None and tier is None:
+        candidates = [(r.latest.timestamp, n, r.latest) for n, r in list(stream_manager.readers.items()) if r.latest]
+        if candidates: _, name, frame = max(candidates, key=lambda c: c[0])
+    return (name, frame) if frame else (None, None)
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """The newest JPEG without opening a stream. ?tier=<name> as /video_feed;
+    ?max_age=<s> lets caches reuse a frame until it is that old (default 0:
+    revalidate every time, which costs a 304 while the frame is unchanged)."""
+    if fleet_mode():
+        return jsonify({"status": "error", "message": "A fleet gateway has no video; see /fleet"}), 404
+    tier = request.args.get('tier')
+    if tier is not None and tier not in video_tiers():
+        return jsonify({"status": "error", "message": f"Unknown tier '{tier}'", "tiers": list(video_tiers())}), 400
+    try:
+        max_age = max(0, int(request.args.get('max_age', 0)))
+    except ValueError:
+        return jsonify({"status": "error", "message": "max_age must be whole seconds"}), 400
+    name, frame = latest_snapshot(tier)
+    if frame is None:
+        return jsonify({"status": "error", "message": "No frame yet"}), 503
+    etag = f'"{SNAPSHOT_EPOCH}-{name}-{frame.seq}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'max-age={max_age}' if max_age else 'no-cache',
+        'Age': str(int(time.monotonic() - frame.timestamp)), # Frame age, so caches expire it on time
+        'X-Stream-State': stream_manager.state,
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        snapshot_counts['not_modified'] += 1
+        return Response(status=304, headers=headers)
+    snapshot_counts['served'] += 1
+    return Response(frame.jpeg, mimetype='image/jpeg', headers=headers)
+
+@app.route('/joystick_debug')
+def joystick_debug():
+    return render_template('joystick_debug.html')
+
+@socketio.on('connect')
+def handle_connect():
+    global connected_clients_count, ser
+    connected_clients_count += 1
+    if fleet_mode(): return # Browsers ask for the fleet with fleet_subscribe
+    # Default rates until the client subscribes explicitly
+    for topic, (rate, _) in TelemetryHub.TOPICS.items():
+        telemetry.subscribe(request.sid, topic, rate)
+    if relay_mode():
+        relay.sync_rates()
+        relay.replay(request.sid)
+        return
+    if ser:
+        socketio.emit('serial_status', {'status': 'connected'})
+        if connected_clients_count == 1:
+            try: ser.write(b'{"T": 131, "cmd": 1}\n')
+            except: pass
+    else:
+        socketio.emit('serial_status', {'status': 'disconnected'})
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    global connected_clients_count, ser, gimbal
+    connected_clients_count -= 1
+    telemetry.remove_client(request.sid)
+    if fleet_mode():
+        fleet.leave(request.sid)
+        return
+    if relay_mode():
+        relay.client_left(request.sid)
+        relay.sync_rates()
+        return
+    if connected_clients_count == 0:
+        control_scheduler.stop()
+        if ser:
+            try: ser.write(b'{"T": 131, "cmd": 0}\n')
+            except: pass
+        if gimbal:
+            try: gimbal.send_gimbal_speed(0, 0)
+            except: pass
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """{'imu_data': 10, 'gimbal_attitude': 2, ...}: rates in Hz, 0 to stop.
+    An optional 'encoding': 'binary' | 'json' switches all of the client's
+    topics. Acks with the rates and encoding actually granted."""
+    data = dict(data or {})
+    encoding = data.pop('encoding', None)
+    if encoding in TelemetryHub.ENCODINGS:
+        telemetry.set_encoding(request.sid, encoding)
+    granted = {}
+    for topic, rate in data.items():
+        if topic not in TelemetryHub.TOPICS: continue
+        try: granted[topic] = telemetry.subscribe(request.sid, topic, float(rate))
+        except (TypeError, ValueError): pass
+    granted['encoding'] = telemetry.encodings.get(request.sid, 'json')
+    if relay_mode(): relay.sync_rates()
+    return granted
+
+@socketio.on('claim_driver')
+def handle_claim_driver(data=None):
+    """Relay mode: asks for the control seat, {'force': true} to take it
+    from an active driver. Acks whether this client now drives. Without a
+    relay every client drives."""
+    if not relay_mode(): return {'driver': True}
+    return {'driver': relay.claim(request.sid, bool((data or {}).get('force')))}
+
+@socketio.on('fleet_subscribe')
+def handle_fleet_subscribe(data=None):
+    """Fleet mode: joins the batched fleet_update stream, starting with the
+    whole fleet. Acks with the rover ids."""
+    if not fleet_mode(): return {'rovers': []}
+    fleet.join(request.sid)
+    return {'rovers': list(fleet.links)}
+
+@socketio.on('control')
+def handle_control(data):
+    if relay_mode():
+        relay.forward(request.sid, 'control', data)
+        return
+    try: control_scheduler.set(data['L'], data['R'])
+    except (KeyError, TypeError, ValueError): pass
+
+@socketio.on('joystick_command')
+def handle_joystick(data):
+    global gimbal, servo
+    if relay_mode():
+        relay.forward(request.sid, 'joystick_command', data)
+        return
+    mode = config.get('camera_mode', 'siyi')
+    
+    yaw_val = data.get('yaw', 0.0)
+    pitch_val = data.get('pitch', 0.0)
+
+    if mode == 'siyi' and gimbal:
+        try:
+            gimbal.send_gimbal_speed(int(yaw_val*100), int(pitch_val*100))
+        except: pass
+        
+    elif mode == 'picam' and servo:
+        # The servo loop maps pitch (-1.0 to 1.0) to an angle or a tilt speed
+        try: servo_controller.set_input(pitch_val)
+        except (TypeError, ValueError): pass
+
+@socketio.on('set_arm_state')
+def handle_arm_state(data):
+    global gimbal
+    if relay_mode():
+        # Upstream records; its recording_status comes back through the relay
+        relay.forward(request.sid, 'set_arm_state', data)
+        return
+    if fleet_mode(): return # Rovers are armed from their own dashboards
+    is_armed = bool(data.get('state', False))
+    logging.info("ARMED: Starting Recording" if is_armed else "DISARMED: Stopping Recording", extra={'console': True})
+
+    # Server-side recording works in every camera mode
+    if config.get('video_record_on_arm', True):
+        if is_armed: video_recorder.start()
+        else: video_recorder.stop()
+        socketio.emit('recording_status', {'recording': video_recorder.recording, 'source': 'server'})
+
+    # The SIYI camera also records to its SD card
+    if gimbal: socketio.start_background_task(gimbal.set_recording, is_armed)
+
+def cleanup():
+    global ser, gimbal, servo
+    relay.stop()
+    for link in fleet.links.values(): link.stop()
+    stream_manager.stop(wait=True)
+    control_scheduler.stop()
+    try: recorder.flush()
+    except Exception: pass
+    video_recorder.stop()
+    try:
+        video_recorder.flush()
+        video_recorder.close()
+    except Exception: pass
+    if ser: ser.write(b'{"T": 131, "cmd": 0}\n')
+    if gimbal: gimbal.stop_motion()
+    if servo:
+        servo_controller.detach()
+        servo.close()
+
+    logging.info("🛑 Server stopping...", extra={'console': True})
+    try: log_handler.shutdown()
+    except Exception: pass
+
+# --- System Monitoring ---
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+# Raspberry Pi firmware flags: bit 0 under-voltage, 1 ARM frequency capped,
+# 2 throttled, 3 soft temperature limit; bits 16-19 the same, since boot
+THROTTLED_PATH = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+CPU_FREQ_PATH = '/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq'
+
+def read_proc(path):
+    """A /proc or /sys file's text, or None if it doesn't exist here."""
+    try:
+        with open(path) as f: return f.read()
+    except OSError: return None
+
+def get_cpu_temp():
     try:
         with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
             temp = float(f.read()) / 1000.0
             return temp
     except Exception as e:
-        logging.error(f"Error reading temp: {e}")
+        logging.error(f"Error reading temp: {e}", extra={'key': 'cpu_temp'})
         return 0.0 # Fallback/Mock
 
+class SystemMonitor:
+    """Builds the system_data topic from /proc and /sys: CPU per core and in
+    total, frequency and throttling, memory, load, CPU/RSS of the video
+    pipeline and of this process, OS threads and greenlets.
+
+    A sample is a few small procfs reads. Values are rounded so the JSON
+    rooms' deltas only carry real changes. Counting greenlets walks the GC
+    heap, so it is refreshed only every `monitor_greenlet_s`. Missing sources
+    (no Pi firmware, no pipeline) are None.
+    """
+
+    def __init__(self):
+        self.cpu_times = None # [(busy, total)] jiffies: all cores, then each
+        self.process_times = {} # pid -> (cpu ticks, monotonic)
+        self.greenlets = None
+        self.greenlets_time = None
+
+    def _cpu(self):
+        times = []
+        for line in (read_proc('/proc/stat') or '').splitlines():
+            if not line.startswith('cpu'): break
+            values = [int(v) for v in line.split()[1:9]] # user .. steal
+            idle = values[3] + values[4] # idle + iowait
+            times.append((sum(values) - idle, sum(values)))
+        previous, self.cpu_times = self.cpu_times, times
+        if not previous or len(previous) != len(times): return None, None
+        percent = [round(100 * (busy - last_busy) / (total - last_total)) if total > last_total else 0
+                   for (busy, total), (last_busy, last_total) in zip(times, previous)]
+        return percent[0], percent[1:]
+
+    def _process(self, pid, now, seen):
+        """(CPU % since the previous sample, RSS MB) of a process."""
+        stat, statm = read_proc(f'/proc/{pid}/stat'), read_proc(f'/proc/{pid}/statm')
+        if not stat or not statm: return None, None
+        fields = stat.rsplit(')', 1)[1].split()
+        ticks = int(fields[11]) + int(fields[12]) # utime + stime
+        seen[pid] = (ticks, now)
+        previous = self.process_times.get(pid)
+        cpu = None
+        if previous and now > previous[1]:
+            cpu = round(100 * (ticks - previous[0]) / CLOCK_TICKS / (now - previous[1]))
+        return cpu, round(int(statm.split()[1]) * PAGE_SIZE / 2**20, 1)
+
+    def _memory(self):
+        info = {}
+        for line in (read_proc('/proc/meminfo') or '').splitlines():
+            name, _, value = line.partition(':')
+            if name in ('MemTotal', 'MemAvailable'): info[name] = int(value.split()[0]) # kB
+        if len(info) < 2: return None, None
+        return round(100 * (1 - info['MemAvailable'] / info['MemTotal'])), info['MemAvailable'] // 1024
+
+    def _greenlet_count(self, now):
+        if self.greenlets_time is None or now - self.greenlets_time >= config.get('monitor_greenlet_s', 10):
+            self.greenlets = sum(1 for o in gc.get_objects() if isinstance(o, greenlet.greenlet))
+            self.greenlets_time = now
+        return self.greenlets
+
+    def sample(self):
+        now = time.monotonic()
+        cpu, cores = self._cpu()
+        seen = {}
+        pipeline = stream_manager.process
+        gst_cpu, gst_rss = self._process(pipeline.pid, now, seen) if pipeline else (None, None)
+        proc_cpu, proc_rss = self._process('self', now, seen)
+        self.process_times = seen # Forget exited pipelines
+        mem_percent, mem_available = self._memory()
+        throttled = read_proc(THROTTLED_PATH)
+        freq = read_proc(CPU_FREQ_PATH)
+        load = read_proc('/proc/loadavg')
+        try: threads = len(os.listdir('/proc/self/task'))
+        except OSError: threads = None
+        return {
+            'cpu_temp': round(get_cpu_temp(), 1),
+            'cpu_percent': cpu,
+            'cpu_cores': cores,
+            'cpu_mhz': int(freq) // 1000 if freq else None,
+            'throttled': int(throttled, 16) if throttled else None,
+            'mem_percent': mem_percent,
+            'mem_available_mb': mem_available,
+            'load1': float(load.split()[0]) if load else None,
+            'gst_cpu': gst_cpu,
+            'gst_rss_mb': gst_rss,
+            'proc_cpu': proc_cpu,
+            'proc_rss_mb': proc_rss,
+            'threads': threads,
+            'greenlets': self._greenlet_count(now),
+        }
+
 def system_monitor_thread():
+    # Sample at the fastest subscribable rate, and only while someone listens
+    interval = 1.0 / TelemetryHub.TOPICS['system_data'][1]
+    monitor = SystemMonitor()
+    while True:
+        if telemetry.wants('system_data'):
+            telemetry.publish('system_data', monitor.sample())
+        socketio.sleep(interval)
+
+# --- Profiler ---
+# Wall-clock stack sampling from a native thread. Greenlets share the main
+# thread, so its stack is whichever greenlet holds the CPU at that moment, or
+# the hub's loop when the server is idle. io_pool's OS threads are sampled too.
+MAIN_THREAD_ID = monkey.get_original('_thread', 'get_ident')()
+profiler_pool = ThreadPool(1)
+profiler_lock = threading.Lock() # One profile at a time
+
+def frame_label(frame):
+    code = frame.f_code
+    # ';' separates frames in the folded format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+def sample_stacks(seconds, hz):
+    """Samples every other thread's stack `hz` times a second for `seconds`.
+    Returns ({folded stack: count}, samples). Runs in profiler_pool, so it
+    sleeps natively rather than through gevent."""
+    sleep = monkey.get_original('time', 'sleep')
+    me = monkey.get_original('_thread', 'get_ident')()
+    stacks = collections.Counter()
+    interval = 1.0 / hz
+    next_time = time.monotonic()
+    deadline = next_time + seconds
+    samples = 0
+    while next_time < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me: continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append('main' if ident == MAIN_THREAD_ID else f'thread-{ident}')
+            stacks[';'.join(reversed(labels))] += 1
+        samples += 1
+        next_time += interval
+        delay = next_time - time.monotonic()
+        if delay > 0: sleep(delay)
+    return stacks, samples
+
+def stats_publisher_thread():
+    """Publishes the 'stats' topic: p99 latencies (ms, bucket upper bounds)
+    and rates over the last interval, plus current queue depths."""
+    interval = 1.0 / TelemetryHub.TOPICS['stats'][1]
+    paths = {
+        'control_p99_ms': rover_write_latency,
+        'gimbal_p99_ms': gimbal_write_latency,
+        'telemetry_p99_ms': telemetry_emit_latency,
+        'video_p99_ms': video_write_latency,
+    }
+    snapshots = {name: list(hist.counts) for name, hist in paths.items()}
+    last = (time.monotonic(), 0, 0, 0, 0)
     while True:
-        temp = get_cpu_temp()
-        socketio.emit('system_data', {'cpu_temp': temp})
-        socketio.sleep(2)
+        socketio.sleep(interval)
+        now = time.monotonic()
+        rx = gimbal.framer.packets if gimbal else 0
+        tx = gimbal.tx_packets if gimbal else 0
+        current = (now, serial_ingest.lines, rx, tx, stream_manager.frames)
+        if not telemetry.wants('stats'):
+            snapshots = {name: list(hist.counts) for name, hist in paths.items()}
+            last = current
+            continue
+        elapsed = now - last[0]
+        # The framer is replaced on reconnect, so its count can go backwards
+        rate = lambda i: round(max(0, current[i] - last[i]) / elapsed, 1)
+        data = {'serial_lines_hz': rate(1), 'gimbal_rx_hz': rate(2),
+                'gimbal_tx_hz': rate(3), 'video_fps': rate(4)}
+        for name, hist in paths.items():
+            p99 = hist.quantile(0.99, snapshots[name])
+            data[name] = None if p99 is None else p99 * 1000
+            snapshots[name] = list(hist.counts)
+        depths = socketio_queue_depths()
+        readers = list(stream_manager.readers.values())
+        lags = [r.seq - client.last_seq for r in readers for client in list(r.clients)]
+        data.update({
+            'socket_queue_max': max(depths.values(), default=0),
+            'viewers': len(lags),
+            'viewer_lag_max': max(lags, default=0),
+            'frames_skipped': sum(r.frames_skipped for r in readers),
+            'malformed_frames': sum(r.malformed_frames for r in readers),
+            'gimbal_dropped': gimbal.dropped_packets if gimbal else 0,
+        })
+        telemetry.publish('stats', data, now)
+        last = current
 
 def read_serial_thread():
-    global ser
-    last_emit = 0
+    """Sleeps until the port is readable, then takes everything buffered in
+    one read, so a quiet rover costs no wakeups."""
     while True:
         try:
-            if ser and ser.in_waiting > 0:
-                # Read line with error ignoring
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                
-                # Robust Extraction: Find first '{' and last '}'
-                start = line.find('{')
-                end = line.rfind('}')
-                
-                if start != -1 and end != -1 and end > start:
-                    json_str = line[start:end+1]
-                    
-                    # Rate Limit: Max 10Hz (0.1s)
-                    now = time.time()
-                    if now - last_emit > 0.1:
-                        try:
-                            data = json.loads(json_str)
-                            socketio.emit('imu_data', data)
-                            last_emit = now
-                            # Debug Success (throttled)
-                            if int(now) % 5 == 0: logging.info("✅ Valid IMU Data")
-                        except json.JSONDecodeError:
-                            logging.warning(f"Invalid JSON from serial: {json_str}")
-                else:
-                    # Debug: Log ignored lines to see what's coming in
-                    if line: logging.info(f"IGNORED SERIAL: {line}")
-
-            else:
-                socketio.sleep(0.01)
+            if not ser:
+                socketio.sleep(1)
+                continue
+            try:
+                wait_read(ser.fileno(), timeout=1.0)
+            except socket.timeout:
+                continue
+            data = ser.read(ser.in_waiting or 1)
+            if data: serial_ingest.feed(data, time.monotonic())
         except Exception as e:
             logging.error(f"Serial thread error: {e}")
             socketio.sleep(1) # Prevent tight loop on error
 
 if __name__ == '__main__':
     atexit.register(cleanup)
-    signal.signal(signal.SIGTERM, lambda s, f: cleanup())
+    # Stop serving and let atexit clean up. The handler itself runs in the hub
+    # and must not block, so the stop gets its own greenlet.
+    gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(socketio.stop))
     
     load_config()
-    init_servo()
-    
-    if init_serial():
-        socketio.start_background_task(read_serial_thread)
+    setup_logging()
+    socketio.start_background_task(log_handler.run)
+
+    # Every subsystem comes up concurrently while the web server is already
+    # serving; /healthz reports which ones are ready
+    socketio.start_background_task(readiness.run)
+    if relay_mode():
+        relay.start(config['relay_upstream']) # Rover hardware is upstream's
+    elif fleet_mode():
+        fleet.start()
+    else:
+        socketio.start_background_task(serial_bringup)
+        socketio.start_background_task(init_servo) # pigpiod can take a while to answer
+    socketio.start_background_task(camera_bringup)
+    socketio.start_background_task(stream_manager.monitor_loop)
+
+    socketio.start_background_task(control_scheduler.run)
+    socketio.start_background_task(servo_controller.run)
+    socketio.start_background_task(recorder.run)
+    socketio.start_background_task(video_recorder.run)
     
-    socketio.start_background_task(system_monitor_thread) # Start monitoring
+    socketio.start_background_task(stats_publisher_thread)
+    if local_hardware(): # Relays get these from upstream; gateways serve none
+        socketio.start_background_task(system_monitor_thread) # Start monitoring
+        socketio.start_background_task(vehicle_state.run)
     
-    try:
-        gimbal = SiyiTCPProtocol(GIMBAL_IP, GIMBAL_PORT)
-        if gimbal.connect():
-            gimbal.request_attitude_stream()
-            socketio.start_background_task(gimbal.receive_loop)
-            socketio.start_background_task(heartbeat_loop, gimbal)
-    except: gimbal = None
-
-    # Startup Delay to ensure camera/system is ready
-    print("⏳ Waiting for system to stabilize...")
-    time.sleep(5) # Increased to 5s for Pi Camera
-
-    start_streamer()
-    print("🚀 Server started at http://0.0.0.0:5000")
+        # Connects (and reconnects) in the background
+        if config.get('gimbal_backend') == 'sim':
+            import sim
+            simulators['gimbal'] = sim.SiyiEmulator().start()
+            gimbal = SiyiTCPProtocol('127.0.0.1', simulators['gimbal'].port)
+        else:
+            gimbal = SiyiTCPProtocol(config.get('gimbal_ip', GIMBAL_IP), config.get('gimbal_port', GIMBAL_PORT))
+        gimbal.start()
+
+    port = config.get('http_port', 5000)
+    logging.info(f"🚀 Server started at http://0.0.0.0:{port}", extra={'console': True})
     
     try:
-        socketio.run(app, host='0.0.0.0', port=5000)
+        socketio.run(app, host='0.0.0.0', port=port)
     except Exception as e:
-        logging.critical(f"CRITICAL SERVER CRASH: {e}")
-        print(f"🔥 CRITICAL SERVER CRASH: {e}")
+        logging.critical(f"🔥 CRITICAL SERVER CRASH: {e}", extra={'console': True})
         raise e
\ No newline at end of file
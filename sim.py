@@ -0,0 +1,387 @@
+# Hardware-free stand-ins for the rover, the SIYI gimbal and the camera.
+#
+# server.py uses these when config.json selects a "sim" backend, and each one
+# can also run on its own so benchmarks can drive a server from outside:
+#
+#   python sim.py rover --rate 50          # prints the pty path to use as serial_port
+#   python sim.py siyi --port 37260        # SIYI TCP protocol on localhost
+#   python sim.py mjpeg --fps 30           # multipart MJPEG on stdout, like gst-launch
+#   python sim.py mjpeg --h264-fd 3        # ...plus fragmented MP4 on fd 3, like the siyi tee
+#   python sim.py mjpeg --out 4:30:30000 --out 5:10:6000   # quality tiers: fd:fps:bytes
+
+import argparse
+import base64
+import binascii
+import collections
+import json
+import math
+import os
+import pty
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import tty
+
+# 64x36 test card. Frames are padded up to a realistic size with JPEG comment
+# segments, which also carry the frame number and send time for latency checks.
+SYNTHETIC_JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABQODxIPDRQSEBIXFRQYHjIhHhwcHj0sLiQySUBMS0dA'
+    'RkVQWnNiUFVtVkVGZIhlbXd7gYKBTmCNl4x9lnN+gXz/2wBDARUXFx4aHjshITt8U0ZTfHx8fHx8'
+    'fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHx8fHz/wAARCAAkAEADASIA'
+    'AhEBAxEB/8QAGAABAQEBAQAAAAAAAAAAAAAAAwIABAX/xAAhEAADAQEAAAYDAAAAAAAAAAAAAQID'
+    'BBESMTNzslFSYf/EABYBAQEBAAAAAAAAAAAAAAAAAAMEAv/EABURAQEAAAAAAAAAAAAAAAAAAAAB'
+    '/9oADAMBAAIRAxEAPwDxZLkiS5K6GEkSQ5O2cMIxyvbbSa0l14TkmkvM16+ZfgOkgpEkXPDm0805'
+    '7aulFUlWSSfgm/2/gUh1uLkSQ5EkOkjxZLkiS5LKkhJOzo9jj+F/ezjk6suvpyhRn0axC9Jm2kg6'
+    'SF4fer4tPpRElvt6rlzXTtUteDT0bTIkOtxciSHIkh0keLJcmMWVJCSJJjB0kJIkmMHW4uRJMYOk'
+    'j//Z'
+)
+
+SIM_COMMENT_PREFIX = b'insight-sim '
+
+def synthetic_frame(seq, size=30000):
+    """A valid JPEG of roughly `size` bytes tagged with `seq` and time.time()."""
+    tag = SIM_COMMENT_PREFIX + b'seq=%d t=%.6f' % (seq, time.time())
+    segments = [b'\xff\xfe' + struct.pack('>H', len(tag) + 2) + tag]
+    padding = size - len(SYNTHETIC_JPEG) - len(segments[0])
+    while padding > 4:
+        chunk = min(padding - 4, 65533)
+        segments.append(b'\xff\xfe' + struct.pack('>H', chunk + 2) + b'\x00' * chunk)
+        padding -= chunk + 4
+    # Comment segments go right after SOI
+    return SYNTHETIC_JPEG[:2] + b''.join(segments) + SYNTHETIC_JPEG[2:]
+
+def parse_frame_tag(jpeg):
+    """Returns (seq, send_time) from a synthetic frame, or None."""
+    idx = jpeg.find(SIM_COMMENT_PREFIX)
+    if idx < 0: return None
+    try:
+        end = jpeg.index(b'\xff', idx)
+        fields = dict(f.split(b'=') for f in bytes(jpeg[idx + len(SIM_COMMENT_PREFIX):end]).split())
+        return int(fields[b'seq']), float(fields[b't'])
+    except (ValueError, KeyError):
+        return None
+
+# --- Fragmented MP4 ---
+# Structurally valid ISO BMFF boxes around placeholder H.264: enough for the
+# server's fragment parsing and fan-out, not for a real decoder.
+def mp4_box(kind, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I', 8 + len(data)) + kind + data
+
+def mp4_full_box(kind, version, flags, *payloads):
+    return mp4_box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+def mp4_init_segment(width=640, height=360, timescale=90000):
+    """ftyp + moov for one avc1 track (Constrained Baseline, level 3.0)."""
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    avcc = mp4_box(b'avcC', bytes([1, 0x42, 0xC0, 0x1E, 0xFF, 0xE1]),
+                   struct.pack('>H', 4), b'\x67\x42\xC0\x1E', # SPS
+                   b'\x01', struct.pack('>H', 4), b'\x68\xCE\x3C\x80') # PPS
+    avc1 = mp4_box(b'avc1', b'\x00' * 6, struct.pack('>H', 1), b'\x00' * 16,
+                   struct.pack('>HHIIIH', width, height, 0x480000, 0x480000, 0, 1),
+                   b'\x00' * 32, struct.pack('>Hh', 0x18, -1), avcc)
+    empty_table = struct.pack('>I', 0)
+    stbl = mp4_box(b'stbl', mp4_full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+                   mp4_full_box(b'stts', 0, 0, empty_table), mp4_full_box(b'stsc', 0, 0, empty_table),
+                   mp4_full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)), mp4_full_box(b'stco', 0, 0, empty_table))
+    dinf = mp4_box(b'dinf', mp4_full_box(b'dref', 0, 0, struct.pack('>I', 1), mp4_full_box(b'url ', 0, 1)))
+    minf = mp4_box(b'minf', mp4_full_box(b'vmhd', 0, 1, b'\x00' * 8), dinf, stbl)
+    mdia = mp4_box(b'mdia', mp4_full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, 0, 0x55C4, 0)),
+                   mp4_full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00'), minf)
+    tkhd = mp4_full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0), b'\x00' * 8,
+                        struct.pack('>hhhH', 0, 0, 0, 0), matrix, struct.pack('>II', width << 16, height << 16))
+    mvhd = mp4_full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, 0),
+                        struct.pack('>IH', 0x10000, 0x100), b'\x00' * 10, matrix, b'\x00' * 24, struct.pack('>I', 2))
+    mvex = mp4_box(b'mvex', mp4_full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0)))
+    moov = mp4_box(b'moov', mvhd, mp4_box(b'trak', tkhd, mdia), mvex)
+    return mp4_box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso6avc1mp41') + moov
+
+def mp4_fragment(seq, decode_time, duration, key, size):
+    """moof + mdat holding one sample of `size` bytes, tagged like synthetic_frame."""
+    tag = SIM_COMMENT_PREFIX + b'seq=%d t=%.6f ' % (seq, time.time())
+    sample = struct.pack('>I', size - 4) + b'\x65' + tag + b'\x00' * max(0, size - 5 - len(tag))
+    sample_flags = 0x02000000 if key else 0x01010000 # depends-on-others / non-sync
+    def moof(data_offset):
+        trun = mp4_full_box(b'trun', 0, 0x001 | 0x004 | 0x100 | 0x200,
+                            struct.pack('>IiIII', 1, data_offset, sample_flags, duration, len(sample)))
+        traf = mp4_box(b'traf', mp4_full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1)),
+                       mp4_full_box(b'tfdt', 1, 0, struct.pack('>Q', decode_time)), trun)
+        return mp4_box(b'moof', mp4_full_box(b'mfhd', 0, 0, struct.pack('>I', seq)), traf)
+    header = moof(0)
+    return moof(len(header) + 8) + mp4_box(b'mdat', sample)
+
+def write_some(fd, data):
+    """Writes what a non-blocking pipe takes; returns the rest."""
+    try: return data[os.write(fd, data):]
+    except BlockingIOError: return data
+
+def run_mjpeg(fps=30, size=30000, outputs=None, h264=None, gop=30):
+    """Writes frames in the same multipartmux framing gst-launch produces.
+
+    `outputs` is a list of (binary file, fps, frame bytes), one per quality
+    tier, each decimated from the `fps` camera clock; the default is stdout at
+    full rate. With `h264`, one fMP4 fragment per camera frame goes there.
+    Frames carry the camera frame number, so decimated tiers skip numbers.
+
+    Like a gst tier branch behind a leaky queue, an output whose reader
+    stops draining it drops frames until its pipe has room again, without
+    holding up the other outputs.
+    """
+    outputs = outputs or [(sys.stdout.buffer, fps, size)]
+    for out, _, _ in outputs: os.set_blocking(out.fileno(), False)
+    pending = [b''] * len(outputs) # Rest of a part the pipe had no room for
+    interval = 1.0 / fps
+    next_time = time.monotonic()
+    seq = 0
+    if h264:
+        h264.write(mp4_init_segment())
+        h264.flush()
+    while True:
+        seq += 1
+        for i, (out, out_fps, out_size) in enumerate(outputs):
+            if pending[i]: pending[i] = write_some(out.fileno(), pending[i])
+            if int(seq * out_fps / fps) == int((seq - 1) * out_fps / fps): continue
+            if pending[i]: continue
+            jpeg = synthetic_frame(seq, out_size)
+            pending[i] = write_some(out.fileno(), b'\r\n----frame\r\nContent-Type: image/jpeg\r\n'
+                                    b'Content-Length: %d\r\n\r\n' % len(jpeg) + jpeg)
+        if h264:
+            duration = int(90000 / fps)
+            h264.write(mp4_fragment(seq, (seq - 1) * duration, duration, (seq - 1) % gop == 0, size // 4))
+            h264.flush()
+        next_time += interval
+        delay = next_time - time.monotonic()
+        while delay > 0:
+            # A blocked sink finishes its part as soon as the pipe has room
+            blocked = [out.fileno() for (out, _, _), rest in zip(outputs, pending) if rest]
+            if not blocked:
+                time.sleep(delay)
+                break
+            _, ready, _ = select.select([], blocked, [], delay)
+            for i, (out, _, _) in enumerate(outputs):
+                if out.fileno() in ready: pending[i] = write_some(out.fileno(), pending[i])
+            delay = next_time - time.monotonic()
+        if delay < -1.0: next_time = time.monotonic() # Resumed from SIGSTOP: don't burst
+
+# --- Rover ---
+class RoverEmulator:
+    """Pretends to be the rover MCU on a pseudo-terminal.
+
+    Streams IMU JSON lines at `rate_hz` and records every command line it
+    receives, turning L/R motor commands into a yaw rate.
+    """
+
+    def __init__(self, rate_hz=50):
+        self.rate_hz = rate_hz
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.commands = collections.deque(maxlen=10000) # (time.time(), line)
+        self.command_count = 0
+        self.samples_sent = 0
+        self.left = self.right = 0.0
+        self.yaw = 0.0
+        self.voltage = 12.6
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _sample(self, t):
+        return {
+            'T': 1001,
+            'roll': round(3 * math.sin(t * 0.7), 2),
+            'pitch': round(2 * math.sin(t * 0.5), 2),
+            'yaw': round(self.yaw, 2),
+            'voltage': round(self.voltage, 2),
+            'battery_percent': round(max(0.0, min(100.0, (self.voltage - 10.5) / 2.1 * 100)), 1),
+        }
+
+    def _handle_line(self, line):
+        self.commands.append((time.time(), line))
+        self.command_count += 1
+        try:
+            cmd = json.loads(line)
+        except ValueError:
+            return
+        if isinstance(cmd, dict) and cmd.get('T') == 1:
+            self.left, self.right = float(cmd.get('L', 0)), float(cmd.get('R', 0))
+
+    def _run(self):
+        interval = 1.0 / self.rate_hz
+        next_emit = time.monotonic()
+        pending = b''
+        while self.running:
+            now = time.monotonic()
+            readable, _, _ = select.select([self.master], [], [], max(0, next_emit - now))
+            if readable:
+                pending += os.read(self.master, 4096)
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    if line.strip(): self._handle_line(line)
+            now = time.monotonic()
+            if now >= next_emit:
+                self.yaw = (self.yaw + (self.left - self.right) * 90 * interval) % 360
+                self.voltage = max(10.5, self.voltage - 0.00001)
+                os.write(self.master, json.dumps(self._sample(now)).encode() + b'\n')
+                self.samples_sent += 1
+                next_emit += interval
+                if now - next_emit > 1.0: next_emit = now # Don't burst after a stall
+
+    def stats(self):
+        return {'port': self.port, 'samples_sent': self.samples_sent,
+                'commands': self.command_count, 'motors': (self.left, self.right)}
+
+# --- SIYI gimbal ---
+# data_freq codes of command 0x25
+SIYI_STREAM_RATES = {0: 0, 1: 2, 2: 4, 3: 5, 4: 10, 5: 20, 6: 50, 7: 100}
+
+def siyi_packet(cmd_id, data=b'', seq=0):
+    packet = b'\x55\x66\x02' + struct.pack('<HHB', len(data), seq, cmd_id) + data
+    return packet + struct.pack('<H', binascii.crc_hqx(packet, 0))
+
+class SiyiEmulator:
+    """A local SIYI gimbal on 127.0.0.1 speaking the 0x55 0x66 TCP framing.
+
+    Answers attitude stream requests (0x25), speed commands (0x07), the
+    configuration query (0x0A) and record toggles (0x0C), and records every
+    command it receives.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.host, self.port = self.server.getsockname()
+        self.commands = collections.deque(maxlen=10000) # (time.time(), cmd_id, payload)
+        self.command_count = 0
+        self.crc_errors = 0
+        self.connections = 0
+        self.yaw = self.pitch = 0.0
+        self.yaw_speed = self.pitch_speed = 0
+        self.recording = False
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while self.running:
+            conn, _ = self.server.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn, cmd_id, seq, payload):
+        self.commands.append((time.time(), cmd_id, payload))
+        self.command_count += 1
+        if cmd_id == 0x07 and len(payload) >= 2:
+            self.yaw_speed, self.pitch_speed = struct.unpack_from('<bb', payload)
+        elif cmd_id == 0x0C and payload[:1] == b'\x02':
+            self.recording = not self.recording
+        elif cmd_id == 0x0A:
+            conn.sendall(siyi_packet(0x0A, bytes([0, 0, 0, int(self.recording), 3, 1, 0]), seq))
+        elif cmd_id == 0x01:
+            conn.sendall(siyi_packet(0x01, struct.pack('<III', 0x030101, 0x030101, 0x030101), seq))
+
+    def _serve(self, conn):
+        buf = b''
+        stream_interval = 0
+        next_attitude = time.monotonic()
+        last = time.monotonic()
+        try:
+            while self.running:
+                timeout = max(0, next_attitude - time.monotonic()) if stream_interval else 0.5
+                readable, _, _ = select.select([conn], [], [], timeout)
+                if readable:
+                    data = conn.recv(4096)
+                    if not data: return
+                    buf += data
+                    while True:
+                        start = buf.find(b'\x55\x66')
+                        if start < 0 or len(buf) - start < 10:
+                            buf = buf[start:] if start >= 0 else b''
+                            break
+                        length = 10 + struct.unpack_from('<H', buf, start + 3)[0]
+                        if len(buf) - start < length:
+                            buf = buf[start:]
+                            break
+                        packet, buf = buf[start:start + length], buf[start + length:]
+                        if binascii.crc_hqx(packet[:-2], 0) != struct.unpack_from('<H', packet, length - 2)[0]:
+                            self.crc_errors += 1
+                            continue
+                        seq, cmd_id = struct.unpack_from('<HB', packet, 5)
+                        if cmd_id == 0x25 and len(packet) >= 12:
+                            rate = SIYI_STREAM_RATES.get(packet[9], 0)
+                            stream_interval = 1.0 / rate if rate else 0
+                            next_attitude = time.monotonic()
+                        self._handle(conn, cmd_id, seq, packet[8:-2])
+                now = time.monotonic()
+                self.yaw = (self.yaw + self.yaw_speed * 0.5 * (now - last) + 180) % 360 - 180
+                self.pitch = max(-90.0, min(25.0, self.pitch + self.pitch_speed * 0.5 * (now - last)))
+                last = now
+                if stream_interval and now >= next_attitude:
+                    data = struct.pack('<hhhhhh', int(self.yaw * 10), int(self.pitch * 10), 0,
+                                       self.yaw_speed * 5, self.pitch_speed * 5, 0)
+                    conn.sendall(siyi_packet(0x0D, data))
+                    next_attitude += stream_interval
+                    if now - next_attitude > 1.0: next_attitude = now
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'port': self.port, 'connections': self.connections, 'commands': self.command_count,
+                'crc_errors': self.crc_errors, 'recording': self.recording,
+                'speed': (self.yaw_speed, self.pitch_speed)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Hardware-free stand-ins for the Insight rover")
+    sub = parser.add_subparsers(dest='backend', required=True)
+    rover = sub.add_parser('rover', help="IMU-streaming rover on a pty")
+    rover.add_argument('--rate', type=float, default=50)
+    siyi = sub.add_parser('siyi', help="SIYI gimbal TCP emulator")
+    siyi.add_argument('--port', type=int, default=37260)
+    mjpeg = sub.add_parser('mjpeg', help="multipart MJPEG on stdout")
+    mjpeg.add_argument('--fps', type=float, default=30)
+    mjpeg.add_argument('--size', type=int, default=30000, help="bytes per frame")
+    mjpeg.add_argument('--out', action='append', metavar='FD:FPS:BYTES',
+                       help="write a tier to this fd instead of stdout (repeatable)")
+    mjpeg.add_argument('--h264-fd', type=int, help="also write fragmented MP4 to this fd")
+    args = parser.parse_args()
+
+    if args.backend == 'mjpeg':
+        h264 = os.fdopen(args.h264_fd, 'wb') if args.h264_fd is not None else None
+        outputs = []
+        for spec in args.out or []:
+            fd, fps, size = spec.split(':')
+            outputs.append((os.fdopen(int(fd), 'wb'), min(float(fps), args.fps), int(size)))
+        try: run_mjpeg(args.fps, args.size, outputs, h264=h264)
+        except (BrokenPipeError, KeyboardInterrupt): pass
+        return
+
+    if args.backend == 'rover':
+        emulator = RoverEmulator(args.rate).start()
+        print(f"Rover emulator on {emulator.port}", flush=True)
+    else:
+        emulator = SiyiEmulator(port=args.port).start()
+        print(f"SIYI emulator on {emulator.host}:{emulator.port}", flush=True)
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(emulator.stats()), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
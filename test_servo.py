@@ -0,0 +1,102 @@
+# ServoController against gpiozero's mock pins: python -m pytest -q
+import pytest
+
+gpiozero = pytest.importorskip('gpiozero')
+from gpiozero import AngularServo
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+import server
+
+DT = 0.02 # 50 Hz
+
+@pytest.fixture
+def servo_config(monkeypatch):
+    config = {'servo_mode': 'position', 'servo_max_speed_dps': 180, 'servo_max_accel_dps2': 720,
+              'servo_resolution_deg': 0.5, 'control_deadman_s': 0.5}
+    monkeypatch.setattr(server, 'config', config)
+    return config
+
+@pytest.fixture
+def controller(servo_config):
+    servo = AngularServo(17, min_angle=-server.SERVO_RANGE, max_angle=server.SERVO_RANGE,
+                         pin_factory=MockFactory(pin_class=MockPWMPin))
+    controller = server.ServoController()
+    controller.attach(servo)
+    yield controller
+    controller.detach()
+    servo.close()
+
+def run(controller, seconds):
+    """Ticks for `seconds`, returning (position, velocity) after each tick."""
+    samples = []
+    for _ in range(round(seconds / DT)):
+        controller._tick(DT)
+        samples.append((controller.position, controller.velocity))
+    return samples
+
+def test_position_mode_reaches_target(controller):
+    controller.set_input(0.5)
+    assert controller.target == 45
+    run(controller, 1)
+    assert controller.position == 45 and controller.velocity == 0
+    assert controller.servo.angle == pytest.approx(45, abs=0.5)
+
+def test_speed_and_accel_limits(controller, servo_config):
+    controller.set_input(1.0)
+    samples = [(0.0, 0.0)] + run(controller, 2)
+    positions, velocities = zip(*samples)
+    speeds = [(b - a) / DT for a, b in zip(positions, positions[1:])]
+    assert max(speeds) == pytest.approx(servo_config['servo_max_speed_dps'])
+    assert max(speeds) <= servo_config['servo_max_speed_dps'] + 1e-9
+    step = servo_config['servo_max_accel_dps2'] * DT
+    arrived = positions.index(90)
+    changes = [abs(b - a) for a, b in zip(velocities[:arrived], velocities[1:arrived])]
+    assert max(changes) <= step + 1e-9
+    # The tick that lands on the target stops from under two braking steps
+    assert velocities[arrived - 1] < 2 * step
+    assert positions[-1] == 90 and velocities[-1] == 0
+
+def test_no_accel_limit_moves_at_full_speed(controller, servo_config):
+    servo_config['servo_max_accel_dps2'] = 0
+    controller.set_input(1.0)
+    controller._tick(DT)
+    assert controller.position == pytest.approx(servo_config['servo_max_speed_dps'] * DT)
+
+def test_rate_mode_integrates_speed(controller, servo_config):
+    servo_config.update(servo_mode='rate', servo_max_speed_dps=60, servo_max_accel_dps2=0)
+    controller.set_input(0.5)
+    assert controller.target == 0 # Rate mode moves the target over time
+    run(controller, 1)
+    assert controller.target == pytest.approx(30)
+    controller.set_input(0.0)
+    run(controller, 0.2)
+    assert controller.position == pytest.approx(30)
+
+def test_rate_mode_deadman_stops(controller, servo_config, monkeypatch):
+    servo_config.update(servo_mode='rate', servo_max_accel_dps2=0)
+    controller.set_input(1.0)
+    controller.last_input_time -= 1 # No input for longer than control_deadman_s
+    controller._tick(DT)
+    assert controller.input == 0 and controller.target == 0
+
+def test_unchanged_output_not_rewritten(controller):
+    pin = controller.servo.pwm_device.pin
+    controller.set_input(0.25)
+    run(controller, 2)
+    writes, states = controller.writes, len(pin.states)
+    run(controller, 1)
+    assert controller.writes == writes
+    assert len(pin.states) == states
+    assert controller.skipped >= 50
+
+def test_small_steps_skipped_but_target_written(controller, servo_config):
+    servo_config.update(servo_mode='rate', servo_max_speed_dps=1, servo_max_accel_dps2=0)
+    controller.set_input(1.0) # 0.02 degrees per tick, under servo_resolution_deg
+    controller._tick(DT)
+    assert controller.writes == 1 # The first write always goes out
+    run(controller, 0.2)
+    assert controller.writes == 1 and controller.skipped == 10
+    servo_config['servo_mode'] = 'position'
+    controller.set_input(0.001) # Target 0.09 degrees: within the resolution, still written exactly
+    run(controller, 0.2)
+    assert controller.last_written == controller.target